@@ -12,20 +12,30 @@ from telegram.ext import (
 )
 from httpx import ConnectError
 import pandas as pd
+import numpy as np
 import datetime
 import json
+import hashlib
 import os
 import locale
 import re # Для перевірки формату ID
 import logging # Для журналу
 import configparser
-from functools import wraps
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps, partial
+from bisect import bisect_right
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+import google_auth_httplib2
+import httplib2
 import asyncio # Якщо ви ще не імпортували для асинхронності
 from pytz import timezone # pip install pytz
 from scipy import stats
+import daily_sheets_sync
+import broadcast
 
 DEBUG = False
 is_bot_in_group = True
@@ -75,9 +85,22 @@ SERVICE_ACCOUNT_SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 SHEETS_SERVICE = None
 CREDS = None
 
+# Виклики Google Sheets з асинхронних обробників виконуються в обмеженому пулі потоків,
+# щоб не блокувати event loop. Розмір пулу = максимальна кількість одночасних запитів.
+SHEETS_MAX_CONCURRENCY = 4
+SHEETS_HTTP_TIMEOUT_SECONDS = 30   # Таймаут сокета для одного HTTP запиту
+SHEETS_CALL_TIMEOUT_SECONDS = 60   # Загальний таймаут очікування виклику в обробнику
+_sheets_executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_CONCURRENCY, thread_name_prefix="sheets")
+_sheets_thread_local = threading.local()
+
 # Глобальний DataFrame
 queue_df = None
 
+# Знімок моделі прогнозу, який оновлює фонове завдання refresh_prediction_data
+PREDICTION_MODEL = None
+# Частіше за TTL синхронізації, щоб не пропускати цикл через кеш, який ще "свіжий" на кілька секунд
+PREDICTION_REFRESH_INTERVAL_MINUTES = 15
+
 DAILY_SHEETS_CACHE_DIR = "daily_sheets_cache"
 
 # Функція для збереження config.ini
@@ -170,6 +193,8 @@ def initialize_bot():
             
     # Ініціалізація DataFrame при запуску
     queue_df = load_queue_data()
+    if queue_df is not None:
+        QUEUE_REPO.load(queue_df)
     
     # Створення директорії для кешу якщо не існує
     os.makedirs(DAILY_SHEETS_CACHE_DIR, exist_ok=True)
@@ -205,9 +230,40 @@ def get_date_from_ordinal(ordinal):
     total_days = weeks * 7 + days
     return anchor + datetime.timedelta(days=total_days)
 
+def get_prediction_model():
+    """
+    Повертає поточний знімок моделі прогнозу без мережевих запитів.
+    До першого запуску refresh_prediction_data модель читається з локального model.json.
+    """
+    global PREDICTION_MODEL
+    if PREDICTION_MODEL is None:
+        PREDICTION_MODEL = daily_sheets_sync.load_prediction_model()
+    return PREDICTION_MODEL
+
+def _refresh_prediction_data_blocking():
+    """Синхронізує щоденні аркуші та перебудовує модель (виконується поза event loop)."""
+    daily_sheets_sync.sync_daily_sheets(get_sheets_service(), STATS_SHEET_ID, STATS_WORKSHEET_NAME)
+    return daily_sheets_sync.load_prediction_model()
+
+async def refresh_prediction_data(context: ContextTypes.DEFAULT_TYPE = None) -> None:
+    """Фонове завдання: тримає кеш щоденних аркушів і модель прогнозу актуальними."""
+    global PREDICTION_MODEL
+    try:
+        # Без загального таймауту: повна синхронізація може тривати довше за звичайний виклик
+        model = await asyncio.get_running_loop().run_in_executor(_sheets_executor, _refresh_prediction_data_blocking)
+        if model is not None:
+            if model != PREDICTION_MODEL:
+                clear_keyboard_cache()
+            PREDICTION_MODEL = model
+        else:
+            logger.warning("Оновлення моделі прогнозу: недостатньо даних, залишаємо попередню модель")
+    except Exception as e:
+        logger.error(f"Помилка фонового оновлення даних прогнозу: {e}")
+
 def calculate_prediction(user_id, stats_df=None):
     """
     Розраховує прогноз дати візиту для user_id використовуючи детальні дані зі щоденних аркушів.
+    Використовує лише знімок моделі в пам'яті (оновлюється фоновим завданням refresh_prediction_data).
     
     Args:
         user_id: ID користувача
@@ -217,10 +273,11 @@ def calculate_prediction(user_id, stats_df=None):
         dict з прогнозом або None
     """
     try:
-        import daily_sheets_sync
-        daily_sheets_sync.sync_daily_sheets(SHEETS_SERVICE, STATS_SHEET_ID, STATS_WORKSHEET_NAME)
-        prediction = daily_sheets_sync.calculate_prediction_with_daily_data(user_id, use_daily_sheets=True)
-        if prediction:
+        model = get_prediction_model()
+        if model is not None:
+            # Готовий рядок з таблиці прогнозів forecast/, інакше обчислення з моделі
+            prediction = daily_sheets_sync.lookup_prediction(user_id, model) or model.predict(user_id)
+            prediction['data_source'] = 'attendance_json'
             logger.info(f"Використано прогноз з {prediction.get('data_points', 0)} точок даних")
             return prediction
     except Exception as e:
@@ -251,32 +308,28 @@ def calculate_daily_entry_probability(tomorrow_ids: list, stats_df: pd.DataFrame
         target_date = datetime.date.today() + datetime.timedelta(days=1)
     
     try:
-        probabilities = {}
+        main_ids = [extract_main_id(uid) for uid in tomorrow_ids]
+        
+        # Один векторний розрахунок для всього списку
+        matrix = None
+        model = get_prediction_model()
+        if model is not None:
+            matrix = daily_sheets_sync.predict_many(main_ids, [target_date], model=model)
         
+        # Fallback: проста логіка на основі пропускної здатності
+        counts = pd.to_numeric(stats_df.get('Зайшов', pd.Series(dtype=float)), errors='coerce').dropna()
+        counts = counts[counts > 0].tail(10)
+        
+        probabilities = {}
         for rank, uid in enumerate(tomorrow_ids, start=1):
-            main_id = extract_main_id(uid)
-            
-            # Використовуємо покращений прогноз
-            prediction = calculate_prediction(main_id, stats_df)
-            
-            if prediction and 'dist' in prediction:
-                prob = calculate_date_probability(target_date, prediction['dist'])
-                probabilities[uid] = round(prob, 1)
+            if matrix is not None and not pd.isna(matrix[rank - 1, 0]):
+                probabilities[uid] = round(float(matrix[rank - 1, 0]), 1)
+            elif counts.empty:
+                probabilities[uid] = 0.0
             else:
-                # Fallback: проста логіка на основі пропускної здатності
-                target_col = 'Зайшов'
-                counts = pd.to_numeric(stats_df[target_col], errors='coerce').dropna()
-                counts = counts[counts > 0]
-                counts = counts.tail(10)
-                
-                if counts.empty:
-                    probabilities[uid] = 0.0
-                else:
-                    # Для позиції rank в черзі: скільки днів пропускна здатність була >= rank
-                    total_days = len(counts)
-                    days_covered = (counts >= rank).sum()
-                    prob = (days_covered / total_days) * 100
-                    probabilities[uid] = round(prob, 1)
+                # Для позиції rank в черзі: скільки днів пропускна здатність була >= rank
+                days_covered = (counts >= rank).sum()
+                probabilities[uid] = round((days_covered / len(counts)) * 100, 1)
         
         return probabilities
         
@@ -284,6 +337,35 @@ def calculate_daily_entry_probability(tomorrow_ids: list, stats_df: pd.DataFrame
         logger.error(f"Помилка розрахунку ймовірності входу: {e}")
         return {uid: 0.0 for uid in tomorrow_ids}
 
+def get_sheets_service():
+    """
+    Повертає Sheets service для поточного потоку.
+    googleapiclient (httplib2) не є потокобезпечним, тому кожен потік пулу має власне з'єднання.
+    """
+    if CREDS is None:
+        return SHEETS_SERVICE
+    service = getattr(_sheets_thread_local, 'service', None)
+    if service is None:
+        http = google_auth_httplib2.AuthorizedHttp(CREDS, http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT_SECONDS))
+        service = build('sheets', 'v4', http=http)
+        _sheets_thread_local.service = service
+    return service
+
+async def run_sheets_call(func, *args, default=None, timeout=SHEETS_CALL_TIMEOUT_SECONDS, **kwargs):
+    """
+    Виконує блокуючу функцію роботи з Google Sheets у пулі потоків.
+    При перевищенні таймауту повертає default (сам запит завершиться у фоні).
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(_sheets_executor, partial(func, *args, **kwargs)),
+            timeout
+        )
+    except asyncio.TimeoutError:
+        logger.error(f"Таймаут ({timeout}s) виклику Google Sheets: {getattr(func, '__name__', func)}")
+        return default
+
 # Завантаження даних з Google Sheet або створення нового DataFrame
 def load_queue_data() -> pd.DataFrame | None:
     """Завантажує дані черги з Google Sheet."""
@@ -294,7 +376,7 @@ def load_queue_data() -> pd.DataFrame | None:
     try:
         # Отримуємо всі записи з аркуша, починаючи з A1
         range_name = f"{SHEET_NAME}!A:{chr(ord('A') + len(REQUIRED_COLUMNS) - 1)}" # Задаємо діапазон для читання
-        result = SHEETS_SERVICE.spreadsheets().values().get(spreadsheetId=SPREADSHEET_ID, range=range_name).execute()     
+        result = get_sheets_service().spreadsheets().values().get(spreadsheetId=SPREADSHEET_ID, range=range_name).execute()     
         values = result.get('values', [])
 
         if not values: # Якщо аркуш порожній (для діапазону A:H)
@@ -361,6 +443,7 @@ async def get_stats_data(force_refresh: bool = False) -> pd.DataFrame | None:
     """
     Завантажує дані з аркуша 'Stats'.
     Використовує локальний кеш з TTL 30 хвилин для зменшення навантаження на API.
+    Типізований DataFrame спільний для всіх викликів (daily_sheets_sync.load_stats_frame) - не змінювати.
     
     Args:
         force_refresh: Примусово завантажити з API, ігноруючи кеш
@@ -373,12 +456,7 @@ async def get_stats_data(force_refresh: bool = False) -> pd.DataFrame | None:
         
         if age_minutes < STATS_CACHE_TTL_MINUTES:
             try:
-                stats_df = pd.read_csv(stats_cache_file)
-                if 'Останній номер що зайшов' in stats_df.columns:
-                    stats_df['Останній номер що зайшов'] = pd.to_numeric(stats_df['Останній номер що зайшов'], errors='coerce')
-                if 'Перший номер що зайшов' in stats_df.columns:
-                    stats_df['Перший номер що зайшов'] = pd.to_numeric(stats_df['Перший номер що зайшов'], errors='coerce')
-                stats_df['Дата прийому'] = pd.to_datetime(stats_df['Дата прийому'], format="%d.%m.%Y", dayfirst=True, errors='coerce')
+                stats_df = daily_sheets_sync.load_stats_frame(stats_cache_file)
                 logger.debug(f"Stats з кешу (вік: {age_minutes:.1f} хв)")
                 return stats_df
             except Exception as e:
@@ -386,9 +464,13 @@ async def get_stats_data(force_refresh: bool = False) -> pd.DataFrame | None:
     
     try:
         range_name = f"{STATS_WORKSHEET_NAME}!A1:Z"
-        result = SHEETS_SERVICE.spreadsheets().values().get(
-            spreadsheetId=STATS_SHEET_ID, range=range_name
-        ).execute()
+        result = await run_sheets_call(
+            lambda: get_sheets_service().spreadsheets().values().get(
+                spreadsheetId=STATS_SHEET_ID, range=range_name
+            ).execute()
+        )
+        if result is None:
+            return None
         
         list_of_lists = result.get("values", [])
 
@@ -402,13 +484,8 @@ async def get_stats_data(force_refresh: bool = False) -> pd.DataFrame | None:
         stats_df.to_csv(stats_cache_file, index=False)
         logger.info(f"Stats завантажено з API та збережено в кеш ({len(stats_df)} рядків)")
         
-        if 'Останній номер що зайшов' in stats_df.columns:
-            stats_df['Останній номер що зайшов'] = pd.to_numeric(stats_df['Останній номер що зайшов'], errors='coerce')
-        if 'Перший номер що зайшов' in stats_df.columns:
-            stats_df['Перший номер що зайшов'] = pd.to_numeric(stats_df['Перший номер що зайшов'], errors='coerce')
-        stats_df['Дата прийому'] = pd.to_datetime(stats_df['Дата прийому'], format="%d.%m.%Y", dayfirst=True, errors='coerce')
-        
-        return stats_df
+        # Типізація та кеш у пам'яті - спільні з daily_sheets_sync
+        return daily_sheets_sync.load_stats_frame(stats_cache_file)
 
     except HttpError as err:
         logger.error(f"Google API HttpError при завантаженні даних: {err.resp.status} - {err.content}. Перевірте адресу таблиці та права доступу.")
@@ -417,6 +494,53 @@ async def get_stats_data(force_refresh: bool = False) -> pd.DataFrame | None:
         logger.error(f"Загальна помилка при завантаженні даних з 'Stats': {e}")
         return None
 
+class PassHistory:
+    """
+    Незмінний індекс історії проходження з аркуша Stats.
+    
+    Для кожного дня прийому (у порядку аркуша) - максимум 'Останній номер що зайшов'
+    серед цього та всіх наступних днів. Суфіксні максимуми не зростають, тож у зворотному
+    порядку це відсортований масив, і кількість днів, коли черга вже була далі ID,
+    знаходиться через bisect.
+    """
+
+    def __init__(self, stats_df: pd.DataFrame):
+        last_ids = stats_df['Останній номер що зайшов']
+        suffix_max = last_ids[::-1].cummax()
+        valid = suffix_max.notna()
+        # Зростаючий порядок: від останнього дня аркуша до першого
+        self.ids = tuple(float(v) for v in suffix_max[valid])
+        self.max_id = self.ids[-1] if self.ids else None
+
+    def missed_days(self, user_id: int) -> int:
+        """Кількість днів прийому, коли черга пройшла далі user_id (і після них)."""
+        return len(self.ids) - bisect_right(self.ids, user_id)
+
+# Кеш: (DataFrame stats, з якого побудовано індекс, PassHistory)
+_pass_history_cache = None
+
+async def get_pass_history() -> PassHistory | None:
+    """
+    Індекс історії проходження для поточних даних Stats.
+    get_stats_data повертає той самий DataFrame, поки _stats.csv не змінився,
+    тож індекс будується один раз на кожне оновлення.
+    """
+    global _pass_history_cache
+    stats_df = await get_stats_data()
+    if stats_df is None or stats_df.empty:
+        return None
+    
+    if _pass_history_cache is not None and _pass_history_cache[0] is stats_df:
+        return _pass_history_cache[1]
+    
+    try:
+        history = PassHistory(stats_df)
+    except Exception as e:
+        logger.error(f"Помилка побудови історії проходження: {e}")
+        return None
+    _pass_history_cache = (stats_df, history)
+    return history
+
 # Збереження даних у Google Sheet (додавання рядків)
 def save_queue_data(df_to_save) -> bool:
     if SHEETS_SERVICE is None:
@@ -431,7 +555,7 @@ def save_queue_data(df_to_save) -> bool:
         # Вибираємо тільки потрібні колонки та забезпечуємо їх порядок
         data_to_append = df_to_save[REQUIRED_COLUMNS].values.tolist()
 
-        SHEETS_SERVICE.spreadsheets().values().append(
+        get_sheets_service().spreadsheets().values().append(
             spreadsheetId=SPREADSHEET_ID, range=SHEET_NAME,
             valueInputOption='USER_ENTERED', # Дозволяє Google розпізнавати формати
             insertDataOption='INSERT_ROWS', # Додаємо нові рядки
@@ -447,110 +571,225 @@ def save_queue_data(df_to_save) -> bool:
         logger.error(f"Помилка збереження даних у Google Sheet: {e}")
         return False
 
-# Функція для повного перезапису Google Sheet
-def save_queue_data_full(df: pd.DataFrame) -> bool:
+# sheetId (gid) аркуша TODO для batchUpdate, визначається при першому використанні
+_queue_sheet_gid = None
+
+def get_queue_sheet_gid() -> int | None:
+    """Повертає числовий sheetId аркуша SHEET_NAME."""
+    global _queue_sheet_gid
+    if _queue_sheet_gid is None:
+        spreadsheet = get_sheets_service().spreadsheets().get(
+            spreadsheetId=SPREADSHEET_ID, fields='sheets.properties(sheetId,title)'
+        ).execute()
+        for sheet in spreadsheet.get('sheets', []):
+            if sheet['properties']['title'] == SHEET_NAME:
+                _queue_sheet_gid = sheet['properties']['sheetId']
+                break
+    return _queue_sheet_gid
+
+def delete_queue_rows(positions: list, expected_ids: list) -> bool:
     """
-    Повністю перезаписує Google Sheet даними з DataFrame.
-    Очищає існуючі дані та записує нові, включаючи заголовки.
+    Видаляє рядки даних аркуша TODO одним batchUpdate з deleteDimension.
+    
+    Args:
+        positions: позиції рядків даних (0 - перший рядок після заголовків)
+        expected_ids: ID, які мають бути в цих рядках; якщо аркуш змінився
+                      і рядки зсунулися, нічого не видаляється
     """
     if SHEETS_SERVICE is None:
-        logger.error("Google Sheets API не ініціалізовано. Неможливо зберегти дані.")
+        logger.error("Google Sheets API не ініціалізовано. Неможливо видалити рядки.")
         return False
+    if not positions:
+        return True
 
     try:
-        # Очищаємо весь лист перед записом нових даних.
-        # Зверніть увагу: це видалить ВСІ дані на листі SHEET_NAME!
-        SHEETS_SERVICE.spreadsheets().values().clear(
-            spreadsheetId=SPREADSHEET_ID, range=f"{SHEET_NAME}!A:Z"
+        # Перевіряємо, що рядки не зсунулися після завантаження
+        result = get_sheets_service().spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID, range=f"{SHEET_NAME}!A:A"
         ).execute()
-        logger.info(f"Google Sheet '{SHEET_NAME}' було очищено перед записом.")
-
-        if df.empty:
-            logger.info(f"DataFrame для запису порожній, записано лише заголовки.")
-            # Якщо DataFrame порожній, все одно записуємо заголовки
-            body = {'values': [REQUIRED_COLUMNS]}
-            SHEETS_SERVICE.spreadsheets().values().update(
-                spreadsheetId=SPREADSHEET_ID, range=f"{SHEET_NAME}!A1",
-                valueInputOption='RAW', body=body
-            ).execute()
-            return
-
-        # Забезпечуємо наявність всіх необхідних колонок у DataFrame та їх порядок
-        df_to_save = df.copy()
-        for col in REQUIRED_COLUMNS:
-            if col not in df_to_save.columns:
-                df_to_save[col] = ''
-        df_to_save = df_to_save[REQUIRED_COLUMNS]
+        id_column = result.get('values', [])
+        for pos, expected_id in zip(positions, expected_ids):
+            row = id_column[pos + 1] if pos + 1 < len(id_column) else []
+            actual_id = row[0] if row else ''
+            if actual_id != expected_id:
+                logger.error(f"Рядок {pos + 2} аркуша '{SHEET_NAME}' змінився (очікувався ID '{expected_id}', знайдено '{actual_id}'). Видалення скасовано.")
+                return False
+
+        sheet_gid = get_queue_sheet_gid()
+        if sheet_gid is None:
+            logger.error(f"Аркуш '{SHEET_NAME}' не знайдено в таблиці.")
+            return False
 
-        # Конвертуємо DataFrame у список списків для запису, додаючи заголовки
-        data_to_write = [df_to_save.columns.tolist()] # Заголовки
-        data_to_write.extend(df_to_save.values.tolist()) # Дані
+        # Об'єднуємо сусідні рядки в діапазони; видаляємо знизу вгору, щоб індекси не зсувались
+        ranges = []
+        for pos in sorted(set(positions)):
+            if ranges and ranges[-1][1] == pos:
+                ranges[-1][1] = pos + 1
+            else:
+                ranges.append([pos, pos + 1])
+        requests = [{
+            'deleteDimension': {
+                'range': {
+                    'sheetId': sheet_gid,
+                    'dimension': 'ROWS',
+                    'startIndex': start + 1, # +1 - рядок заголовків
+                    'endIndex': end + 1
+                }
+            }
+        } for start, end in reversed(ranges)]
 
-        # Записуємо дані у лист, починаючи з A1, щоб включити заголовки
-        SHEETS_SERVICE.spreadsheets().values().update(
-            spreadsheetId=SPREADSHEET_ID, range=f"{SHEET_NAME}!A1",
-            valueInputOption='USER_ENTERED', # Дозволяє Google розпізнавати формати
-            body={'values': data_to_write}
+        get_sheets_service().spreadsheets().batchUpdate(
+            spreadsheetId=SPREADSHEET_ID, body={'requests': requests}
         ).execute()
-        logger.info(f"Дані успішно записано до Google Sheet '{SHEET_NAME}'.")
+        logger.info(f"Видалено {len(positions)} рядків ({len(ranges)} діапазонів) з Google Sheet '{SHEET_NAME}'.")
         return True
     except HttpError as err:
-        logger.error(f"Google API HttpError при повному збереженні даних: {err.resp.status} - {err.content}")
+        logger.error(f"Google API HttpError при видаленні рядків: {err.resp.status} - {err.content}")
         return False
     except Exception as e:
-        logger.error(f"Помилка при повному збереженні даних у Google Sheet: {e}")
+        logger.error(f"Помилка видалення рядків з Google Sheet: {e}")
         return False
 
 
+# --- ВІДКЛАДЕНИЙ ЗАПИС СТАТУСІВ В ACTIVE SHEET ---
+ACTIVE_STATUS_FLUSH_SECONDS = 5
+ACTIVE_STATUS_JOURNAL_FILE = "active_status_journal.json"
+
+class ActiveStatusWriter:
+    """
+    Буфер змін статусів аркуша Active (колонка C) з відкладеним записом.
+    
+    Зміни для одного ID об'єднуються (лишається остання) і зберігаються в локальному
+    журналі, доки запис не підтверджено. flush() читає лише колонку ID і записує всі
+    зміни одним values().batchUpdate. Індекс ID -> рядок перебудовується лише тоді,
+    коли вміст колонки ID змінився.
+    """
+
+    def __init__(self, journal_path: str = ACTIVE_STATUS_JOURNAL_FILE):
+        self.journal_path = journal_path
+        self._lock = threading.Lock()        # _pending та журнал
+        self._flush_lock = threading.Lock()  # один flush одночасно
+        self._pending = self._load_journal()
+        self._index_digest = None
+        self._index = {}
+        if self._pending:
+            logger.info(f"Журнал статусів Active sheet: {len(self._pending)} незаписаних змін")
+
+    def _load_journal(self) -> dict:
+        if not os.path.exists(self.journal_path):
+            return {}
+        try:
+            with open(self.journal_path, "r", encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не вдалося прочитати журнал статусів {self.journal_path}: {e}")
+            return {}
+
+    def _save_journal(self):
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, "w", encoding='utf8') as f:
+            json.dump(self._pending, f, ensure_ascii=False)
+        os.replace(tmp_path, self.journal_path)
+
+    def enqueue(self, user_id: str, new_status: str):
+        with self._lock:
+            self._pending[str(user_id).strip()] = new_status
+            self._save_journal()
+
+    def pending(self) -> dict:
+        with self._lock:
+            return dict(self._pending)
+
+    def _row_index(self, id_column: list) -> dict:
+        """ID -> номер рядка аркуша (перший збіг, як раніше при пошуку по A:D)."""
+        digest = hashlib.sha1(json.dumps(id_column, ensure_ascii=False).encode('utf-8')).hexdigest()
+        if digest != self._index_digest:
+            index = {}
+            for i, row in enumerate(id_column):
+                user_id = str(row[0]).strip() if row else ''
+                if user_id and user_id not in index:
+                    index[user_id] = i + 1
+            self._index = index
+            self._index_digest = digest
+        return self._index
+
+    def flush(self) -> bool:
+        """Записує накопичені зміни. Повертає False, якщо записати не вдалося (зміни лишаються в журналі)."""
+        with self._flush_lock:
+            snapshot = self.pending()
+            if not snapshot:
+                return True
+            if SHEETS_SERVICE is None:
+                logger.error("Google Sheets API не ініціалізовано. Неможливо оновити статуси.")
+                return False
+            
+            try:
+                result = get_sheets_service().spreadsheets().values().get(
+                    spreadsheetId=ACTIVE_SHEET_ID,
+                    range=f"{ACTIVE_WORKSHEET_NAME}!B:B"
+                ).execute()
+                index = self._row_index(result.get('values', []))
+                
+                data = []
+                for user_id, new_status in snapshot.items():
+                    row_number = index.get(user_id)
+                    if row_number is None:
+                        logger.warning(f"ID {user_id} не знайдено в Active sheet")
+                        continue
+                    data.append({'range': f"{ACTIVE_WORKSHEET_NAME}!C{row_number}", 'values': [[new_status]]})
+                
+                if data:
+                    get_sheets_service().spreadsheets().values().batchUpdate(
+                        spreadsheetId=ACTIVE_SHEET_ID,
+                        body={'valueInputOption': 'USER_ENTERED', 'data': data}
+                    ).execute()
+                
+                with self._lock:
+                    # Зміни, що надійшли під час запису, лишаються до наступного flush
+                    for user_id, new_status in snapshot.items():
+                        if self._pending.get(user_id) == new_status:
+                            del self._pending[user_id]
+                    self._save_journal()
+                
+                logger.info(f"Оновлено статуси {len(data)} ID в Active sheet одним запитом")
+                return True
+                
+            except HttpError as err:
+                logger.error(f"Google API HttpError при оновленні статусів: {err.resp.status} - {err.content}")
+                return False
+            except Exception as e:
+                logger.error(f"Помилка оновлення статусів в Active sheet: {e}")
+                return False
+
+ACTIVE_STATUS_WRITER = None
+
+def get_active_status_writer() -> ActiveStatusWriter:
+    global ACTIVE_STATUS_WRITER
+    if ACTIVE_STATUS_WRITER is None:
+        ACTIVE_STATUS_WRITER = ActiveStatusWriter()
+    return ACTIVE_STATUS_WRITER
+
 def update_active_sheet_status(user_id: str, new_status: str) -> bool:
     """
     Оновлює статус для ID в колонці C (Статус) аркуша Active.
     Статуси: 'Підтвердив візит', 'Відклав візит', 'Скасував'
-    """
-    if SHEETS_SERVICE is None:
-        logger.error("Google Sheets API не ініціалізовано. Неможливо оновити статус.")
-        return False
     
+    Зміна записується в журнал і потрапляє в аркуш з найближчим
+    flush_active_status_updates (кожні ACTIVE_STATUS_FLUSH_SECONDS секунд).
+    """
     try:
-        range_name = f"{ACTIVE_WORKSHEET_NAME}!A:D"
-        result = SHEETS_SERVICE.spreadsheets().values().get(
-            spreadsheetId=ACTIVE_SHEET_ID,
-            range=range_name
-        ).execute()
-        
-        values = result.get('values', [])
-        if not values:
-            logger.warning(f"Active sheet порожній")
-            return False
-        
-        row_index = None
-        for i, row in enumerate(values):
-            if len(row) >= 2 and str(row[1]).strip() == str(user_id).strip():
-                row_index = i
-                break
-        
-        if row_index is None:
-            logger.warning(f"ID {user_id} не знайдено в Active sheet")
-            return False
-        
-        cell_range = f"{ACTIVE_WORKSHEET_NAME}!C{row_index + 1}"
-        SHEETS_SERVICE.spreadsheets().values().update(
-            spreadsheetId=ACTIVE_SHEET_ID,
-            range=cell_range,
-            valueInputOption='USER_ENTERED',
-            body={'values': [[new_status]]}
-        ).execute()
-        
-        logger.info(f"Статус ID {user_id} оновлено на '{new_status}' в Active sheet")
+        get_active_status_writer().enqueue(user_id, new_status)
         return True
-        
-    except HttpError as err:
-        logger.error(f"Google API HttpError при оновленні статусу: {err.resp.status} - {err.content}")
-        return False
     except Exception as e:
-        logger.error(f"Помилка оновлення статусу в Active sheet: {e}")
+        logger.error(f"Помилка збереження статусу ID {user_id} в журнал: {e}")
         return False
 
+async def flush_active_status_updates(context: ContextTypes.DEFAULT_TYPE = None) -> None:
+    """Фонове завдання: записує накопичені статуси в Active sheet."""
+    writer = get_active_status_writer()
+    if writer.pending():
+        await run_sheets_call(writer.flush, default=False)
+
 
 def get_sheets_list(spreadsheet_id: str) -> list:
     """
@@ -561,7 +800,7 @@ def get_sheets_list(spreadsheet_id: str) -> list:
         return []
     
     try:
-        spreadsheet = SHEETS_SERVICE.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+        spreadsheet = get_sheets_service().spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
         sheets = spreadsheet.get('sheets', [])
         return [sheet['properties']['title'] for sheet in sheets]
     except HttpError as err:
@@ -585,7 +824,7 @@ def get_users_for_date_from_active_sheet(target_date: str) -> list:
     
     try:
         range_name = f"{ACTIVE_WORKSHEET_NAME}!A:Z"
-        result = SHEETS_SERVICE.spreadsheets().values().get(
+        result = get_sheets_service().spreadsheets().values().get(
             spreadsheetId=ACTIVE_SHEET_ID,
             range=range_name
         ).execute()
@@ -637,6 +876,201 @@ def get_users_for_date_from_active_sheet(target_date: str) -> list:
         return []
 
 
+# --- АСИНХРОННІ ОБГОРТКИ ДЛЯ ОБРОБНИКІВ ---
+async def load_queue_data_async() -> pd.DataFrame | None:
+    return await run_sheets_call(load_queue_data, default=None)
+
+async def save_queue_data_async(df_to_save) -> bool:
+    return await run_sheets_call(save_queue_data, df_to_save, default=False)
+
+async def delete_queue_rows_async(positions: list, expected_ids: list) -> bool:
+    return await run_sheets_call(delete_queue_rows, positions, expected_ids, default=False)
+
+async def update_active_sheet_status_async(user_id: str, new_status: str) -> bool:
+    # Лише запис у журнал - сам аркуш оновлює flush_active_status_updates
+    return update_active_sheet_status(user_id, new_status)
+
+async def get_sheets_list_async(spreadsheet_id: str) -> list:
+    return await run_sheets_call(get_sheets_list, spreadsheet_id, default=[])
+
+async def get_users_for_date_from_active_sheet_async(target_date: str) -> list:
+    return await run_sheets_call(get_users_for_date_from_active_sheet, target_date, default=[])
+
+
+# --- РЕПОЗИТОРІЙ ЗАПИСІВ ЧЕРГИ (TODO) ---
+QUEUE_MODIFIED_FORMAT = "%d.%m.%Y %H:%M:%S"
+# Записи без дати зміни не мають перекривати актуальні записи
+QUEUE_MODIFIED_FALLBACK = datetime.datetime(2000, 1, 1, 0, 0, 0)
+# Інтерактивні обробники не перезавантажують аркуш, якщо дані свіжіші за цей вік
+QUEUE_REFRESH_MAX_AGE_SECONDS = 30
+
+class QueueRepository:
+    """
+    Записи аркуша TODO в пам'яті з індексами за ID та TG ID
+    і готовим останнім записом для кожного ID.
+    
+    Аркуш читається повністю (Sheets API не віддає зміни), але індекси
+    оновлюються інкрементально - лише для доданих або змінених рядків.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.loaded_at = None  # time.monotonic() останнього завантаження
+        self._reset()
+
+    def _reset(self):
+        self._rows = []       # кортежі значень у порядку аркуша
+        self._records = []    # ті ж рядки як словники
+        self._modified = []   # розібране значення 'Змінено'
+        self._by_id = {}
+        self._by_tg_id = {}
+        self._latest = {}     # ID -> позиція останнього запису
+        self._frame = None
+
+    def _normalize(self, values):
+        return tuple('' if v is None or (isinstance(v, float) and pd.isna(v)) else str(v) for v in values)
+
+    def _parse_modified(self, value):
+        try:
+            return datetime.datetime.strptime(value.strip(), QUEUE_MODIFIED_FORMAT)
+        except ValueError:
+            return QUEUE_MODIFIED_FALLBACK
+
+    def _set_row(self, pos, row):
+        record = dict(zip(self.columns, row))
+        if pos == len(self._rows):
+            self._rows.append(row)
+            self._records.append(record)
+            self._modified.append(None)
+        else:
+            self._rows[pos] = row
+            self._records[pos] = record
+        self._modified[pos] = self._parse_modified(record['Змінено'])
+        self._by_id.setdefault(record['ID'], []).append(pos)
+        self._by_tg_id.setdefault(record['TG ID'].strip(), []).append(pos)
+
+    def _unindex_row(self, pos):
+        record = self._records[pos]
+        self._by_id[record['ID']].remove(pos)
+        if not self._by_id[record['ID']]:
+            del self._by_id[record['ID']]
+        tg_key = record['TG ID'].strip()
+        self._by_tg_id[tg_key].remove(pos)
+        if not self._by_tg_id[tg_key]:
+            del self._by_tg_id[tg_key]
+
+    def _update_latest(self, record_ids):
+        for record_id in record_ids:
+            positions = self._by_id.get(record_id)
+            if not positions:
+                self._latest.pop(record_id, None)
+                continue
+            # При однаковому часі зміни перемагає пізніший рядок аркуша
+            self._latest[record_id] = max(positions, key=lambda pos: (self._modified[pos], pos))
+
+    def load(self, df: pd.DataFrame):
+        """Повністю перебудовує репозиторій з DataFrame."""
+        self._reset()
+        for pos, values in enumerate(df[self.columns].itertuples(index=False, name=None)):
+            self._set_row(pos, self._normalize(values))
+        for positions in self._by_id.values():
+            positions.sort()
+        self._update_latest(list(self._by_id))
+        self.loaded_at = time.monotonic()
+
+    def apply_frame(self, df: pd.DataFrame) -> int:
+        """
+        Оновлює репозиторій свіжим вмістом аркуша, переіндексовуючи лише змінені рядки.
+        Повертає кількість змінених або доданих рядків.
+        """
+        rows = [self._normalize(values) for values in df[self.columns].itertuples(index=False, name=None)]
+        if len(rows) < len(self._rows):
+            # Рядки видалено (очищення) - позиції зсунулися, перебудовуємо повністю
+            self.load(df)
+            return len(rows)
+        
+        changed = [pos for pos in range(len(self._rows)) if self._rows[pos] != rows[pos]]
+        changed.extend(range(len(self._rows), len(rows)))
+        affected_ids = set()
+        for pos in changed:
+            if pos < len(self._rows):
+                affected_ids.add(self._records[pos]['ID'])
+                self._unindex_row(pos)
+            self._set_row(pos, rows[pos])
+            affected_ids.add(rows[pos][self.columns.index('ID')])
+        for record_id in affected_ids:
+            if record_id in self._by_id:
+                self._by_id[record_id].sort()
+        self._update_latest(affected_ids)
+        if changed:
+            self._frame = None
+        self.loaded_at = time.monotonic()
+        return len(changed)
+
+    def append(self, record: dict):
+        """Додає запис, успішно збережений в аркуш."""
+        row = self._normalize(record.get(col, '') for col in self.columns)
+        self._set_row(len(self._rows), row)
+        self._update_latest([row[self.columns.index('ID')]])
+        self._frame = None
+
+    def is_fresh(self, max_age_seconds: float) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < max_age_seconds
+
+    def records_for_id(self, record_id: str) -> list:
+        return [self._records[pos] for pos in self._by_id.get(record_id, [])]
+
+    def records_for_tg_id(self, tg_id) -> list:
+        return [self._records[pos] for pos in self._by_tg_id.get(str(tg_id).strip(), [])]
+
+    def latest(self, record_id: str, status: str = None) -> dict | None:
+        """Останній запис для ID (за 'Змінено'); зі status - останній запис з таким статусом."""
+        if status is None:
+            pos = self._latest.get(record_id)
+            return self._records[pos] if pos is not None else None
+        positions = [pos for pos in self._by_id.get(record_id, []) if self._records[pos]['Статус'] == status]
+        if not positions:
+            return None
+        return self._records[max(positions, key=lambda pos: (self._modified[pos], pos))]
+
+    def latest_records(self) -> list:
+        """Останні записи для кожного ID."""
+        return [self._records[pos] for pos in self._latest.values()]
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        """Усі записи як DataFrame (кешується до наступної зміни)."""
+        if self._frame is None:
+            self._frame = pd.DataFrame(self._rows, columns=self.columns)
+        return self._frame
+
+    def __len__(self):
+        return len(self._rows)
+
+QUEUE_REPO = QueueRepository(REQUIRED_COLUMNS)
+
+async def refresh_queue(max_age_seconds: float = 0) -> bool:
+    """
+    Оновлює QUEUE_REPO з аркуша TODO, якщо дані старші за max_age_seconds.
+    Повертає False при помилці завантаження.
+    """
+    global queue_df
+    if max_age_seconds and QUEUE_REPO.is_fresh(max_age_seconds):
+        return True
+    df = await load_queue_data_async()
+    if df is None:
+        return False
+    QUEUE_REPO.apply_frame(df)
+    queue_df = QUEUE_REPO.frame
+    return True
+
+def append_queue_record(record: dict):
+    """Додає успішно збережений запис до QUEUE_REPO і оновлює queue_df."""
+    global queue_df
+    QUEUE_REPO.append(record)
+    queue_df = QUEUE_REPO.frame
+
+
 # --- СТАНДАРТНА КЛАВІАТУРА З КОМАНДАМИ ---
 # Важливо: хоча на кнопках текст, для внутрішньої логіки бот все ще реагує на цей текст як на "команду"
 BUTTON_TEXT_JOIN = "Записатися / Перенести"
@@ -691,24 +1125,62 @@ SHOW_OPTION_KEYBOARD = ReplyKeyboardMarkup([
 def get_ua_weekday(date_obj):
     return date_obj.strftime('%a').title()
 
+# Робочих днів від сьогодні в кешованій таблиці ймовірностей (~6 місяців)
+PROBABILITY_TABLE_DAYS = 130
+
+@lru_cache(maxsize=256)
+def _probability_table(loc, scale, df, start_ordinal):
+    """
+    Кумулятивні ймовірності (%) для PROBABILITY_TABLE_DAYS робочих днів від start_ordinal
+    одним векторним викликом t.cdf. Кешується для кожного прогнозу (loc, scale, df) на день.
+    """
+    ordinals = np.arange(start_ordinal, start_ordinal + PROBABILITY_TABLE_DAYS)
+    # ordinal + 1: ймовірність того, що черга настане ДО кінця цього дня
+    table = stats.t.cdf(ordinals + 1, df, loc=loc, scale=scale) * 100
+    table.setflags(write=False)
+    return table
+
+def calculate_date_probabilities(dates, dist, today=None):
+    """
+    Кумулятивні ймовірності (%) того, що черга настане до кінця кожної з дат.
+    Дати в межах PROBABILITY_TABLE_DAYS робочих днів від today беруться з кешованої таблиці,
+    решта рахується одним векторним викликом t.cdf.
+    
+    Returns:
+        list[float] у порядку dates
+    """
+    if not dates:
+        return []
+    try:
+        if today is None:
+            today = datetime.date.today()
+        # Прогноз з таблиці forecast/ вже містить ймовірності на найближчі робочі дні
+        precomputed = dist.get('probabilities', {})
+        
+        start_ordinal = get_ordinal_date(today)
+        ordinals = np.array([get_ordinal_date(d) for d in dates])
+        offsets = ordinals - start_ordinal
+        in_table = (offsets >= 0) & (offsets < PROBABILITY_TABLE_DAYS)
+        
+        result = np.empty(len(dates))
+        if in_table.any():
+            table = _probability_table(float(dist['loc']), float(dist['scale']), float(dist['df']), start_ordinal)
+            result[in_table] = table[offsets[in_table]]
+        if not in_table.all():
+            result[~in_table] = stats.t.cdf(ordinals[~in_table] + 1, dist['df'],
+                                            loc=dist['loc'], scale=dist['scale']) * 100
+        
+        return [precomputed.get(d, float(p)) for d, p in zip(dates, result)]
+    except Exception as e:
+        logger.error(f"Помилка обчислення ймовірностей для {len(dates)} дат: {e}")
+        return [0.0] * len(dates)
+
 def calculate_date_probability(date_obj, dist):
     """
     Обчислює кумулятивну ймовірність того, що черга настане до кінця вказаної дати.
     Повертає ймовірність у відсотках (0-100).
     """
-    try:
-        ordinal = get_ordinal_date(date_obj)
-        loc = dist['loc']
-        scale = dist['scale']
-        df = dist['df']
-        # Обчислюємо кумулятивну ймовірність для цього порядкового номера (кінець дня)
-        # Використовуємо ordinal + 1, оскільки ordinal представляє початок дня (або індекс цілого дня),
-        # і ми хочемо отримати ймовірність того, що черга настане ДО кінця цього дня.
-        prob = stats.t.cdf(ordinal + 1, df, loc=loc, scale=scale)
-        return prob * 100
-    except Exception as e:
-        logger.error(f"Помилка обчислення ймовірності для {date_obj}: {e}")
-        return 0.0
+    return calculate_date_probabilities([date_obj], dist)[0]
 
 def calculate_end_date(start_date, days_count):
     """
@@ -740,63 +1212,86 @@ def generate_date_options(today=None, days_to_check=0, days_ahead=15, start_date
     
     logger.debug(f"generate_date_options: start_date={start_date}, end_date={end_date}, using_range={bool(start_date and end_date)}")
     
+    dates = []
     if start_date and end_date:
         iter_date = max(current_check_date, start_date)
         limit_date = end_date
         
         while iter_date <= limit_date:
             if iter_date.weekday() < 5:
-                date_str_short = iter_date.strftime("%d.%m.%y")
-                date_str_full = iter_date.strftime("%d.%m.%Y")
-                weekday_str = get_ua_weekday(iter_date)
-                button_text = f"{weekday_str}: {date_str_short}"
-                
-                if prediction_dist:
-                    percent = calculate_date_probability(iter_date, prediction_dist)
-                    if percent >= 0.1:
-                        button_text = f"{button_text} ({percent:.0f}%)"
-                
-                date_options.append({
-                    'date': iter_date,
-                    'text': button_text,
-                    'date_str': date_str_full
-                })
+                dates.append(iter_date)
             iter_date += datetime.timedelta(days=1)
-            if len(date_options) >= 30:
+            if len(dates) >= 30:
                 break
     else:
-        buttons_added = 0
         iter_date = current_check_date
-        while buttons_added < days_ahead:
+        while len(dates) < days_ahead:
             if iter_date.weekday() < 5:
-                date_str_short = iter_date.strftime("%d.%m.%y")
-                date_str_full = iter_date.strftime("%d.%m.%Y")
-                weekday_str = get_ua_weekday(iter_date)
-                button_text = f"{weekday_str}: {date_str_short}"
-                
-                if prediction_dist:
-                    percent = calculate_date_probability(iter_date, prediction_dist)
-                    if percent >= 0.1:
-                        button_text = f"{button_text} ({percent:.0f}%)"
-                
-                date_options.append({
-                    'date': iter_date,
-                    'text': button_text,
-                    'date_str': date_str_full
-                })
-                buttons_added += 1
+                dates.append(iter_date)
             iter_date += datetime.timedelta(days=1)
     
+    # Ймовірності для всіх кнопок одним векторним викликом
+    percents = calculate_date_probabilities(dates, prediction_dist, today) if prediction_dist else [None] * len(dates)
+    
+    for iter_date, percent in zip(dates, percents):
+        date_str_short = iter_date.strftime("%d.%m.%y")
+        date_str_full = iter_date.strftime("%d.%m.%Y")
+        weekday_str = get_ua_weekday(iter_date)
+        button_text = f"{weekday_str}: {date_str_short}"
+        
+        if percent is not None and percent >= 0.1:
+            button_text = f"{button_text} ({percent:.0f}%)"
+        
+        date_options.append({
+            'date': iter_date,
+            'text': button_text,
+            'date_str': date_str_full
+        })
+    
     return date_options
 
+# Кеш готових клавіатур дат: ключ -> Markup (об'єкти telegram незмінні, тож спільні між користувачами).
+# Очищується при зміні дня та при оновленні моделі прогнозу (refresh_prediction_data).
+KEYBOARD_CACHE_MAX_SIZE = 1024
+_keyboard_cache = {}
+_keyboard_cache_day = None
+
+def _dist_cache_key(prediction_dist):
+    """Округлений розподіл прогнозу: відсотки на кнопках округлюються до цілого, тож дрібні зміни не важливі."""
+    if not prediction_dist:
+        return None
+    return (round(float(prediction_dist['loc']), 3), round(float(prediction_dist['scale']), 3), prediction_dist['df'])
+
+def clear_keyboard_cache():
+    """Скидає кеш клавіатур (після оновлення моделі прогнозу)."""
+    _keyboard_cache.clear()
+
+def _cached_keyboard(key, build):
+    """Повертає клавіатуру з кешу або будує її через build()."""
+    global _keyboard_cache_day
+    current_day = datetime.date.today()
+    if _keyboard_cache_day != current_day or len(_keyboard_cache) >= KEYBOARD_CACHE_MAX_SIZE:
+        _keyboard_cache.clear()
+        _keyboard_cache_day = current_day
+    
+    markup = _keyboard_cache.get(key)
+    if markup is None:
+        markup = build()
+        _keyboard_cache[key] = markup
+    return markup
+
 def date_keyboard(today=None, days_to_check=0, days_ahead=15, start_date=None, end_date=None, prediction_dist=None) -> ReplyKeyboardMarkup:
     """
     Створює ReplyKeyboardMarkup з датами.
-    Використовує generate_date_options() для генерації списку дат.
+    Використовує generate_date_options() для генерації списку дат; результат кешується.
     """
     if today is None:
         today = datetime.date.today()
     
+    key = ('reply', today, days_to_check, days_ahead, start_date, end_date, _dist_cache_key(prediction_dist))
+    return _cached_keyboard(key, partial(_build_date_keyboard, today, days_to_check, days_ahead, start_date, end_date, prediction_dist))
+
+def _build_date_keyboard(today, days_to_check, days_ahead, start_date, end_date, prediction_dist) -> ReplyKeyboardMarkup:
     date_options = generate_date_options(today, days_to_check, days_ahead, start_date, end_date, prediction_dist)
     
     flat_keyboard_buttons = [KeyboardButton(opt['text']) for opt in date_options]
@@ -866,15 +1361,10 @@ def format_prediction_range_text(prediction: dict, today: datetime.date = None,
         return ""
     
     try:
-        prob_start = calculate_date_probability(start_date, prediction_dist)
-        
-        if end_date:
-            prob_end = calculate_date_probability(end_date, prediction_dist)
-            end_str = f"`{end_date.strftime('%d.%m.%Y')}` ({prob_end:.0f}%)"
-        else:
-            est_end = calculate_end_date(start_date, days_ahead)
-            prob_end = calculate_date_probability(est_end, prediction_dist)
-            end_str = f"`{est_end.strftime('%d.%m.%Y')}` ({prob_end:.0f}%)"
+        if not end_date:
+            end_date = calculate_end_date(start_date, days_ahead)
+        prob_start, prob_end = calculate_date_probabilities([start_date, end_date], prediction_dist, today)
+        end_str = f"`{end_date.strftime('%d.%m.%Y')}` ({prob_end:.0f}%)"
         
         return f"`{start_date.strftime('%d.%m.%Y')}` ({prob_start:.0f}%) - {end_str}"
     except Exception as e:
@@ -895,12 +1385,17 @@ def date_inline_keyboard_from_prediction(user_id: str, prediction: dict, today:
 def date_inline_keyboard(user_id: str, today=None, days_to_check=0, days_ahead=15, start_date=None, end_date=None, prediction_dist=None, columns=2) -> InlineKeyboardMarkup:
     """
     Створює InlineKeyboardMarkup з датами для опитування.
-    Використовує generate_date_options() для генерації списку дат.
+    Використовує generate_date_options() для генерації списку дат; результат кешується.
     Callback data: poll_date_{user_id}_{date_str}
     """
     if today is None:
         today = datetime.date.today()
     
+    key = ('inline', user_id, today, days_to_check, days_ahead, start_date, end_date, _dist_cache_key(prediction_dist), columns)
+    return _cached_keyboard(key, partial(_build_date_inline_keyboard, user_id, today, days_to_check, days_ahead,
+                                         start_date, end_date, prediction_dist, columns))
+
+def _build_date_inline_keyboard(user_id, today, days_to_check, days_ahead, start_date, end_date, prediction_dist, columns) -> InlineKeyboardMarkup:
     date_options = generate_date_options(today, days_to_check, days_ahead, start_date, end_date, prediction_dist)
     
     flat_buttons = []
@@ -958,17 +1453,12 @@ async def check_id_for_queue(user_id_to_check: int, user_prev_date: str, user_la
     Перевіряє, чи має користувач право на запис в чергу згідно з номерами проходження.
     Повертає (can_register: bool, message: str).
     """
-    stats_df = await get_stats_data()
-    if stats_df is None or stats_df.empty:
+    history = await get_pass_history()
+    if history is None or history.max_id is None:
         return False, "Виникла помилка при перевірці даних, спробуйте пізніше."
 
-    # Отримуємо максимальний номер і дату
-    max_id_row = stats_df.loc[stats_df['Останній номер що зайшов'].idxmax()]
-    max_id = max_id_row['Останній номер що зайшов']
-    max_id_date = max_id_row['Дата прийому']
-
     # 1. Перевіряємо, чи ID більший за максимальний
-    if user_id_to_check >= max_id:
+    if user_id_to_check >= history.max_id:
         return True, ""
 
     # 2. Перевіряємо дату
@@ -987,9 +1477,7 @@ async def check_id_for_queue(user_id_to_check: int, user_prev_date: str, user_la
             return True, ""
 
     # 3. Шукаємо найближчий більший ID і перевіряємо запізнення
-    stats_df['Cum_Max'] = stats_df['Останній номер що зайшов'][::-1].cummax()[::-1]
-    filtered_df = stats_df[stats_df['Cum_Max'] > user_id_to_check]
-    delay_days = filtered_df.shape[0]
+    delay_days = history.missed_days(user_id_to_check)
     if delay_days <= 1:
         return True, "До вас застосовано `п.8` правил:\nВи пропустили свою чергу на один день.\nУ вас лишається `Остання спроба`.\n"
     else:
@@ -1005,7 +1493,7 @@ async def send_group_notification(context, message) -> None:
         logger.warning("Сповіщення не надіслано в груповий чат, бот був вилучений з нього.")
         return
     try:
-        await context.bot.send_message(chat_id=GROUP_ID, text=message, parse_mode="HTML")
+        await context.bot.send_message(chat_id=GROUP_ID, text=message, parse_mode="HTML", rate_limit_args=broadcast.PRIORITY_GROUP)
         logger.info("Сповіщення успішно надіслано в груповий чат.")
     except telegram.error.Forbidden as e:
         # 2. Якщо виникла помилка Forbidden, ми знаємо, що бота вилучили.
@@ -1017,65 +1505,50 @@ async def send_group_notification(context, message) -> None:
 
 # --- Допоміжна функція для надсилання повідомлення користувачу ---
 async def send_user_notification(context: ContextTypes.DEFAULT_TYPE, user_tg_id: str, message: str) -> None:
-    """Надсилає особисте повідомлення користувачу за його TG ID."""
+    """Надсилає особисте повідомлення користувачу за його TG ID (зі спільним лімітом розсилок)."""
     if user_tg_id != '':
-        try:
-            await context.bot.send_message(chat_id=user_tg_id, text=message, parse_mode="HTML", reply_markup=MAIN_KEYBOARD)
+        message = broadcast.OutboundMessage(key=str(user_tg_id), chat_id=user_tg_id, text=message, reply_markup=MAIN_KEYBOARD)
+        if await broadcast.send_with_retry(context.bot, message):
             logger.info(f"Особисте сповіщення успішно надіслано користувачу {user_tg_id}.")
-        except Exception as e:
-            logger.error(f"Помилка при надсиланні особистого сповіщення користувачу {user_tg_id}: {e}")
 
 # --- ДОПОМІЖНА ФУНКЦІЯ ДЛЯ ВІДОБРАЖЕННЯ ЧЕРГИ (З ПАГІНАЦІЄЮ) ---
-async def display_queue_data(update: Update, data_frame: pd.DataFrame, title: str = "Поточна черга:", reply_markup = None, iConfirmation = False) -> None:
-    # Фільтруємо лише актуальні записи (де 'Дата' не порожня і є останнім записом для даного ID)
-    # Спочатку перетворюємо стовпець "Змінено" на datetime для коректного сортування
-    temp_df = data_frame.copy()
-    # Перевірка на пустий 'Змінено' перед перетворенням
-    temp_df['Змінено_dt'] = pd.to_datetime(temp_df['Змінено'].astype(str), format="%d.%m.%Y %H:%M:%S", dayfirst=True, errors='coerce')
-    temp_df['Змінено_dt'] = temp_df['Змінено_dt'].fillna("01.01.2025 00:00:00")
-    #temp_df = temp_df.dropna(subset=['Змінено_dt'])
-
-
-    # Сортуємо за ID та часом зміни (найновіші записи будуть останніми для кожного ID)
-    temp_df_sorted = temp_df.sort_values(by=['ID', 'Змінено_dt'], ascending=[True, True])
-
-    # Вибираємо тільки останній запис для кожного ID
-    actual_records = temp_df_sorted.drop_duplicates(subset='ID', keep='last')
-
-    # Фільтруємо ті, у яких поле "Дата" не порожнє (актуальні записи)
-    actual_queue = actual_records[
-        (actual_records['Дата'].astype(str).str.strip() != '') &
-        (actual_records['Статус'].astype(str).str.strip().str.lower() == 'ухвалено')
-    ].copy()
+async def display_queue_data(update: Update, records: list, title: str = "Поточна черга:", reply_markup = None, iConfirmation = False) -> None:
+    """
+    Відображає чергу. records - останні записи для кожного ID (QueueRepository.latest_records()).
+    Показуються лише ухвалені записи з датою не раніше сьогодні.
+    """
+    current_date_obj = datetime.date.today()
+    actual_queue = []
+    for record in records:
+        if record['Дата'].strip() == '' or record['Статус'].strip().lower() != 'ухвалено':
+            continue
+        try:
+            record_date = datetime.datetime.strptime(record['Дата'].strip(), "%d.%m.%Y").date()
+        except ValueError:
+            continue # Пропускаємо записи з некоректними датами
+        if record_date >= current_date_obj:
+            actual_queue.append((record_date, record['ID'], record))
 
-    if actual_queue.empty:
+    if not actual_queue:
         await update.message.reply_text(f"{title}\nЧерга порожня або жоден запис ще не ухвалено. Гарна нагода записатися!", reply_markup=reply_markup) # Додаємо клавіатуру)
         return
 
     # Сортуємо актуальні записи за датою для відображення
-    try:
-        # Створюємо тимчасовий стовпець для сортування, щоб не змінювати початковий DataFrame
-        current_date_obj = datetime.date.today()
-        actual_queue['Дата_dt'] = pd.to_datetime(actual_queue['Дата'].astype(str), format="%d.%m.%Y", dayfirst=True, errors='coerce')
-        actual_queue = actual_queue.dropna(subset=['Дата_dt']) # Видаляємо записи з некоректними датами
-
-        sorted_df_for_display = actual_queue.sort_values(by=['Дата_dt', 'ID'], ascending=[True, True]).loc[actual_queue['Дата_dt'].dt.date >= current_date_obj].drop(columns=['Дата_dt', 'Змінено_dt'])
-    except Exception as e: # На випадок, якщо у файлі є некоректні дати
-        logger.error(f"Помилка сортування черги для відображення: {e}. Сортування без перетворення дат.")
-        sorted_df_for_display = actual_queue.sort_values(by=['Дата', 'ID'], ascending=[True, True]).drop(columns=['Змінено_dt']) # Сортуємо як рядок
+    actual_queue.sort(key=lambda item: (item[0], item[1]))
+    sorted_records = [item[2] for item in actual_queue]
 
     # Формуємо список рядків черги
     queue_lines = []
     # Для відображення показуємо лише ID та Дату
     if iConfirmation:
         last_known_state = load_status_state()       
-        for index, row in sorted_df_for_display.iterrows():
+        for row in sorted_records:
             last_status_info = last_known_state.get(row['ID'])
             queue_lines.append(f"**{len(queue_lines) + 1}.** ID: `{row['ID']}`, Дата: `{row['Дата']}`, `{last_status_info['confirmation']}`")
     else:    
-        for index, row in sorted_df_for_display.iterrows():
+        for row in sorted_records:
             queue_lines.append(f"**{len(queue_lines) + 1}.** ID: `{row['ID']}`, Дата: `{row['Дата']}`")
-    base_queue_text = f"📊 **{title} {sorted_df_for_display.shape[0]} записів**\n"
+    base_queue_text = f"📊 **{title} {len(sorted_records)} записів**\n"
     current_message_parts = [base_queue_text]
     current_part_length = len(base_queue_text)
     MAX_MESSAGE_LENGTH = 1500 # Має бути менше 4096, обираємо 1500 щоб мати запас на форматування
@@ -1185,6 +1658,51 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 
     # Функція, яка містить основну логіку очищення
+def compute_cleanup_drop_positions(df: pd.DataFrame, current_date_obj: datetime.date) -> list:
+    """
+    Визначає позиції рядків TODO (0 - перший рядок даних), які видаляє очищення.
+    
+    Видаляються:
+    - усі записи зі статусом "Відхилено";
+    - старіші записи ID з минулою датою, створені тим самим TG ID, що й останній запис;
+    - якщо останній запис ухвалено: старіші записи "На розгляді"/"Ухвалено" того ж TG ID,
+      а якщо дата останнього запису вже минула - і від інших TG ID.
+    """
+    if df.empty:
+        return []
+    
+    rows = pd.DataFrame({
+        'pos': range(len(df)),
+        'ID': df['ID'].values,
+        'TG': df['TG ID'].values,
+        'status': df['Статус'].astype(str).str.strip().str.lower().values,
+        'date': pd.to_datetime(df['Дата'].astype(str).str.strip(), format="%d.%m.%Y", errors='coerce').values,
+        'modified': pd.to_datetime(df['Змінено'].astype(str).str.strip(), format="%d.%m.%Y %H:%M:%S", errors='coerce').values,
+    })
+    
+    # Останній запис для кожного ID: максимальний 'Змінено', при рівності - перший рядок
+    latest = (rows[rows['modified'].notna()]
+              .sort_values(['ID', 'modified', 'pos'], ascending=[True, True, False], kind='mergesort')
+              .drop_duplicates('ID', keep='last')
+              .set_index('ID'))
+    latest_modified = rows['ID'].map(latest['modified'])
+    latest_tg = rows['ID'].map(latest['TG'].astype(str).str.strip())
+    latest_approved = rows['ID'].map(latest['status']) == 'ухвалено'
+    today = pd.Timestamp(current_date_obj)
+    latest_past = rows['ID'].map(latest['date']) < today
+    
+    older = rows['modified'] < latest_modified
+    same_tg = rows['TG'] == latest_tg
+    active = rows['status'].isin(['на розгляді', 'ухвалено'])
+    
+    drop = (
+        (rows['status'] == 'відхилено')
+        | (older & (rows['date'] < today) & same_tg)
+        | (latest_approved & older & active & same_tg)
+        | (latest_approved & latest_past & older & active & ~same_tg)
+    )
+    return rows.loc[drop, 'pos'].tolist()
+
 async def perform_queue_cleanup(logger_info_prefix: str = "Очищення за розкладом"):
     """
     Виконує логіку очищення черги. Може бути викликана як з команди, так і за розкладом.
@@ -1194,65 +1712,30 @@ async def perform_queue_cleanup(logger_info_prefix: str = "Очищення за
     logger.info(f"{logger_info_prefix}: Розпочато розумне очищення черги.")
 
     # 1. Завантажуємо актуальний стан черги
-    queue_df = load_queue_data()
-    if queue_df is None: # Перевіряємо, чи була помилка завантаження
+    if not await refresh_queue(): # Перевіряємо, чи була помилка завантаження
         logger.error(f"{logger_info_prefix}: Не вдалося завантажити чергу для очищення. Можливо, проблема зі зв'язком з Google Sheets.")
         return -1 # Повертаємо -1, щоб сигналізувати про помилку
-    sort_df = queue_df.copy()
+    sort_df = QUEUE_REPO.frame.copy()
     if sort_df.empty:
         logger.info(f"{logger_info_prefix}: Черга вже порожня.")
         return 0 # Повертаємо 0, якщо черга порожня (не помилка)
 
     initial_records_count = len(sort_df)
 
-    # 2. Підготовка допоміжних стовпців для фільтрації
-    sort_df['Статус_clean'] = sort_df['Статус'].astype(str).str.strip().str.lower()
-    sort_df['Дата_clean'] = sort_df['Дата'].astype(str).str.strip()
-    # Перетворюємо стовпець 'Дата' на формат datetime для порівняння
-    sort_df['Дата_dt'] = pd.to_datetime(sort_df['Дата_clean'], format="%d.%m.%Y", dayfirst=True, errors='coerce')
-    sort_df['Змінено_clean'] = sort_df['Змінено'].astype(str).str.strip()
-    sort_df['Змінено_dt'] = pd.to_datetime(sort_df['Змінено_clean'], format="%d.%m.%Y %H:%M:%S", dayfirst=True, errors='coerce')
-    # Створюємо список видалення
-    current_date_obj = datetime.date.today() # Поточна дата
-    unique_ids = sort_df['ID'].unique()
-    index_to_drop = []
-    # index_to_drop.extend(sort_df.loc[(sort_df['Дата_dt'].dt.date < current_date_obj) & (sort_df['Дата_dt'].notna())].index.tolist())
-    index_to_drop.extend(sort_df.loc[(sort_df['Статус_clean'].isin(['відхилено'])].index.tolist())
-    
-  
-    for cur_id in unique_ids:
-        max_mod_idx = sort_df[sort_df['ID'] == cur_id]['Змінено_dt'].idxmax()
-        TG_ID = sort_df['TG ID'][max_mod_idx].strip()
-        # index_to_drop.extend(sort_df.loc[(sort_df['ID'] == cur_id) & (sort_df['Змінено_dt'] < sort_df['Змінено_dt'][max_mod_idx]) & ((sort_df['Дата_dt'].dt.date >= current_date_obj) | (sort_df['Дата_dt'].isna())) & (sort_df['Статус_clean'].isin(['відхилено']))].index.tolist())
-        index_to_drop.extend(sort_df.loc[(sort_df['ID'] == cur_id) & (sort_df['Змінено_dt'] < sort_df['Змінено_dt'][max_mod_idx]) & (sort_df['Дата_dt'].dt.date < current_date_obj) & (sort_df['TG ID'] == TG_ID)].index.tolist())
-        if sort_df['Статус_clean'][max_mod_idx] == 'ухвалено':
-            index_to_drop.extend(sort_df.loc[(sort_df['ID'] == cur_id) & (sort_df['Змінено_dt'] < sort_df['Змінено_dt'][max_mod_idx]) & (sort_df['Статус_clean'].isin(['на розгляді', 'ухвалено'])) & (sort_df['TG ID'] == TG_ID)].index.tolist())
-            # index_to_drop.extend(sort_df.loc[(sort_df['ID'] == cur_id) & (sort_df['Змінено_dt'] < sort_df['Змінено_dt'][max_mod_idx]) & (sort_df['Статус_clean'].isin(['на розгляді', 'ухвалено'])) & (sort_df['TG ID'] != TG_ID) & (sort_df['Дата_dt'].isna())].index.tolist())
-            if pd.notna(sort_df['Дата_dt'][max_mod_idx]):
-                if sort_df['Дата_dt'].dt.date[max_mod_idx] < current_date_obj:
-                    index_to_drop.extend(sort_df.loc[(sort_df['ID'] == cur_id) & (sort_df['Змінено_dt'] < sort_df['Змінено_dt'][max_mod_idx]) & (sort_df['Статус_clean'].isin(['на розгляді', 'ухвалено'])) & (sort_df['TG ID'] != TG_ID)].index.tolist())
-                    
-    unique_index_to_drop = list(set(index_to_drop))
-    records_to_keep = sort_df.drop(index=unique_index_to_drop).copy()
-    
-    # Видаляємо допоміжні стовпці перед збереженням
-    if 'Статус_clean' in records_to_keep.columns:
-        records_to_keep = records_to_keep.drop(columns=['Статус_clean'])
-    if 'Дата_clean' in records_to_keep.columns:
-        records_to_keep = records_to_keep.drop(columns=['Дата_clean'])
-    if 'Дата_dt' in records_to_keep.columns:
-        records_to_keep = records_to_keep.drop(columns=['Дата_dt'])
-    if 'Змінено_dt' in records_to_keep.columns:
-        records_to_keep = records_to_keep.drop(columns=['Змінено_dt'])
-    if 'Змінено_clean' in records_to_keep.columns:
-        records_to_keep = records_to_keep.drop(columns=['Змінено_clean'])
-
-    # Оновлюємо глобальний DataFrame
-    queue_df = records_to_keep
-    # 3. Зберігаємо оновлений DataFrame у Google Sheet
-    if not save_queue_data_full(queue_df): # Перевіряємо результат збереження
-        logger.error(f"{logger_info_prefix}: Помилка при збереженні очищеної черги в Google Sheet.")
+    # 2. Визначаємо рядки для видалення одним векторним проходом
+    drop_positions = compute_cleanup_drop_positions(sort_df, datetime.date.today())
+    if not drop_positions:
+        logger.info(f"{logger_info_prefix}: Немає записів для очищення. Залишилось {initial_records_count} записів.")
+        return 0
+
+    # 3. Видаляємо лише ці рядки в Google Sheet (batchUpdate deleteDimension)
+    expected_ids = [sort_df['ID'].iat[pos] for pos in drop_positions]
+    if not await delete_queue_rows_async(drop_positions, expected_ids): # Перевіряємо результат видалення
+        logger.error(f"{logger_info_prefix}: Помилка при видаленні рядків черги в Google Sheet.")
         return -1 # Повертаємо -1, щоб сигналізувати про помилку
+    # Оновлюємо репозиторій і глобальний DataFrame
+    QUEUE_REPO.load(sort_df.drop(index=sort_df.index[drop_positions]))
+    queue_df = QUEUE_REPO.frame
 
     records_removed_count = initial_records_count - len(queue_df)
 
@@ -1566,7 +2049,7 @@ async def test_poll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if context.args:
         user_id = context.args[0]
     else:
-        users = get_users_for_date_from_active_sheet('')
+        users = await get_users_for_date_from_active_sheet_async('')
         for u in users:
             if u.get('tg_id') == str(requester_id):
                 user_id = u['id']
@@ -1706,9 +2189,7 @@ async def join_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         context.user_data.clear() # Очищуємо тимчасові дані
         return ConversationHandler.END # Завершуємо розмову 
         
-    global queue_df # Оновлюємо DataFrame перед початком діалогу
-    queue_df = load_queue_data()
-    if queue_df is None: # Перевірка на помилку завантаження
+    if not await refresh_queue(QUEUE_REFRESH_MAX_AGE_SECONDS): # Перевірка на помилку завантаження
         logger.error(f"Помилка завантаження даних для запису в чергу або перенесення дати відвідування користувача {get_user_log_info(update.effective_user)}.")
         await update.message.reply_text(
             "Сталася помилка при завантаженні даних. Будь ласка, спробуйте повторити спробу пізніше.",
@@ -1752,20 +2233,16 @@ async def join_get_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     context.user_data.pop('warning_shown', None)
     context.user_data.pop('prediction_bounds', None)
     
-    # Знаходимо останній актуальний запис для цього ID
-    temp_df_for_prev = queue_df.copy()
-    temp_df_for_prev['Змінено_dt'] = pd.to_datetime(temp_df_for_prev['Змінено'].astype(str), format="%d.%m.%Y %H:%M:%S", dayfirst=True, errors='coerce')
-    temp_df_for_prev['Змінено_dt'] = temp_df_for_prev['Змінено_dt'].fillna("01.01.2025 00:00:00")
-
-    last_record_for_id = temp_df_for_prev[(temp_df_for_prev['ID'] == user_id_input) & (temp_df_for_prev['Статус'] == 'Ухвалено')].sort_values(by='Змінено_dt', ascending=False)
+    # Знаходимо останній ухвалений запис для цього ID
+    last_record_for_id = QUEUE_REPO.latest(user_id_input, status='Ухвалено')
     
     previous_date = ''
-    if not last_record_for_id.empty:
+    if last_record_for_id is not None:
         # Беремо останній запис і його дату, якщо вона не порожня
-        last_date = last_record_for_id.iloc[0]['Дата']
-        last_note = last_record_for_id.iloc[0]['Примітки']
-        last_status = last_record_for_id.iloc[0]['Статус']
-        if pd.isna(last_date) or last_date == '': # Перевіряємо на NaN або порожній рядок
+        last_date = last_record_for_id['Дата']
+        last_note = last_record_for_id['Примітки']
+        last_status = last_record_for_id['Статус']
+        if last_date == '': # Перевіряємо на порожній рядок
             previous_date = '' # Якщо останній запис був скасований або порожній, то попередньої дати немає
         else:
             previous_date = last_date # Зберігаємо попередню дату
@@ -1828,7 +2305,6 @@ async def join_get_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
 async def join_get_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отримує дату від користувача, перевіряє її, оновлює або додає запис."""
-    global queue_df
     date_input = update.message.text.strip()
     
     user_id = context.user_data.get('temp_id')
@@ -1919,8 +2395,7 @@ async def join_get_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             # Calculate probability for chosen date
             try:
                 dist = prediction['dist']
-                chosen_ord = get_ordinal_date(chosen_date)
-                chosen_prob = stats.t.cdf(chosen_ord + 1, dist['df'], loc=dist['loc'], scale=dist['scale']) * 100
+                chosen_prob = calculate_date_probability(chosen_date, dist)
             except Exception as e:
                 logger.error(f"Error calculating chosen date probability: {e}")
                 chosen_prob = 0
@@ -1930,8 +2405,7 @@ async def join_get_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
                 # Якщо prediction['mean'] у минулому, chosen_prob все одно може бути високою (наприклад, 100%)
                 if chosen_prob < 50:
                     try:
-                        prob_mean = calculate_date_probability(prediction['mean'], dist)
-                        prob_h90 = calculate_date_probability(prediction['h90'], dist)
+                        prob_mean, prob_h90 = calculate_date_probabilities([prediction['mean'], prediction['h90']], dist)
                         
                         range_info = f"`{prediction['mean'].strftime('%d.%m.%Y')}` ({prob_mean:.0f}%) - `{prediction['h90'].strftime('%d.%m.%Y')}` ({prob_h90:.0f}%)"
                     except Exception as e:
@@ -2004,9 +2478,9 @@ async def join_get_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     
     new_entry_df = pd.DataFrame([new_entry])
     # Спроба зберегти дані
-    if save_queue_data(new_entry_df): # Перевіряємо результат збереження
+    if await save_queue_data_async(new_entry_df): # Перевіряємо результат збереження
         # Оновлюємо глобальний DataFrame ТІЛЬКИ ПІСЛЯ УСПІШНОГО ЗБЕРЕЖЕННЯ
-        queue_df = pd.concat([queue_df, new_entry_df], ignore_index=True)
+        append_queue_record(new_entry)
         if previous_state:
             notification_text = f"✅ Користувач {update.effective_user.mention_html()}\nпереніс запис для\nID <code>{user_id}</code> на <code>{chosen_date.strftime('%d.%m.%Y')}</code>" 
         else:
@@ -2039,10 +2513,7 @@ async def cancel_record_start(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         context.user_data.clear() # Очищуємо тимчасові дані
         return ConversationHandler.END # Завершуємо розмову 
-    global queue_df # Оновлюємо DataFrame перед початком діалогу
-    queue_df = load_queue_data() # Оновлюємо DataFrame перед початком діалогу
-
-    if queue_df is None: # Перевірка на помилку завантаження
+    if not await refresh_queue(QUEUE_REFRESH_MAX_AGE_SECONDS): # Перевірка на помилку завантаження
         logger.error(f"Помилка завантаження даних для скасування запису користувача {get_user_log_info(update.effective_user)}.")
         await update.message.reply_text(
             "Сталася помилка при завантаженні даних. Будь ласка, спробуйте повторити спробу пізніше.",
@@ -2064,7 +2535,6 @@ async def cancel_record_start(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def cancel_record_get_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отримує ID для скасування, перевіряє його та видаляє запис."""
-    global queue_df
     
     id_to_cancel = update.message.text.strip()
     telegram_user_data = context.user_data.get('telegram_user_data')
@@ -2084,14 +2554,11 @@ async def cancel_record_get_id(update: Update, context: ContextTypes.DEFAULT_TYP
         return CANCEL_GETTING_ID # Залишаємося в тому ж стані
 
     # Знаходимо останній актуальний запис для цього ID
-    temp_df_for_prev = queue_df.copy()
-    temp_df_for_prev['Змінено_dt'] = pd.to_datetime(temp_df_for_prev['Змінено'].astype(str), format="%d.%m.%Y %H:%M:%S", dayfirst=True, errors='coerce').fillna("01.01.2025 00:00:00")
-
-    last_record_for_id = temp_df_for_prev[temp_df_for_prev['ID'] == id_to_cancel].sort_values(by='Змінено_dt', ascending=False)
+    last_record_for_id = QUEUE_REPO.latest(id_to_cancel)
     # Перевіряємо, чи є актуальний (непорожній) запис.
     # Додаткова умова, що статус не "Скасовано" або "Відхилено", щоб уникнути повторного скасування
-    if (not last_record_for_id.empty and last_record_for_id.iloc[0]['Дата'] != '') or (not last_record_for_id.empty and last_record_for_id.iloc[0]['Дата'] == '' and last_record_for_id.iloc[0]['Статус'] == 'Відхилено'):
-        previous_date = last_record_for_id.iloc[0]['Дата'] # Беремо дату з останнього запису
+    if last_record_for_id is not None and (last_record_for_id['Дата'] != '' or last_record_for_id['Статус'] == 'Відхилено'):
+        previous_date = last_record_for_id['Дата'] # Беремо дату з останнього запису
         # Створюємо новий запис для скасування
         new_entry = {
             'ID': id_to_cancel,
@@ -2104,9 +2571,9 @@ async def cancel_record_get_id(update: Update, context: ContextTypes.DEFAULT_TYP
         }
         
         new_entry_df = pd.DataFrame([new_entry])
-        if save_queue_data(new_entry_df): # Перевіряємо результат збереження
+        if await save_queue_data_async(new_entry_df): # Перевіряємо результат збереження
             # Оновлюємо глобальний DataFrame ТІЛЬКИ ПІСЛЯ УСПІШНОГО ЗБЕРЕЖЕННЯ
-            queue_df = pd.concat([queue_df, new_entry_df], ignore_index=True)
+            append_queue_record(new_entry)
             logger.info(f"Запис з ID '{id_to_cancel}' на `{previous_date}` успішно скасовано користувачем {get_user_log_info(update.effective_user)}.")
             notification_text = f"❎ Користувач {update.effective_user.mention_html()} скасував запис для\nID <code>{id_to_cancel}</code> на <code>{previous_date}</code>" 
             await send_group_notification(context, notification_text)
@@ -2121,7 +2588,7 @@ async def cancel_record_get_id(update: Update, context: ContextTypes.DEFAULT_TYP
                 "Cталася помилка при скасуванні вашого запису. Будь ласка, спробуйте повторити спробу пізніше.",
                 reply_markup=MAIN_KEYBOARD
             )
-    elif not last_record_for_id.empty and last_record_for_id.iloc[0]['Дата'] == '' and last_record_for_id.iloc[0]['Статус'] != 'Відхилено':
+    elif last_record_for_id is not None:
         logger.info(f"Користувач {get_user_log_info(update.effective_user)} спробував повторно скасувати запис з ID '{id_to_cancel}'.")
         await update.message.reply_text(
             f"Запит на скасування номеру `{id_to_cancel}` вже прийнято.",
@@ -2142,9 +2609,7 @@ async def cancel_record_get_id(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def status_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Запускає процес перегляду статусу, просячи користувача ввести ID."""
-    global queue_df # Оновлюємо DataFrame перед початком діалогу
-    queue_df = load_queue_data()
-    if queue_df is None: # Перевірка на помилку завантаження
+    if not await refresh_queue(QUEUE_REFRESH_MAX_AGE_SECONDS): # Перевірка на помилку завантаження
         logger.error(f"Помилка завантаження даних для перегляду статусу користувача {get_user_log_info(update.effective_user)}.")
         await update.message.reply_text(
             "Сталася помилка при завантаженні даних. Будь ласка, спробуйте повторити спробу пізніше.",
@@ -2163,7 +2628,6 @@ async def status_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
 async def status_get_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отримує ID від користувача, перевіряє його та відображає статус останнього запису для цього ID."""
-    global queue_df
     id_to_check = update.message.text.strip()
     user_tg_id = update.effective_user.id
 
@@ -2179,10 +2643,10 @@ async def status_get_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         )
         return STATUS_GETTING_ID # Залишаємося в тому ж стані
 
-    # Знаходимо всі записи, що стосуються цього ID
-    id_records = queue_df[queue_df['ID'] == id_to_check].copy() 
+    # Знаходимо останній запис для цього ID
+    latest_record = QUEUE_REPO.latest(id_to_check)
     
-    if id_records.empty:
+    if latest_record is None:
         logger.info(f"Користувач {get_user_log_info(update.effective_user)} запитав статус для ID '{id_to_check}'.")
         await update.message.reply_text(
             f"Запис з номером `{id_to_check}` не знайдено.",
@@ -2192,17 +2656,6 @@ async def status_get_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         context.user_data.clear() # Очищуємо тимчасові дані
         return ConversationHandler.END
 
-    # Знаходимо останній актуальний запис для цього ID
-    id_records['Змінено_dt'] = pd.to_datetime(
-        id_records['Змінено'].astype(str),
-        format="%d.%m.%Y %H:%M:%S",
-        dayfirst=True,
-        errors='coerce'
-    )
-    id_records['Змінено_dt'] = id_records['Змінено_dt'].fillna(datetime.datetime(2025, 1, 1, 0, 0, 0)) # Для старих записів без часу зміни
-
-    latest_record = id_records.sort_values(by='Змінено_dt', ascending=False).iloc[0]
-
     # Визначаємо, чи є цей запис актуальним (не скасованим)
     is_actual_record = (latest_record['Дата'].strip() != '')
 
@@ -2250,9 +2703,7 @@ async def status_get_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
 async def show_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Запускає процес відображення черги, пропонуючи вибрати опцію."""
-    global queue_df # Оновлюємо DataFrame перед початком діалогу
-    queue_df = load_queue_data() 
-    if queue_df is None: # Перевірка на помилку завантаження
+    if not await refresh_queue(QUEUE_REFRESH_MAX_AGE_SECONDS): # Перевірка на помилку завантаження
         logger.error(f"Помилка завантаження даних для перегляду черги користувача {get_user_log_info(update.effective_user)}.")
         await update.message.reply_text(
             "Сталася помилка при завантаженні даних. Будь ласка, спробуйте повторити спробу пізніше.",
@@ -2273,8 +2724,8 @@ async def show_get_option(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     if choice == BUTTON_TEXT_SHOW_ALL:
         logger.info(f"Користувач {get_user_log_info(update.effective_user)} обрав перегляд усіх записів.")
-        # Передаємо весь DataFrame до display_queue_data, яка сама відфільтрує актуальні
-        await display_queue_data(update, queue_df, title="Усі записи в черзі зі статусом \"Ухвалено\":", reply_markup=MAIN_KEYBOARD)
+        # Передаємо останні записи для кожного ID, display_queue_data відфільтрує актуальні
+        await display_queue_data(update, QUEUE_REPO.latest_records(), title="Усі записи в черзі зі статусом \"Ухвалено\":", reply_markup=MAIN_KEYBOARD)
         context.user_data.clear() # Очищуємо тимчасові дані
         return ConversationHandler.END
     elif choice == BUTTON_TEXT_SHOW_DATE:
@@ -2361,17 +2812,11 @@ async def show_get_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             )
             return SHOW_GETTING_DATE
 
-        # Отримуємо актуальні записи
-        temp_df = queue_df.copy()
-        temp_df['Змінено_dt'] = pd.to_datetime(temp_df['Змінено'].astype(str), format="%d.%m.%Y %H:%M:%S", dayfirst=True, errors='coerce')
-        temp_df['Змінено_dt'] = temp_df['Змінено_dt'].fillna("01.01.2025 00:00:00")
-        #temp_df = temp_df.dropna(subset=['Змінено_dt'])
-        actual_records = temp_df.sort_values(by=['ID', 'Змінено_dt'], ascending=[True, True]).drop_duplicates(subset='ID', keep='last')
-        actual_queue = actual_records[actual_records['Дата'].astype(str).str.strip() != '']
-        # Фільтруємо актуальні записи за обраною датою
-        filtered_df = actual_queue[
-            (actual_queue['Дата'] == chosen_date.strftime("%d.%m.%Y")) &
-            (actual_queue['Статус'].astype(str).str.strip().str.lower() == 'ухвалено')
+        # Фільтруємо останні записи за обраною датою
+        chosen_date_str = chosen_date.strftime("%d.%m.%Y")
+        filtered_records = [
+            record for record in QUEUE_REPO.latest_records()
+            if record['Дата'] == chosen_date_str and record['Статус'].strip().lower() == 'ухвалено'
         ]
         
         logger.info(f"Користувач {get_user_log_info(update.effective_user)} переглянув записи на дату: {chosen_date.strftime('%d.%m.%Y')}")
@@ -2379,9 +2824,9 @@ async def show_get_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         while next_working_day.weekday() >= 5:  # 5 is Saturday, 6 is Sunday
             next_working_day += datetime.timedelta(days=1)
         if chosen_date == next_working_day:
-            await display_queue_data(update, filtered_df, title=f"Поточна черга зі статусом \"Ухвалено\" на `{chosen_date.strftime('%d.%m.%Y')}`:\n", reply_markup=MAIN_KEYBOARD, iConfirmation = False) #iConfirmation статус про підтвердження візиту на завтра при перегляді черги на завтра
+            await display_queue_data(update, filtered_records, title=f"Поточна черга зі статусом \"Ухвалено\" на `{chosen_date.strftime('%d.%m.%Y')}`:\n", reply_markup=MAIN_KEYBOARD, iConfirmation = False) #iConfirmation статус про підтвердження візиту на завтра при перегляді черги на завтра
         else:
-            await display_queue_data(update, filtered_df, title=f"Поточна черга зі статусом \"Ухвалено\" на `{chosen_date.strftime('%d.%m.%Y')}`:\n", reply_markup=MAIN_KEYBOARD)
+            await display_queue_data(update, filtered_records, title=f"Поточна черга зі статусом \"Ухвалено\" на `{chosen_date.strftime('%d.%m.%Y')}`:\n", reply_markup=MAIN_KEYBOARD)
         context.user_data.clear() # Очищуємо тимчасові дані
         return ConversationHandler.END
 
@@ -2404,27 +2849,21 @@ async def notify_status(context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     logger.info("Початок перевірки зміни статусів записів.")
     
-    # 1. Завантажуємо дані з Google Sheets (використовуйте вашу функцію)
-    global queue_df
-    queue_df = load_queue_data()
-    
-    # 2. Очищаємо та готуємо дані
-    queue_df['Змінено_dt'] = pd.to_datetime(queue_df['Змінено'], format="%d.%m.%Y %H:%M:%S", errors='coerce')
-    # Використовуємо стару дату (2000 рік), щоб записи без дати зміни не перекривали актуальні записи при сортуванні
-    queue_df['Змінено_dt'] = queue_df['Змінено_dt'].fillna(pd.Timestamp("2000-01-01 00:00:00"))
-    #queue_df.dropna(subset=['Дата', 'Примітки', 'Статус', 'Змінено'], inplace=True)
-    queue_df.dropna(inplace=True)
-    queue_df['TG ID'] = queue_df['TG ID'].astype(str)    
+    # 1. Завантажуємо дані з Google Sheets
+    if not await refresh_queue():
+        logger.error("Не вдалося завантажити чергу для перевірки статусів.")
+        return
 
-    # 3. Знаходимо найактуальніший запис для кожного користувача
-    latest_entries = queue_df.loc[queue_df.groupby('ID')['Змінено_dt'].idxmax()]
+    # 2. Найактуальніший запис для кожного користувача
+    latest_entries = QUEUE_REPO.latest_records()
 
     # 4. Завантажуємо останній відомий стан
     last_known_state = load_status_state()
     
-    # 5. Перевіряємо зміни та відправляємо сповіщення
+    # 5. Перевіряємо зміни та збираємо сповіщення
     new_state = {}
-    for index, row in latest_entries.iterrows():
+    notifications = []
+    for row in latest_entries:
         user_id = row['ID']
         target_date = row['Дата']
         note = row['Примітки']
@@ -2464,8 +2903,12 @@ async def notify_status(context: ContextTypes.DEFAULT_TYPE) -> None:
                 notification = notification_text+notification_warning
                 # Надсилаємо сповіщення в групу
                 #await send_group_notification(context, notification)
-                # Надсилаємо особисте повідомлення користувачу
-                await send_user_notification(context, tg_id, notification)
+                # Особисте повідомлення користувачу
+                if tg_id != '':
+                    notifications.append(broadcast.OutboundMessage(
+                        key=f"{user_id}|{target_date}|{current_status}|{modified}",
+                        chat_id=tg_id, text=notification, reply_markup=MAIN_KEYBOARD
+                    ))
         # Оновлюємо стан для збереження
         new_state[user_id] = {
             'date': target_date,
@@ -2474,8 +2917,13 @@ async def notify_status(context: ContextTypes.DEFAULT_TYPE) -> None:
             'confirmation': confirmation
         }
 
-    # 6. Зберігаємо оновлений стан
+    # 6. Надсилаємо сповіщення; журнал розсилки захищає від повторів, якщо стан не встиг зберегтися
+    journal = broadcast.get_journal()
+    await broadcast.broadcast(context.bot, "status", notifications, journal)
+
+    # 7. Зберігаємо оновлений стан
     save_status_state(new_state)
+    await journal.discard("status")
     logger.info("Завершення перевірки зміни статусів записів.")
     
 # --- ПОВІДОМЛЕННЯ НАГАДУВАННЯ ПРО ЗАПИС ЗА РОЗКЛАДОМ ---
@@ -2486,20 +2934,13 @@ async def date_reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     logger.info("Початок процедури нагадування і підтвердження дати візиту.")
     
-    # 1. Завантажуємо дані з Google Sheets (використовуйте вашу функцію)
-    global queue_df
-    queue_df = load_queue_data()
-    
-    # 2. Очищаємо та готуємо дані
-    queue_df['Змінено_dt'] = pd.to_datetime(queue_df['Змінено'], format="%d.%m.%Y %H:%M:%S", errors='coerce')
-    # Використовуємо стару дату (2000 рік), щоб записи без дати зміни не перекривали актуальні записи при сортуванні
-    queue_df['Змінено_dt'] = queue_df['Змінено_dt'].fillna(pd.Timestamp("2000-01-01 00:00:00"))
-    queue_df['Дата_dt'] = pd.to_datetime(queue_df['Дата'], format="%d.%m.%Y", errors='coerce').dt.date
-    queue_df.dropna(inplace=True)
-    queue_df['TG ID'] = queue_df['TG ID'].astype(str)    
+    # 1. Завантажуємо дані з Google Sheets
+    if not await refresh_queue():
+        logger.error("Не вдалося завантажити чергу для нагадувань.")
+        return
 
-    # 3. Знаходимо найактуальніший запис для кожного користувача
-    latest_entries = queue_df.loc[queue_df.groupby('ID')['Змінено_dt'].idxmax()]
+    # 2. Найактуальніший запис для кожного користувача
+    latest_entries = QUEUE_REPO.latest_records()
     
     # 4. Знаходимо дати на сьогодні, через день і три дні
     current_date_obj = datetime.date.today()
@@ -2508,11 +2949,15 @@ async def date_reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
     # Define a timedelta of 3 days
     three_days_later = current_date_obj + datetime.timedelta(days=3)
     
-    # 5. Перевіряємо дати та відправляємо сповіщення
-    for index, row in latest_entries.iterrows():
+    # 5. Перевіряємо дати та збираємо нагадування
+    notifications = []
+    for row in latest_entries:
         user_id = row['ID']
         target_date = row['Дата']
-        target_date_dt = row['Дата_dt']
+        try:
+            target_date_dt = datetime.datetime.strptime(target_date.strip(), "%d.%m.%Y").date()
+        except ValueError:
+            continue # Скасовані записи та некоректні дати
         note = row['Примітки']
         current_status = row['Статус']
         modified = row['Змінено']
@@ -2537,9 +2982,13 @@ async def date_reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
             notification_text = f"{emo}<code>Нагадування!</code>\n  Для вашого номеру <code>{user_id}</code> призначено візит {nr_days}: <code>{target_date}</code>"
             notification_warning = f'\nПримітка: <code>{note}</code>' if note !='' else ''
             notification = notification_text+notification_warning
-            # Надсилаємо особисте повідомлення користувачу
-            await send_user_notification(context, tg_id, notification)
+            # Особисте повідомлення користувачу
+            if tg_id != '':
+                notifications.append(broadcast.OutboundMessage(
+                    key=f"{user_id}|{target_date}", chat_id=tg_id, text=notification, reply_markup=MAIN_KEYBOARD
+                ))
 
+    await broadcast.broadcast(context.bot, f"reminder_{current_date_obj.isoformat()}", notifications)
     logger.info("Завершення процедури нагадування і підтвердження дати візиту.")
 
 
@@ -2570,7 +3019,7 @@ async def check_new_daily_sheet(context: ContextTypes.DEFAULT_TYPE) -> None:
             logger.debug("Опитування вже надіслано сьогодні, пропускаємо перевірку")
             return
     
-    existing_sheets = get_sheets_list(STATS_SHEET_ID)
+    existing_sheets = await get_sheets_list_async(STATS_SHEET_ID)
     if not existing_sheets:
         logger.warning("Не вдалося отримати список аркушів")
         return
@@ -2628,12 +3077,13 @@ async def send_visit_poll(context: ContextTypes.DEFAULT_TYPE) -> None:
     
     logger.info(f"Надсилаємо опитування для дати {next_reception_sheet}")
     
-    users = get_users_for_date_from_active_sheet(next_reception_sheet)
+    users = await get_users_for_date_from_active_sheet_async(next_reception_sheet)
     
     if not users:
         logger.info(f"Користувачів для опитування на {next_reception_sheet} не знайдено")
         return
     
+    polls = []
     for user in users:
         user_id = user['id']
         tg_id = user['tg_id']
@@ -2642,18 +3092,17 @@ async def send_visit_poll(context: ContextTypes.DEFAULT_TYPE) -> None:
             logger.debug(f"TG ID для користувача {user_id} не знайдено, пропускаємо")
             continue
         
-        try:
-            await context.bot.send_message(
-                chat_id=tg_id,
-                text=get_poll_text(user_id, next_reception_sheet),
-                reply_markup=get_poll_keyboard(user_id),
-                parse_mode="HTML"
-            )
-            logger.info(f"Опитування надіслано користувачу {user_id} (TG: {tg_id})")
-        except Exception as e:
-            logger.error(f"Помилка надсилання опитування користувачу {user_id} (TG: {tg_id}): {e}")
+        polls.append(broadcast.OutboundMessage(
+            key=str(user_id),
+            chat_id=tg_id,
+            text=get_poll_text(user_id, next_reception_sheet),
+            reply_markup=get_poll_keyboard(user_id),
+            priority=broadcast.PRIORITY_POLL
+        ))
     
-    logger.info(f"Опитування надіслано {len(users)} користувачам")
+    # Журнал за датою аркуша: повторний запуск після збою не надсилає опитування вдруге
+    result = await broadcast.broadcast(context.bot, f"poll_{next_reception_sheet}", polls)
+    logger.info(f"Опитування надіслано {result.sent} користувачам")
 
     
 def get_poll_keyboard(user_id: str) -> InlineKeyboardMarkup:
@@ -2692,7 +3141,6 @@ async def handle_poll_response(update: Update, context: ContextTypes.DEFAULT_TYP
     Обробляє відповіді на опитування про візит.
     Підтримує: poll_confirm, poll_reschedule, poll_cancel, poll_date, poll_cancel_confirm
     """
-    global queue_df
     query = update.callback_query
     await query.answer()
 
@@ -2722,7 +3170,7 @@ async def handle_poll_response(update: Update, context: ContextTypes.DEFAULT_TYP
         user_id = callback_data.replace(POLL_CONFIRM + "_", "")
         confirmed_date = context.bot_data.get('next_reception_sheet', '')
         
-        update_active_sheet_status(user_id, "Підтвердив візит")
+        await update_active_sheet_status_async(user_id, "Підтвердив візит")
         
         last_known_state = load_status_state()
         if user_id in last_known_state:
@@ -2785,7 +3233,7 @@ async def handle_poll_response(update: Update, context: ContextTypes.DEFAULT_TYP
         if len(parts) == 2:
             user_id, date_str = parts
             
-            update_active_sheet_status(user_id, "Відклав візит")
+            await update_active_sheet_status_async(user_id, "Відклав візит")
             
             try:
                 chosen_date = datetime.datetime.strptime(date_str, "%d.%m.%Y").date()
@@ -2810,8 +3258,8 @@ async def handle_poll_response(update: Update, context: ContextTypes.DEFAULT_TYP
             }
             
             new_entry_df = pd.DataFrame([new_entry])
-            if save_queue_data(new_entry_df):
-                queue_df = pd.concat([queue_df, new_entry_df], ignore_index=True)
+            if await save_queue_data_async(new_entry_df):
+                append_queue_record(new_entry)
                 
                 try:
                     await query.message.edit_text(
@@ -2841,7 +3289,7 @@ async def handle_poll_response(update: Update, context: ContextTypes.DEFAULT_TYP
     elif callback_data.startswith(POLL_CANCEL_CONFIRM + "_"):
         user_id = callback_data.replace(POLL_CANCEL_CONFIRM + "_", "")
         
-        update_active_sheet_status(user_id, "Скасував")
+        await update_active_sheet_status_async(user_id, "Скасував")
         
         telegram_user_data = {
             'TG ID': user_tg_id,
@@ -2862,8 +3310,8 @@ async def handle_poll_response(update: Update, context: ContextTypes.DEFAULT_TYP
         }
         
         new_entry_df = pd.DataFrame([new_entry])
-        if save_queue_data(new_entry_df):
-            queue_df = pd.concat([queue_df, new_entry_df], ignore_index=True)
+        if await save_queue_data_async(new_entry_df):
+            append_queue_record(new_entry)
             
             try:
                 await query.message.edit_text(
@@ -2936,7 +3384,6 @@ async def handle_poll_custom_date(update: Update, context: ContextTypes.DEFAULT_
     if not context.user_data.get('poll_awaiting_custom_date'):
         return  # Не обробляємо, передаємо далі (наступна група)
     
-    global queue_df
     user_tg_id = str(update.effective_user.id)
     date_input = update.message.text.strip()
     user_id = context.user_data.get('poll_reschedule_user_id', '')
@@ -2995,10 +3442,9 @@ async def handle_poll_custom_date(update: Update, context: ContextTypes.DEFAULT_
     # Якщо це підтвердження тієї самої дати - пропускаємо попередження
     if not (warning_shown and warned_date_str == date_str):
         try:
-            import daily_sheets_sync
             numeric_id = daily_sheets_sync.id_to_numeric(user_id)
             if numeric_id:
-                prediction = daily_sheets_sync.calculate_prediction_with_daily_data(int(numeric_id))
+                prediction = calculate_prediction(int(numeric_id))
                 if prediction and prediction.get('dist'):
                     dist = prediction['dist']
                     warn_msg = None
@@ -3058,7 +3504,7 @@ async def handle_poll_custom_date(update: Update, context: ContextTypes.DEFAULT_
         except Exception as e:
             logger.warning(f"Помилка перевірки дати для попередження в poll: {e}")
     
-    update_active_sheet_status(user_id, "Відклав візит")
+    await update_active_sheet_status_async(user_id, "Відклав візит")
     
     telegram_user_data = {
         'TG ID': user_tg_id,
@@ -3079,8 +3525,8 @@ async def handle_poll_custom_date(update: Update, context: ContextTypes.DEFAULT_
     }
     
     new_entry_df = pd.DataFrame([new_entry])
-    if save_queue_data(new_entry_df):
-        queue_df = pd.concat([queue_df, new_entry_df], ignore_index=True)
+    if await save_queue_data_async(new_entry_df):
+        append_queue_record(new_entry)
         
         await update.message.reply_text(
             f"Заявку на перенесення запису створено.\n"
@@ -3163,6 +3609,7 @@ def main() -> None:
         .write_timeout(30.0) # Таймаут на запис запиту
         .connect_timeout(30.0) # Таймаут на встановлення з'єднання
         .pool_timeout(30.0)  # Таймаут пулу з'єднань
+        .rate_limiter(broadcast.OutboundRateLimiter()) # Спільний ліміт: відповіді користувачам мають пріоритет над розсилками
         .build()
    )
     # Register the error handler
@@ -3311,6 +3758,25 @@ def main() -> None:
     # --- Налаштування планувальника ---
     kyiv_tz = timezone('Europe/Kyiv')        
     
+    # Фонове оновлення кешу щоденних аркушів і моделі прогнозу (в усіх оточеннях).
+    # Обробники запитів лише читають знімок моделі і не звертаються до Google Sheets.
+    application.job_queue.run_repeating(
+        callback=refresh_prediction_data,
+        interval=datetime.timedelta(minutes=PREDICTION_REFRESH_INTERVAL_MINUTES),
+        first=0,
+        name="Prediction Data Refresh"
+    )
+    logger.info(f"Завдання 'Prediction Data Refresh' заплановано кожні {PREDICTION_REFRESH_INTERVAL_MINUTES} хвилин")
+    
+    # Відкладений запис статусів опитування в Active sheet (також дописує журнал після перезапуску)
+    application.job_queue.run_repeating(
+        callback=flush_active_status_updates,
+        interval=ACTIVE_STATUS_FLUSH_SECONDS,
+        first=ACTIVE_STATUS_FLUSH_SECONDS,
+        name="Active Status Flush"
+    )
+    logger.info(f"Завдання 'Active Status Flush' заплановано кожні {ACTIVE_STATUS_FLUSH_SECONDS} секунд")
+    
     # Заплановані завдання запускаються тільки в production оточенні
     if ENVIRONMENT == "production":
         # Це завдання буде запускатися щоденно о 3:00
@@ -18,6 +18,9 @@ from dataclasses import dataclass
 from typing import List, Dict, Tuple, Optional
 import statistics
 
+from daily_sheet_parser import load_daily_sheet
+import attendance_store
+
 
 SHEET_ID = '1d9OG-0b7wxxqrOujC9v6ikhjMKL2ei3wfrfaG61zSjA'
 TODO_GID = '84071606'
@@ -109,78 +112,23 @@ def fetch_todo_list() -> List[TodoEntry]:
         return []
 
 
+def _queue_entries(rows) -> List[QueueEntry]:
+    return [QueueEntry(position=row.position, queue_id=row.queue_id, status=row.status, notes=row.notes)
+            for row in rows if row.position > 0 and row.queue_id]
+
+
 def parse_left_section(csv_path: str) -> List[QueueEntry]:
     """
     Парсить ліву секцію CSV (результати попереднього дня).
     """
-    entries = []
-    
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        lines = list(reader)
-        
-        for row in lines:
-            if len(row) < 3:
-                continue
-            
-            try:
-                pos_str = row[0].strip() if row[0] else ''
-                if not pos_str or not pos_str.isdigit():
-                    continue
-                
-                position = int(pos_str)
-                queue_id = row[1].strip() if len(row) > 1 else ''
-                status = row[2].strip() if len(row) > 2 else ''
-                notes = row[3].strip() if len(row) > 3 else ''
-                
-                if position > 0 and queue_id:
-                    entries.append(QueueEntry(
-                        position=position,
-                        queue_id=queue_id,
-                        status=status,
-                        notes=notes
-                    ))
-            except (ValueError, IndexError):
-                continue
-    
-    return entries
+    return _queue_entries(load_daily_sheet(csv_path).previous_rows)
 
 
 def parse_right_section(csv_path: str) -> List[QueueEntry]:
     """
     Парсить праву секцію CSV (поточна/майбутня черга).
     """
-    entries = []
-    
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        lines = list(reader)
-        
-        for row in lines:
-            if len(row) < 8:
-                continue
-            
-            try:
-                pos_str = row[5].strip() if row[5] else ''
-                if not pos_str or not pos_str.isdigit():
-                    continue
-                
-                position = int(pos_str)
-                notes = row[6].strip() if len(row) > 6 else ''
-                queue_id = row[7].strip() if len(row) > 7 else ''
-                status = row[8].strip() if len(row) > 8 else ''
-                
-                if position > 0 and queue_id:
-                    entries.append(QueueEntry(
-                        position=position,
-                        queue_id=queue_id,
-                        status=status,
-                        notes=notes
-                    ))
-            except (ValueError, IndexError):
-                continue
-    
-    return entries
+    return _queue_entries(load_daily_sheet(csv_path).current_rows)
 
 
 def analyze_day(entries: List[QueueEntry]) -> Optional[DayStats]:
@@ -227,10 +175,42 @@ def analyze_day(entries: List[QueueEntry]) -> Optional[DayStats]:
     )
 
 
+def _historical_stats_from_store(store: attendance_store.AttendanceStore) -> List[DayStats]:
+    """
+    Історична статистика з колонкового сховища (рядки попереднього прийому).
+    """
+    stats = []
+    sheet_dates = store['row_sheet_date']
+    
+    for day_ordinal in sorted(set(sheet_dates.tolist())):
+        indices = (sheet_dates == day_ordinal).nonzero()[0]
+        entries = [
+            QueueEntry(
+                position=int(store['row_position'][i]),
+                queue_id=attendance_store.format_id(int(store['row_id_main'][i]), int(store['row_id_sub'][i])),
+                status=store.status_names[store['row_status'][i]],
+                notes=''
+            )
+            for i in indices if store['row_position'][i] > 0
+        ]
+        day_stats = analyze_day(entries)
+        
+        if day_stats and day_stats.positions_processed > 0:
+            day_stats.date = datetime.fromordinal(day_ordinal).strftime('%Y-%m-%d')
+            stats.append(day_stats)
+    
+    return stats
+
+
 def load_historical_stats(cache_dir: str) -> List[DayStats]:
     """
-    Завантажує історичну статистику з усіх CSV файлів.
+    Завантажує історичну статистику: з _attendance_store.npz якщо воно
+    актуальне, інакше з усіх CSV файлів.
     """
+    store = attendance_store.load_current_store(cache_dir)
+    if store is not None:
+        return _historical_stats_from_store(store)
+    
     stats = []
     csv_files = sorted(glob.glob(os.path.join(cache_dir, '*.csv')))
     
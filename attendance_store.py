@@ -0,0 +1,175 @@
+"""
+Колонкове сховище історії відвідуваності (daily_sheets_cache/_attendance_store.npz).
+
+Будується синхронізацією з CSV кешу. Прогноз і звіти читають типізовані
+масиви одним зчитуванням замість розбору сотень CSV файлів.
+
+Таблиці:
+- point_*: точки відвідуваності (як attendance_points в attendance_data.json)
+- row_*: рядки попереднього прийому з усіх щоденних аркушів
+- day_*: хеш CSV кожного дня - рядки незмінених днів переносяться
+  з попередньої версії сховища без повторного розбору
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STORE_FILENAME = '_attendance_store.npz'
+MANIFEST_FILENAME = '_manifest.json'
+
+# Канонічний ID: "1234" або "1234/1"
+ID_PATTERN = re.compile(r'([1-9]\d*)(?:/([1-9]\d*))?')
+
+ARRAY_DTYPES = {
+    'point_date': np.int32,       # date.toordinal() дати прийому
+    'point_id_main': np.int32,
+    'point_id_sub': np.int16,
+    'point_is_live': np.bool_,
+    'row_sheet_date': np.int32,   # date.toordinal() дати аркуша (назва файлу)
+    'row_position': np.int16,
+    'row_id_main': np.int32,
+    'row_id_sub': np.int16,
+    'row_status': np.int16,       # індекс у status_names
+    'row_in_data': np.bool_,      # рядок після заголовків (DailySheet.attendance_rows)
+    'row_attended': np.bool_,
+    'row_is_live': np.bool_,
+    'day_date': np.int32,         # date.toordinal() дати аркуша; хеш - у day_hashes
+}
+
+
+def parse_id(text: str) -> Optional[Tuple[int, int]]:
+    """'1234/1' -> (1234, 1), '1234' -> (1234, 0); None для неканонічних ID."""
+    match = ID_PATTERN.fullmatch(text)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2) or 0)
+
+
+def format_id(main: int, sub: int) -> str:
+    """Зворотне перетворення до parse_id."""
+    return f"{main}/{sub}" if sub else str(main)
+
+
+def business_ordinals(day_ordinals) -> np.ndarray:
+    """Векторний get_ordinal_date: порядковий номер робочого дня (якір 05.01.1970)."""
+    diff = np.asarray(day_ordinals, dtype=np.int64) - date(1970, 1, 5).toordinal()
+    return (diff // 7) * 5 + np.minimum(diff % 7, 5)
+
+
+def source_digest(manifest_hashes: Dict[str, str]) -> str:
+    """Хеш маніфесту кешу - версія даних, з яких побудовано сховище."""
+    payload = json.dumps(manifest_hashes, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(payload).hexdigest()
+
+
+@dataclass(eq=False)
+class AttendanceStore:
+    """Масиви сховища (див. ARRAY_DTYPES)."""
+    source_digest: str
+    status_names: Tuple[str, ...]
+    day_hashes: Tuple[str, ...]
+    arrays: Dict[str, np.ndarray]
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def numeric_ids(self, prefix: str) -> np.ndarray:
+        """Числові ID як у id_to_numeric: 1234/1 -> 1234.01."""
+        return self.arrays[f'{prefix}_id_main'] + self.arrays[f'{prefix}_id_sub'] / 100.0
+
+    def same_content(self, other: 'AttendanceStore') -> bool:
+        return (self.source_digest == other.source_digest
+                and self.status_names == other.status_names
+                and self.day_hashes == other.day_hashes
+                and all(np.array_equal(self.arrays[k], other.arrays[k]) for k in ARRAY_DTYPES))
+
+
+def _read_store(path: str) -> AttendanceStore:
+    with np.load(path, allow_pickle=False) as data:
+        return AttendanceStore(
+            source_digest=str(data['source_digest']),
+            status_names=tuple(str(s) for s in data['status_names']),
+            day_hashes=tuple(str(s) for s in data['day_hashes']),
+            arrays={name: data[name] for name in ARRAY_DTYPES}
+        )
+
+
+def save_attendance_store(path: str, store: AttendanceStore) -> bool:
+    """
+    Зберігає сховище якщо вміст змінився (zip-архів npz містить час запису,
+    тож незмінені дані не перезаписуються). Повертає True якщо файл змінено.
+    """
+    if os.path.exists(path):
+        try:
+            if _read_store(path).same_content(store):
+                return False
+        except Exception as e:
+            logger.warning(f"Не вдалося прочитати {path}, перезаписуємо: {e}")
+
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(
+        tmp_path,
+        source_digest=np.array(store.source_digest),
+        status_names=np.array(store.status_names, dtype=str),
+        day_hashes=np.array(store.day_hashes, dtype=str),
+        **{name: np.asarray(store.arrays[name], dtype=dtype) for name, dtype in ARRAY_DTYPES.items()}
+    )
+    os.replace(tmp_path, path)
+    return True
+
+
+# Кеш: path -> ((mtime_ns, size), AttendanceStore)
+_store_cache: Dict[str, Tuple[Tuple[int, int], AttendanceStore]] = {}
+
+
+def load_attendance_store(path: str) -> Optional[AttendanceStore]:
+    """Завантажує сховище; повторні виклики без зміни файлу повертають кеш."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _store_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    try:
+        store = _read_store(path)
+    except Exception as e:
+        logger.error(f"Помилка завантаження {path}: {e}")
+        return None
+
+    _store_cache[path] = (key, store)
+    return store
+
+
+def load_current_store(cache_dir: str) -> Optional[AttendanceStore]:
+    """
+    Сховище з cache_dir, якщо воно побудоване з поточної версії кешу
+    (source_digest збігається з _manifest.json); інакше None.
+    """
+    store = load_attendance_store(os.path.join(cache_dir, STORE_FILENAME))
+    if store is None:
+        return None
+
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            manifest_hashes = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if source_digest(manifest_hashes) != store.source_digest:
+        logger.debug(f"{STORE_FILENAME} застарів відносно {MANIFEST_FILENAME}")
+        return None
+    return store
@@ -0,0 +1,354 @@
+"""
+Вихідні повідомлення Telegram: спільний ліміт з пріоритетами та масові розсилки
+(опитування, нагадування, зміни статусів).
+
+- Усі запити Bot API проходять через OutboundRateLimiter (rate_limiter застосунку)
+  і отримують токени спільного ліміту в порядку пріоритету:
+  відповіді користувачам > опитування > нагадування > сповіщення в групу
+- Масові надсилання додатково розносяться в часі для кожного чату
+- RetryAfter призупиняє всі надсилання і повторюється лише в OutboundRateLimiter,
+  мережеві помилки - повтор з backoff у send_with_retry
+- Журнал прогресу (спільний для всіх розсилок процесу): після збою розсилка
+  продовжується без повторного надсилання
+"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import httpx
+import telegram
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Ліміти Telegram: ~30 повідомлень/с загалом і ~1/с в один чат
+BROADCAST_MESSAGES_PER_SECOND = 25
+BROADCAST_PER_CHAT_INTERVAL_SECONDS = 1.0
+BROADCAST_MAX_CONCURRENCY = 8
+BROADCAST_MAX_RETRIES = 5
+BROADCAST_BACKOFF_SECONDS = 1.0
+BROADCAST_JOURNAL_FILE = "broadcast_journal.json"
+BROADCAST_JOURNAL_KEEP_DAYS = 7
+
+# Пріоритети вихідних запитів (менше - раніше)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_POLL = 1
+PRIORITY_REMINDER = 2
+PRIORITY_GROUP = 3
+
+
+class RateLimiter:
+    """
+    Асинхронний token bucket для запитів до Bot API з чергою очікування за пріоритетом.
+    
+    Токени видаються найвищому пріоритету серед запитів, що чекають, тож масова розсилка
+    не затримує відповіді користувачам більше ніж на один токен. Для неінтерактивних
+    запитів тримається мінімальний інтервал між повідомленнями в один чат.
+    """
+
+    def __init__(self, messages_per_second=BROADCAST_MESSAGES_PER_SECOND,
+                 per_chat_interval=BROADCAST_PER_CHAT_INTERVAL_SECONDS, capacity=None):
+        self.rate = float(messages_per_second)
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate / 5)
+        self.per_chat_interval = per_chat_interval
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._chat_next = {}  # chat_id -> найраніший час наступного неінтерактивного надсилання
+        self._seq = itertools.count()
+        self._loop = None
+
+    def _bind_loop(self):
+        # Черга очікування прив'язана до event loop, у якому працює бот
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._waiters = []  # heap: (priority, seq, chat_id, future)
+            self._changed = asyncio.Event()
+            self._dispatcher = None
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _next_ready(self, now):
+        """(waiter, 0) для першого за пріоритетом готового запиту або (None, час очікування)."""
+        wait_time = None
+        for waiter in sorted(self._waiters):
+            priority, _, chat_id, future = waiter
+            if future.done():
+                continue
+            chat_ready = self._chat_next.get(chat_id, 0.0) if priority != PRIORITY_INTERACTIVE else 0.0
+            if chat_ready <= now:
+                return waiter, 0.0
+            wait_time = min(wait_time, chat_ready - now) if wait_time is not None else chat_ready - now
+        return None, wait_time
+
+    async def _dispatch(self):
+        while self._waiters:
+            now = time.monotonic()
+            self._refill(now)
+            self._waiters = [w for w in self._waiters if not w[3].done()]
+            heapq.heapify(self._waiters)
+            if not self._waiters:
+                break
+            
+            if now < self._paused_until:
+                wait_time = self._paused_until - now
+            elif self._tokens < 1:
+                wait_time = (1 - self._tokens) / self.rate
+            else:
+                waiter, wait_time = self._next_ready(now)
+                if waiter is not None:
+                    priority, _, chat_id, future = waiter
+                    self._waiters.remove(waiter)
+                    heapq.heapify(self._waiters)
+                    self._tokens -= 1
+                    if chat_id is not None and priority != PRIORITY_INTERACTIVE:
+                        self._chat_next[chat_id] = now + self.per_chat_interval
+                        if len(self._chat_next) > 10000:
+                            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+                    future.set_result(None)
+                    continue
+            
+            # Чекаємо токен/паузу, але прокидаємось раніше, якщо з'явився новий запит
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=wait_time)
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire(self, chat_id=None, priority=PRIORITY_INTERACTIVE):
+        """Чекає, доки можна надіслати запит з цим пріоритетом у chat_id."""
+        self._bind_loop()
+        future = self._loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), chat_id, future))
+        self._changed.set()
+        await future
+
+    def pause(self, seconds):
+        """Призупиняє всі надсилання (flood control від Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# Спільний ліміт для всіх вихідних запитів процесу
+TELEGRAM_LIMITER = RateLimiter()
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """
+    Rate limiter застосунку python-telegram-bot поверх спільного RateLimiter.
+    Пріоритет передається через rate_limit_args методів бота (за замовчуванням - інтерактивний).
+    """
+
+    def __init__(self, limiter: RateLimiter = None, max_retries: int = BROADCAST_MAX_RETRIES):
+        self.limiter = limiter or TELEGRAM_LIMITER
+        self.max_retries = max_retries
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = rate_limit_args if rate_limit_args is not None else PRIORITY_INTERACTIVE
+        chat_id = data.get('chat_id')
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except telegram.error.RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                wait_time = _retry_after_seconds(e)
+                logger.warning(f"Flood control Telegram ({endpoint}): пауза {wait_time:.0f} с")
+                self.limiter.pause(wait_time)
+
+
+def _retry_after_seconds(err: telegram.error.RetryAfter) -> float:
+    value = err.retry_after
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class BroadcastJournal:
+    """
+    JSON журнал надісланих повідомлень: назва розсилки -> ключі надісланих повідомлень.
+    
+    Один екземпляр на файл (get_journal), тож розсилки, що йдуть одночасно, не затирають
+    прогрес одна одної. Файл перезаписується атомарно (os.replace) поза event loop;
+    записи, що надійшли під час попереднього запису, зберігаються одним наступним.
+    """
+
+    def __init__(self, path=BROADCAST_JOURNAL_FILE):
+        self.path = path
+        self._data = self._load()
+        self._lock = asyncio.Lock()
+        self._dirty = False
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не вдалося прочитати журнал розсилок {self.path}: {e}")
+            return {}
+
+    def _write(self, content: str):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, "w", encoding='utf8') as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+    async def _save(self):
+        """Повертається, коли всі зміни, зроблені до виклику, записані на диск."""
+        self._dirty = True
+        async with self._lock:
+            if not self._dirty:
+                return  # вже записано разом з іншою зміною
+            self._dirty = False
+            cutoff = (datetime.date.today() - datetime.timedelta(days=BROADCAST_JOURNAL_KEEP_DAYS)).isoformat()
+            self._data = {name: entry for name, entry in self._data.items() if entry['started'] >= cutoff}
+            content = json.dumps(self._data, ensure_ascii=False)
+            await asyncio.to_thread(self._write, content)
+
+    def sent_keys(self, name: str) -> set:
+        return set(self._data.get(name, {}).get('sent', []))
+
+    async def mark_sent(self, name: str, key: str):
+        entry = self._data.setdefault(name, {'started': datetime.date.today().isoformat(), 'sent': []})
+        entry['sent'].append(key)
+        await self._save()
+
+    async def discard(self, name: str):
+        """Видаляє прогрес розсилки (коли результат збережено деінде)."""
+        if self._data.pop(name, None) is not None:
+            await self._save()
+
+
+# Спільні журнали процесу: path -> BroadcastJournal
+_journals = {}
+
+def get_journal(path=None) -> BroadcastJournal:
+    """Журнал для path (за замовчуванням BROADCAST_JOURNAL_FILE), спільний для всіх розсилок процесу."""
+    path = path or BROADCAST_JOURNAL_FILE
+    journal = _journals.get(path)
+    if journal is None:
+        journal = _journals[path] = BroadcastJournal(path)
+    return journal
+
+
+@dataclass
+class OutboundMessage:
+    """Повідомлення розсилки. key - стабільний ідентифікатор для журналу."""
+    key: str
+    chat_id: str
+    text: str
+    reply_markup: object = None
+    parse_mode: str = "HTML"
+    priority: int = PRIORITY_REMINDER
+
+
+@dataclass
+class BroadcastResult:
+    sent: int = 0
+    skipped: int = 0  # вже надіслані до збою
+    failed: int = 0
+    uncertain: int = 0  # таймаут відповіді: могли дійти, в журнал не записані
+
+
+def _timed_out_before_sending(err: telegram.error.TimedOut) -> bool:
+    """Таймаут з'єднання або пулу - запит не покидав процес, повтор безпечний."""
+    return isinstance(err.__cause__, (httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+async def send_with_retry(bot, message: OutboundMessage, max_retries: int = BROADCAST_MAX_RETRIES) -> Optional[bool]:
+    """
+    Надсилає одне повідомлення через спільний ліміт (OutboundRateLimiter бота) з пріоритетом message.priority.
+    Повертає True при успіху; False для заблокованих ботом чатів, помилкових запитів
+    та після вичерпання повторів; None, якщо невідомо, чи повідомлення дійшло.
+    
+    RetryAfter повторює лише OutboundRateLimiter; якщо він дійшов сюди, повтори вже вичерпано.
+    TimedOut з'єднання/пулу повторюється як мережева помилка. Таймаут очікування відповіді
+    не повторюється (запит міг бути виконаний) і повертає None.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            await bot.send_message(chat_id=message.chat_id, text=message.text,
+                                   reply_markup=message.reply_markup, parse_mode=message.parse_mode,
+                                   rate_limit_args=message.priority)
+            return True
+        except telegram.error.RetryAfter as e:
+            logger.error(f"Повідомлення в чат {message.chat_id} не надіслано через flood control: {e}")
+            return False
+        except (telegram.error.Forbidden, telegram.error.BadRequest) as e:
+            logger.error(f"Повідомлення в чат {message.chat_id} не надіслано: {e}")
+            return False
+        except telegram.error.TimedOut as e:
+            # Підклас NetworkError: якщо запит уже надіслано, повтор може дати дублікат
+            if not _timed_out_before_sending(e):
+                logger.warning(f"Таймаут відповіді при надсиланні в чат {message.chat_id} ({e}): "
+                               f"повідомлення могло бути доставлене, повторний запуск розсилки може його дублювати")
+                return None
+            wait_time = BROADCAST_BACKOFF_SECONDS * (2 ** attempt)
+            logger.warning(f"Таймаут з'єднання при надсиланні в чат {message.chat_id}: {e}, повтор через {wait_time:.0f} с")
+            await asyncio.sleep(wait_time)
+        except telegram.error.NetworkError as e:
+            wait_time = BROADCAST_BACKOFF_SECONDS * (2 ** attempt)
+            logger.warning(f"Мережева помилка надсилання в чат {message.chat_id}: {e}, повтор через {wait_time:.0f} с")
+            await asyncio.sleep(wait_time)
+    logger.error(f"Повідомлення в чат {message.chat_id} не надіслано після {max_retries + 1} спроб")
+    return False
+
+
+async def broadcast(bot, name: str, messages: Iterable[OutboundMessage], journal: Optional[BroadcastJournal] = None,
+                    concurrency: int = BROADCAST_MAX_CONCURRENCY) -> BroadcastResult:
+    """
+    Надсилає messages пулом з concurrency воркерів.
+    Повідомлення, ключі яких вже є в журналі для name, пропускаються.
+    """
+    journal = journal or get_journal()
+    result = BroadcastResult()
+    already_sent = journal.sent_keys(name)
+
+    queue = asyncio.Queue()
+    for message in messages:
+        if message.key in already_sent:
+            result.skipped += 1
+        else:
+            already_sent.add(message.key)
+            queue.put_nowait(message)
+
+    async def worker():
+        while True:
+            try:
+                message = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            sent = await send_with_retry(bot, message)
+            if sent:
+                await journal.mark_sent(name, message.key)
+                result.sent += 1
+            elif sent is None:
+                result.uncertain += 1
+            else:
+                result.failed += 1
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, queue.qsize()))))
+    logger.info(f"Розсилка {name}: надіслано {result.sent}, пропущено {result.skipped}, помилок {result.failed}, "
+                f"невідомо {result.uncertain}")
+    return result
@@ -0,0 +1,22 @@
+// Web Worker для index.html: підготовка даних графіка поза UI потоком.
+// Приймає { attendanceData, modelArtifact, overviewPayload }, повертає { result } або { error }.
+import { prepareChartData } from './queue_model.js';
+
+const JSTAT_MODULE_URL = 'https://cdn.jsdelivr.net/npm/jstat@1.9.6/+esm';
+
+async function loadStudentTInv() {
+    // jStat потрібен лише для підбору регресії без model.json
+    const module = await import(JSTAT_MODULE_URL);
+    const jStat = module.default?.studentt ? module.default : (module.jStat ?? module.default.jStat);
+    return (p, dof) => jStat.studentt.inv(p, dof);
+}
+
+self.onmessage = async ({ data }) => {
+    const { attendanceData, modelArtifact, overviewPayload } = data;
+    try {
+        const studentTInv = modelArtifact ? null : await loadStudentTInv();
+        self.postMessage({ result: prepareChartData(attendanceData, modelArtifact, studentTInv, overviewPayload) });
+    } catch (err) {
+        self.postMessage({ error: err.message });
+    }
+};
@@ -0,0 +1,174 @@
+"""
+Єдиний парсер щоденного аркуша з daily_sheets_cache/.
+
+Файл читається один раз у DailySheet; результат кешується за шляхом та mtime,
+тож daily_sheets_sync і admission_probability не парсять той самий CSV повторно.
+
+Структура аркуша:
+- Рядок 0: Заголовок
+- Рядок 1: "Попередній прийом:" <дата> ... "Поточний прийом:" <дата>
+- Рядок 2: Заголовки колонок (№, ID, Статус, Примітки, '', №, Примітки, ID, Статус, ...)
+- Рядок 3+: Дані
+"""
+
+import csv
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+
+DATE_PATTERN = re.compile(r'\d{2}\.\d{2}\.\d{4}')
+
+# Перша колонка правої частини (Поточний прийом)
+RIGHT_SECTION_START = 5
+
+
+@dataclass(frozen=True)
+class SheetRow:
+    """Рядок однієї з частин аркуша з уже класифікованим статусом."""
+    row_index: int
+    position: int
+    queue_id: str
+    status: str
+    notes: str
+    attended: bool
+    is_live: bool
+    no_show: bool
+    postponed: bool
+
+    @property
+    def has_numeric_id(self) -> bool:
+        return any(char.isdigit() for char in self.queue_id)
+
+
+@dataclass(frozen=True)
+class DailySheet:
+    """Розібраний щоденний аркуш."""
+    path: str
+    row_count: int
+    header_index: Optional[int]
+    previous_date: Optional[date]
+    current_date: Optional[date]
+    previous_rows: Tuple[SheetRow, ...]
+    current_rows: Tuple[SheetRow, ...]
+
+    def attendance_rows(self) -> List[SheetRow]:
+        """
+        Рядки попереднього прийому для статистики відвідуваності:
+        лише після рядка заголовків і з числовим ID.
+        """
+        if self.row_count < 4 or self.header_index is None:
+            return []
+        return [row for row in self.previous_rows
+                if row.row_index > self.header_index and row.has_numeric_id]
+
+
+def _make_row(row_index: int, position: int, queue_id: str, status: str, notes: str) -> SheetRow:
+    status_lower = status.lower()
+    no_show = 'не зайшов' in status_lower or "не з'явився" in status_lower
+    attended = 'зайшов' in status_lower and not no_show
+    return SheetRow(
+        row_index=row_index,
+        position=position,
+        queue_id=queue_id,
+        status=status,
+        notes=notes,
+        attended=attended,
+        is_live=attended and 'за живою чергою' in status_lower,
+        no_show=no_show,
+        postponed=not attended and not no_show and 'відклав' in status_lower
+    )
+
+
+def _parse_position(value: str) -> Optional[int]:
+    value = value.strip() if value else ''
+    if not value or not value.isdigit():
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _parse_header_dates(row: List[str]) -> Tuple[Optional[date], Optional[date]]:
+    previous_date = current_date = None
+    for col, cell in enumerate(row):
+        match = DATE_PATTERN.search(cell)
+        if not match:
+            continue
+        try:
+            parsed = datetime.strptime(match.group(0), '%d.%m.%Y').date()
+        except ValueError:
+            continue
+        if col < RIGHT_SECTION_START:
+            previous_date = previous_date or parsed
+        else:
+            current_date = current_date or parsed
+    return previous_date, current_date
+
+
+def parse_daily_sheet(csv_path: str) -> DailySheet:
+    """Читає CSV один раз і розбирає обидві частини аркуша."""
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+
+    header_index = None
+    previous_date = current_date = None
+    previous_rows = []
+    current_rows = []
+
+    for i, row in enumerate(rows):
+        if header_index is None and len(row) > 0 and row[0].strip() == '№':
+            header_index = i
+        if header_index is None and len(row) > 0 and row[0].strip().startswith('Попередній прийом'):
+            previous_date, current_date = _parse_header_dates(row)
+
+        # Ліва частина: Попередній прийом (колонки 0-3: №, ID, Статус, Примітки)
+        if len(row) >= 3:
+            position = _parse_position(row[0])
+            if position is not None:
+                previous_rows.append(_make_row(
+                    i, position,
+                    queue_id=row[1].strip(),
+                    status=row[2].strip(),
+                    notes=row[3].strip() if len(row) > 3 else ''
+                ))
+
+        # Права частина: Поточний прийом (колонки 5-8: №, Примітки, ID, Статус)
+        if len(row) >= 8:
+            position = _parse_position(row[RIGHT_SECTION_START])
+            if position is not None:
+                current_rows.append(_make_row(
+                    i, position,
+                    queue_id=row[7].strip(),
+                    status=row[8].strip() if len(row) > 8 else '',
+                    notes=row[6].strip()
+                ))
+
+    return DailySheet(
+        path=csv_path,
+        row_count=len(rows),
+        header_index=header_index,
+        previous_date=previous_date,
+        current_date=current_date,
+        previous_rows=tuple(previous_rows),
+        current_rows=tuple(current_rows)
+    )
+
+
+_sheet_cache: Dict[str, Tuple[Tuple[int, int], DailySheet]] = {}
+
+
+def load_daily_sheet(csv_path: str) -> DailySheet:
+    """DailySheet з кешу; файл перечитується лише якщо змінились mtime або розмір."""
+    stat = os.stat(csv_path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _sheet_cache.get(csv_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    sheet = parse_daily_sheet(csv_path)
+    _sheet_cache[csv_path] = (key, sheet)
+    return sheet
@@ -5,10 +5,22 @@
 import os
 import datetime
 import csv
+import gzip
+import hashlib
+import io
+import json
+import math
+import numpy as np
 import pandas as pd
 import logging
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, fields
 from googleapiclient.errors import HttpError
+from daily_sheet_parser import DATE_PATTERN, load_daily_sheet
+import attendance_store
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +30,65 @@ def ensure_cache_dir():
     """Створює директорію для кешу якщо не існує."""
     os.makedirs(DAILY_SHEETS_CACHE_DIR, exist_ok=True)
 
-def download_stats(sheets_service, stats_sheet_id, stats_worksheet_name):
+MANIFEST_FILENAME = attendance_store.MANIFEST_FILENAME
+
+class SheetManifest:
+    """
+    Хеші вмісту файлів кешу (daily_sheets_cache/_manifest.json).
+    
+    Файл перезаписується лише якщо його вміст змінився, тож
+    повторна синхронізація без змін не змінює нічого на диску.
+    """
+    
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DAILY_SHEETS_CACHE_DIR, MANIFEST_FILENAME)
+        self.hashes = {}
+        self.changed = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.hashes = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Не вдалося прочитати {self.path}: {e}")
+    
+    def write_if_changed(self, file_path, text):
+        """Записує text у file_path якщо хеш відрізняється. Повертає True якщо файл змінено."""
+        data = text.encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+        key = os.path.basename(file_path)
+        
+        with self._lock:
+            if self.hashes.get(key) == digest and os.path.exists(file_path):
+                return False
+        
+        changed = True
+        if os.path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                changed = hashlib.sha1(f.read()).hexdigest() != digest
+        if changed:
+            with open(file_path, 'wb') as f:
+                f.write(data)
+        
+        with self._lock:
+            if self.hashes.get(key) != digest:
+                self.hashes[key] = digest
+                self._dirty = True
+            if changed:
+                self.changed.add(key)
+        return changed
+    
+    def save(self):
+        """Зберігає маніфест (детерміновано: відсортовані ключі, без часових міток)."""
+        if not self._dirty:
+            return
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.hashes, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write('\n')
+        self._dirty = False
+
+def download_stats(sheets_service, stats_sheet_id, stats_worksheet_name, manifest=None):
     """Завантажує stats аркуш."""
     try:
         range_name = f"{stats_worksheet_name}!A:Z"
@@ -45,8 +115,15 @@ def download_stats(sheets_service, stats_sheet_id, stats_worksheet_name):
         df = pd.DataFrame(normalized_data, columns=headers)
         
         stats_file = os.path.join(DAILY_SHEETS_CACHE_DIR, "_stats.csv")
-        df.to_csv(stats_file, index=False)
-        logger.info(f"Stats оновлено: {len(df)} рядків")
+        if manifest is None:
+            df.to_csv(stats_file, index=False)
+            logger.info(f"Stats оновлено: {len(df)} рядків")
+        elif manifest.write_if_changed(stats_file, df.to_csv(index=False)):
+            logger.info(f"Stats оновлено: {len(df)} рядків")
+        else:
+            # Вміст не змінився - оновлюємо лише mtime (ознака актуальності на сьогодні)
+            os.utime(stats_file, None)
+            logger.info(f"Stats без змін: {len(df)} рядків")
         
         return df
         
@@ -54,78 +131,266 @@ def download_stats(sheets_service, stats_sheet_id, stats_worksheet_name):
         logger.error(f"Помилка завантаження stats: {e}")
         return None
 
-def download_daily_sheet(sheets_service, stats_sheet_id, sheet_name, retry_delay=0.5):
-    """
-    Завантажує один щоденний аркуш за назвою.
-    
-    Args:
-        retry_delay: Затримка в секундах при rate limit (429)
-    """
-    import time
-    
+def _sheet_cache_file(sheet_name):
+    """Шлях до CSV кешу для аркуша "ДД.ММ.РРРР" або None при невірній назві."""
     try:
         date_obj = datetime.datetime.strptime(sheet_name, "%d.%m.%Y").date()
-        cache_filename = date_obj.strftime("%Y-%m-%d.csv")
     except ValueError:
         logger.error(f"Невірний формат дати: {sheet_name}")
-        return False
+        return None
+    return os.path.join(DAILY_SHEETS_CACHE_DIR, date_obj.strftime("%Y-%m-%d.csv"))
+
+def _write_sheet_csv(cache_file, values, manifest=None):
+    """Записує значення аркуша у CSV кеш. Повертає True якщо файл змінено."""
+    # LF як у репозиторії (.gitattributes: *.csv eol=lf) - інакше хеш не збігається з checkout
+    buffer = io.StringIO(newline='')
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in values:
+        writer.writerow(row)
+    
+    if manifest is not None:
+        return manifest.write_if_changed(cache_file, buffer.getvalue())
+    
+    with open(cache_file, 'w', newline='', encoding='utf-8') as f:
+        f.write(buffer.getvalue())
+    return True
+
+# Квота Sheets API на читання: 60 запитів на хвилину на користувача
+SHEETS_REQUESTS_PER_MINUTE = 60
+SHEETS_FETCH_CONCURRENCY = 4
+SHEETS_MAX_RETRIES = 4
+
+class TokenBucket:
+    """
+    Потокобезпечний token bucket для запитів до Sheets API.
     
-    cache_file = os.path.join(DAILY_SHEETS_CACHE_DIR, cache_filename)
+    На 429 швидкість поповнення зменшується вдвічі, а всі потоки
+    призупиняються (з урахуванням Retry-After); після успішних запитів
+    швидкість поступово повертається до номінальної.
+    """
     
-    max_retries = 3
+    def __init__(self, requests_per_minute=SHEETS_REQUESTS_PER_MINUTE, capacity=None):
+        self.max_rate = requests_per_minute / 60.0
+        self.min_rate = self.max_rate / 8
+        self.rate = self.max_rate
+        self.capacity = capacity if capacity is not None else max(1.0, requests_per_minute / 6)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def acquire(self):
+        """Блокує потік до отримання токена."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait_time = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+    
+    def throttle(self, retry_after=None):
+        """Реакція на 429/мережеву помилку. Повертає паузу в секундах."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            wait_time = retry_after if retry_after is not None else 1 / self.rate
+            self._paused_until = max(self._paused_until, time.monotonic() + wait_time)
+            self._tokens = 0.0
+            return wait_time
+    
+    def success(self):
+        """Поступово відновлює швидкість після успішного запиту."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+def _retry_after_seconds(err):
+    """Значення заголовка Retry-After з HttpError (секунди) або None."""
+    try:
+        value = err.resp.get('retry-after')
+        return float(value) if value is not None else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+_fetch_thread_local = threading.local()
+
+def _thread_http(sheets_service):
+    """
+    Окремий AuthorizedHttp для кожного потоку: httplib2.Http не потокобезпечний.
+    None якщо сервіс не містить облікових даних (тоді запити виконуються послідовно).
+    """
+    credentials = getattr(getattr(sheets_service, '_http', None), 'credentials', None)
+    if credentials is None:
+        return None
+    http = getattr(_fetch_thread_local, 'http', None)
+    if http is None or _fetch_thread_local.credentials is not credentials:
+        import google_auth_httplib2
+        import httplib2
+        http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+        _fetch_thread_local.http = http
+        _fetch_thread_local.credentials = credentials
+    return http
+
+def _execute_sheets_request(build_request, bucket, description, http=None, max_retries=SHEETS_MAX_RETRIES):
+    """
+    Виконує запит з урахуванням token bucket.
+    
+    429 та мережеві помилки повторюються з адаптивною паузою,
+    інші HttpError прокидаються далі.
+    """
     for attempt in range(max_retries):
+        bucket.acquire()
         try:
-            range_name = f"{sheet_name}!A:Z"
-            result = sheets_service.spreadsheets().values().get(
-                spreadsheetId=stats_sheet_id,
-                range=range_name
-            ).execute()
-            
-            values = result.get('values', [])
-            
-            if not values:
-                logger.warning(f"Аркуш {sheet_name} порожній")
-                return False
-            
-            with open(cache_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                for row in values:
-                    writer.writerow(row)
-            
-            logger.debug(f"Завантажено {sheet_name} -> {cache_filename}")
-            return True
-            
+            request = build_request()
+            result = request.execute(http=http) if http is not None else request.execute()
+            bucket.success()
+            return result
         except HttpError as err:
-            if err.resp.status == 429:
-                if attempt < max_retries - 1:
-                    wait_time = retry_delay * (2 ** attempt)
-                    logger.warning(f"Rate limit для {sheet_name}, чекаю {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    logger.error(f"Rate limit для {sheet_name} після {max_retries} спроб")
-                    return False
-            elif err.resp.status != 400:
-                logger.error(f"HTTP помилка для {sheet_name}: {err.resp.status}")
-            return False
+            if err.resp.status != 429:
+                raise
+            if attempt == max_retries - 1:
+                logger.error(f"Rate limit для {description} після {max_retries} спроб")
+                raise
+            wait_time = bucket.throttle(_retry_after_seconds(err))
+            logger.warning(f"Rate limit для {description}, чекаю {wait_time:.1f}s...")
         except (ConnectionError, BrokenPipeError, OSError) as e:
-            if attempt < max_retries - 1:
-                wait_time = retry_delay * (2 ** attempt)
-                logger.warning(f"Мережева помилка для {sheet_name} ({type(e).__name__}), чекаю {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-            else:
-                logger.error(f"Мережева помилка для {sheet_name} після {max_retries} спроб: {e}")
-                return False
-        except Exception as e:
-            logger.error(f"Невідома помилка завантаження {sheet_name}: {e}")
+            if attempt == max_retries - 1:
+                logger.error(f"Мережева помилка для {description} після {max_retries} спроб: {e}")
+                raise
+            wait_time = bucket.throttle()
+            logger.warning(f"Мережева помилка для {description} ({type(e).__name__}), чекаю {wait_time:.1f}s...")
+
+def download_daily_sheet(sheets_service, stats_sheet_id, sheet_name, bucket=None, manifest=None):
+    """
+    Завантажує один щоденний аркуш за назвою.
+    
+    Args:
+        bucket: TokenBucket для обмеження швидкості запитів
+        manifest: SheetManifest - CSV перезаписується лише при зміні вмісту
+    """
+    cache_file = _sheet_cache_file(sheet_name)
+    if cache_file is None:
+        return False
+    
+    if bucket is None:
+        bucket = TokenBucket()
+    
+    try:
+        result = _execute_sheets_request(
+            lambda: sheets_service.spreadsheets().values().get(
+                spreadsheetId=stats_sheet_id,
+                range=f"{sheet_name}!A:Z"
+            ),
+            bucket, sheet_name, http=_thread_http(sheets_service)
+        )
+        
+        values = result.get('values', [])
+        
+        if not values:
+            logger.warning(f"Аркуш {sheet_name} порожній")
             return False
+        
+        if _write_sheet_csv(cache_file, values, manifest):
+            logger.debug(f"Завантажено {sheet_name} -> {os.path.basename(cache_file)}")
+        return True
+        
+    except HttpError as err:
+        if err.resp.status not in (400, 429):
+            logger.error(f"HTTP помилка для {sheet_name}: {err.resp.status}")
+        return False
+    except (ConnectionError, BrokenPipeError, OSError):
+        return False
+    except Exception as e:
+        logger.error(f"Невідома помилка завантаження {sheet_name}: {e}")
+        return False
+
+SHEETS_BATCH_SIZE = 20
+
+def _download_batch(sheets_service, stats_sheet_id, batch, bucket, manifest=None):
+    """Завантажує одну групу аркушів; повертає список збережених назв."""
+    cache_files = {name: _sheet_cache_file(name) for name in batch}
+    batch = [name for name in batch if cache_files[name] is not None]
+    if not batch:
+        return []
+    
+    description = f"групи з {len(batch)} аркушів"
+    http = _thread_http(sheets_service)
+    try:
+        result = _execute_sheets_request(
+            lambda: sheets_service.spreadsheets().values().batchGet(
+                spreadsheetId=stats_sheet_id,
+                ranges=[f"{name}!A:Z" for name in batch]
+            ),
+            bucket, description, http=http
+        )
+    except HttpError as err:
+        if err.resp.status == 400:
+            # Один відсутній аркуш робить недійсним весь batchGet
+            logger.warning(f"Група з {len(batch)} аркушів містить недоступний аркуш, завантажуємо поодинці")
+            return [name for name in batch
+                    if download_daily_sheet(sheets_service, stats_sheet_id, name, bucket=bucket, manifest=manifest)]
+        if err.resp.status != 429:
+            logger.error(f"HTTP помилка для {description}: {err.resp.status}")
+        return []
+    except (ConnectionError, BrokenPipeError, OSError):
+        return []
+    except Exception as e:
+        logger.error(f"Невідома помилка завантаження {description}: {e}")
+        return []
+    
+    downloaded = []
+    # valueRanges повертаються в тому ж порядку, що й ranges
+    for name, value_range in zip(batch, result.get('valueRanges', [])):
+        values = value_range.get('values', [])
+        if not values:
+            logger.warning(f"Аркуш {name} порожній")
+            continue
+        _write_sheet_csv(cache_files[name], values, manifest)
+        downloaded.append(name)
+    return downloaded
+
+def download_daily_sheets_batch(sheets_service, stats_sheet_id, sheet_names, batch_size=SHEETS_BATCH_SIZE,
+                                concurrency=SHEETS_FETCH_CONCURRENCY, requests_per_minute=SHEETS_REQUESTS_PER_MINUTE,
+                                manifest=None):
+    """
+    Завантажує щоденні аркуші групами через values().batchGet.
+    
+    Групи завантажуються паралельно (concurrency потоків), загальна
+    швидкість обмежується спільним TokenBucket. Якщо група не завантажилась
+    через відсутній аркуш (400), аркуші цієї групи завантажуються поодинці.
+    
+    Returns:
+        list: назви аркушів, які успішно збережено в кеш (у порядку sheet_names)
+    """
+    batches = [sheet_names[i:i + batch_size] for i in range(0, len(sheet_names), batch_size)]
+    bucket = TokenBucket(requests_per_minute)
+    
+    # Без облікових даних немає потокобезпечного http - працюємо послідовно
+    if _thread_http(sheets_service) is None:
+        concurrency = 1
     
-    return False
+    if concurrency <= 1 or len(batches) <= 1:
+        results = [_download_batch(sheets_service, stats_sheet_id, batch, bucket, manifest) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(
+                lambda batch: _download_batch(sheets_service, stats_sheet_id, batch, bucket, manifest), batches
+            ))
+    
+    return [name for downloaded in results for name in downloaded]
 
 SYNC_CACHE_TTL_MINUTES = 30
 
-def sync_daily_sheets(sheets_service, stats_sheet_id, stats_worksheet_name, force_refresh_stats=False, force_refresh_all_sheets=False):
+def sync_daily_sheets(sheets_service, stats_sheet_id, stats_worksheet_name, force_refresh_stats=False, force_refresh_all_sheets=False, batch_size=SHEETS_BATCH_SIZE,
+                      concurrency=SHEETS_FETCH_CONCURRENCY, requests_per_minute=SHEETS_REQUESTS_PER_MINUTE):
     """
     Синхронізує щоденні аркуші на основі колонки "Аркуш" зі stats.
     Оновлює stats якщо він застарів або force_refresh_stats=True.
@@ -138,6 +403,9 @@ def sync_daily_sheets(sheets_service, stats_sheet_id, stats_worksheet_name, forc
         stats_worksheet_name: Назва worksheet зі статистикою
         force_refresh_stats: Примусово оновити stats (ігнорувати кеш)
         force_refresh_all_sheets: Примусово перезавантажити ВСІ щоденні аркуші
+        batch_size: Кількість аркушів в одному запиті batchGet
+        concurrency: Кількість паралельних запитів
+        requests_per_minute: Ліміт запитів до Sheets API на хвилину
     """
     ensure_cache_dir()
     
@@ -152,6 +420,7 @@ def sync_daily_sheets(sheets_service, stats_sheet_id, stats_worksheet_name, forc
             return True
     
     stats_file = os.path.join(DAILY_SHEETS_CACHE_DIR, "_stats.csv")
+    manifest = SheetManifest()
     should_refresh = force_refresh_stats
     
     # Перевіряємо чи stats актуальний
@@ -164,12 +433,12 @@ def sync_daily_sheets(sheets_service, stats_sheet_id, stats_worksheet_name, forc
         should_refresh = True
     
     if should_refresh:
-        stats_df = download_stats(sheets_service, stats_sheet_id, stats_worksheet_name)
+        stats_df = download_stats(sheets_service, stats_sheet_id, stats_worksheet_name, manifest=manifest)
         if stats_df is None:
             logger.error("Не вдалося завантажити stats")
             return False
     else:
-        stats_df = pd.read_csv(stats_file)
+        stats_df = load_stats_frame(stats_file)
         logger.debug(f"Використовуємо кешований stats")
     
     # Отримуємо список аркушів з колонки "Аркуш" (пропускаємо де немає відвідування)
@@ -215,23 +484,28 @@ def sync_daily_sheets(sheets_service, stats_sheet_id, stats_worksheet_name, forc
         # Аркуші які відсутні АБО в межах останніх N днів
         sheets_to_update = [s for s in sheets_to_download if s not in existing_sheets]
     
-    sheets_updated = False
     if sheets_to_update:
-        import time
         logger.info(f"Завантаження {len(sheets_to_update)} аркушів (включно з оновленням останніх {REFRESH_LAST_N_DAYS} днів)...")
-        for i, sheet_name in enumerate(sheets_to_update):
-            if download_daily_sheet(sheets_service, stats_sheet_id, sheet_name):
-                sheets_updated = True
-            
-            # Затримка між запитами для уникнення rate limit (крім останнього)
-            if i < len(sheets_to_update) - 1:
-                time.sleep(0.3)  # 300ms між запитами
-    
-    # Якщо були оновлення або force_refresh_stats, регенеруємо attendance_data.json
-    if sheets_updated or should_refresh:
-        logger.info("Оновлення attendance_data.json...")
+        download_daily_sheets_batch(sheets_service, stats_sheet_id, sheets_to_update, batch_size=batch_size,
+                                    concurrency=concurrency, requests_per_minute=requests_per_minute,
+                                    manifest=manifest)
+    manifest.save()
+    
+    # Регенеруємо похідні дані лише якщо змінились вхідні файли
+    if (manifest.changed or not os.path.exists(attendance_file) or not os.path.exists(MODEL_ARTIFACT_FILE)
+            or attendance_store.load_current_store(DAILY_SHEETS_CACHE_DIR) is None):
+        logger.info(f"Змінено файлів: {len(manifest.changed)}, оновлення attendance_data.json...")
+        build_attendance_store(manifest.hashes)
         generate_attendance_json()
-    elif os.path.exists(attendance_file):
+        write_model_artifact(get_attendance_model())
+    else:
+        logger.info("Щоденні аркуші та stats без змін")
+
+    # Таблиця прогнозів залежить лише від моделі - перебудовується, коли в forecast/index.json інший хеш
+    write_prediction_lookup(load_prediction_model())
+
+    # mtime attendance_data.json - ознака останньої синхронізації для TTL
+    if os.path.exists(attendance_file):
         os.utime(attendance_file, None)
     
     return True
@@ -271,78 +545,21 @@ def id_to_numeric(id_val):
 def parse_daily_sheet_attendance(csv_file):
     """
     Парсить щоденний аркуш і повертає дані про ФАКТИЧНУ відвідуваність.
-    Витягує ЛІВУ частину (Попередній прийом) - перші 4 колонки: №, ID, Статус, Примітки.
-    
-    Структура файлу:
-    - Рядок 0: Заголовок
-    - Рядок 1: "Попередній прийом:" ...
-    - Рядок 2: Заголовки колонок (№, ID, Статус, Примітки, ..., №, ID, Статус, ...)
-    - Рядок 3+: Дані
+    Використовує ЛІВУ частину (Попередній прийом) - перші 4 колонки: №, ID, Статус, Примітки.
     """
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-    
-    if len(rows) < 4:
-        return None
-    
-    # Знаходимо рядок з заголовками (де перша колонка = '№')
-    data_start_idx = None
-    for i, row in enumerate(rows):
-        if len(row) > 0 and row[0].strip() == '№':
-            # Дані починаються з наступного рядка
-            data_start_idx = i + 1
-            break
-    
-    if data_start_idx is None:
-        return None
-    
-    attended = 0
-    no_show = 0
-    postponed = 0
-    total = 0
-    
-    # Парсимо ТІЛЬКИ ліву частину (колонки 0-3: №, ID, Статус, Примітки)
-    for row in rows[data_start_idx:]:
-        if len(row) < 3:
-            continue
-        
-        # Ліва частина: Попередній прийом (ФАКТИЧНІ дані)
-        number = row[0].strip()
-        person_id = row[1].strip()
-        status = row[2].strip()
-        
-        # Пропускаємо порожні рядки та нечислові номери
-        if not number:
-            continue
-        
-        if not number.isdigit():
-            continue
-        
-        # Парсимо ID (може бути "1234/1") - зберігаємо як рядок для точного обліку
-        if not any(char.isdigit() for char in person_id):
-            continue
-            
-        id_val = person_id.strip()
-        
-        total += 1
-        status_lower = status.lower()
-        
-        if 'зайшов' in status_lower and 'не зайшов' not in status_lower and "не з'явився" not in status_lower:
-            attended += 1
-        elif 'не зайшов' in status_lower or "не з'явився" in status_lower:
-            no_show += 1
-        elif 'відклав' in status_lower:
-            postponed += 1
+    rows = load_daily_sheet(csv_file).attendance_rows()
     
+    total = len(rows)
     if total == 0:
         return None
     
+    attended = sum(row.attended for row in rows)
+    
     return {
         'total': total,
         'attended': attended,
-        'no_show': no_show,
-        'postponed': postponed,
+        'no_show': sum(row.no_show for row in rows),
+        'postponed': sum(row.postponed for row in rows),
         'attendance_rate': attended / total
     }
 
@@ -373,54 +590,12 @@ def get_attendance_rate(num_recent_days=10):
 def extract_attended_ids_from_sheet(csv_file):
     """
     Витягує список ID людей які ЗАЙШЛИ (статус = "Зайшов") з щоденного аркуша.
-    Повертає список словників з полями: {'id': int, 'is_live': bool}.
+    Повертає список словників з полями: {'id': str, 'is_live': bool}.
     is_live=True якщо статус містить "(за живою чергою)".
     """
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-    
-    if len(rows) < 4:
-        return []
-    
-    # Знаходимо початок даних
-    data_start_idx = None
-    for i, row in enumerate(rows):
-        if len(row) > 0 and row[0].strip() == '№':
-            data_start_idx = i + 1
-            break
-    
-    if data_start_idx is None:
-        return []
-    
-    attended_ids = []
-    
-    # Парсимо ліву частину (попередній прийом)
-    for row in rows[data_start_idx:]:
-        if len(row) < 3:
-            continue
-        
-        number = row[0].strip()
-        person_id = row[1].strip()
-        status = row[2].strip()
-        
-        if not number or not person_id or not number.isdigit():
-            continue
-        
-        # Парсимо ID - зберігаємо як рядок
-        if not any(char.isdigit() for char in person_id):
-            continue
-            
-        id_val = person_id.strip()
-        
-        # Тільки тих хто зайшов
-        status_lower = status.lower()
-        if 'зайшов' in status_lower and 'не зайшов' not in status_lower and "не з'явився" not in status_lower:
-            # Перевіряємо чи це жива черга
-            is_live = 'за живою чергою' in status_lower
-            attended_ids.append({'id': id_val, 'is_live': is_live})
-    
-    return attended_ids
+    return [{'id': row.queue_id, 'is_live': row.is_live}
+            for row in load_daily_sheet(csv_file).attendance_rows()
+            if row.attended]
 
 def get_historical_attendance_data():
     """
@@ -489,40 +664,198 @@ def get_historical_attendance_data():
     logger.info(f"Завантажено історичні дані про відвідуваність для {len(df)} днів")
     return df
 
+# Кеш типізованого stats: path -> ((mtime_ns, size), DataFrame)
+_stats_frame_cache = {}
+_stats_frame_lock = threading.Lock()
+
+def load_stats_frame(stats_file=None):
+    """
+    Типізований DataFrame з _stats.csv: номери - числа, 'Дата прийому' - datetime.
+    Повторні виклики без зміни файлу (mtime, розмір) повертають той самий об'єкт
+    без розбору CSV, тому результат не можна змінювати. None якщо файлу немає.
+    """
+    if stats_file is None:
+        stats_file = os.path.join(DAILY_SHEETS_CACHE_DIR, "_stats.csv")
+    try:
+        stat = os.stat(stats_file)
+    except OSError:
+        return None
+    
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _stats_frame_lock:
+        cached = _stats_frame_cache.get(stats_file)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        
+        stats_df = pd.read_csv(stats_file)
+        for column in ('Останній номер що зайшов', 'Перший номер що зайшов'):
+            if column in stats_df.columns:
+                stats_df[column] = pd.to_numeric(stats_df[column], errors='coerce')
+        if 'Дата прийому' in stats_df.columns:
+            stats_df['Дата прийому'] = pd.to_datetime(stats_df['Дата прийому'], format="%d.%m.%Y", errors='coerce')
+        
+        _stats_frame_cache[stats_file] = (key, stats_df)
+        return stats_df
+
+def _load_sheet_to_date():
+    """Mapping з _stats.csv: назва аркуша -> дата прийому (None якщо файлу немає)."""
+    stats_df = load_stats_frame()
+    if stats_df is None:
+        logger.error("Файл _stats.csv не знайдено. Запустіть синхронізацію спочатку")
+        return None
+    
+    sheet_to_date = {}
+    for sheet_name, visit_date in zip(stats_df['Аркуш'].astype(str).str.strip(), stats_df['Дата прийому']):
+        if sheet_name and sheet_name != 'nan' and not pd.isna(visit_date):
+            sheet_to_date[sheet_name] = visit_date.date()
+    return sheet_to_date
+
+ROW_COLUMNS = ('row_sheet_date', 'row_position', 'row_id_main', 'row_id_sub', 'row_status',
+               'row_in_data', 'row_attended', 'row_is_live')
+
+def _day_rows(filepath, file_date_obj):
+    """Розбирає рядки попереднього прийому одного дня (статуси - рядками)."""
+    sheet = load_daily_sheet(filepath)
+    in_data = {row.row_index for row in sheet.attendance_rows()}
+    
+    columns = {name: [] for name in ROW_COLUMNS}
+    for row in sheet.previous_rows:
+        if not row.queue_id:
+            continue
+        parsed_id = attendance_store.parse_id(row.queue_id)
+        if parsed_id is None:
+            logger.warning(f"Неканонічний ID '{row.queue_id}' у {os.path.basename(filepath)}, рядок пропущено")
+            continue
+        
+        columns['row_sheet_date'].append(file_date_obj.toordinal())
+        columns['row_position'].append(row.position)
+        columns['row_id_main'].append(parsed_id[0])
+        columns['row_id_sub'].append(parsed_id[1])
+        columns['row_status'].append(row.status)
+        columns['row_in_data'].append(row.row_index in in_data)
+        columns['row_attended'].append(row.attended)
+        columns['row_is_live'].append(row.is_live)
+    
+    return {name: np.asarray(values, dtype=str if name == 'row_status' else attendance_store.ARRAY_DTYPES[name])
+            for name, values in columns.items()}
+
+def build_attendance_store(manifest_hashes):
+    """
+    Будує колонкове сховище daily_sheets_cache/_attendance_store.npz з CSV кешу.
+    
+    Інкрементально: рядки дня, хеш CSV якого не змінився, беруться з
+    попередньої версії сховища; розбираються лише змінені дні.
+    Точки відвідуваності щоразу збираються з рядків та актуального _stats.csv.
+    
+    Args:
+        manifest_hashes: хеші SheetManifest - версія даних та ключі фрагментів
+    
+    Returns:
+        bool: True якщо файл сховища змінено
+    """
+    sheet_to_date = _load_sheet_to_date()
+    if sheet_to_date is None:
+        return False
+    
+    store_file = os.path.join(DAILY_SHEETS_CACHE_DIR, attendance_store.STORE_FILENAME)
+    previous = attendance_store.load_attendance_store(store_file)
+    previous_hashes = {}
+    if previous is not None:
+        previous_hashes = dict(zip(previous['day_date'].tolist(), previous.day_hashes))
+    
+    day_dates, day_hashes, fragments = [], [], []
+    reparsed = 0
+    
+    files = sorted(f for f in os.listdir(DAILY_SHEETS_CACHE_DIR)
+                   if f.endswith('.csv') and f != '_stats.csv')
+    for filename in files:
+        try:
+            file_date_obj = datetime.datetime.strptime(filename[:-4], "%Y-%m-%d").date()
+        except ValueError:
+            continue
+        
+        filepath = os.path.join(DAILY_SHEETS_CACHE_DIR, filename)
+        file_hash = manifest_hashes.get(filename)
+        if file_hash is None:
+            with open(filepath, 'rb') as f:
+                file_hash = hashlib.sha1(f.read()).hexdigest()
+        
+        day_ordinal = file_date_obj.toordinal()
+        if previous_hashes.get(day_ordinal) == file_hash:
+            mask = previous['row_sheet_date'] == day_ordinal
+            fragment = {name: previous[name][mask] for name in ROW_COLUMNS}
+            fragment['row_status'] = np.asarray(previous.status_names, dtype=str)[fragment['row_status']]
+        else:
+            fragment = _day_rows(filepath, file_date_obj)
+            reparsed += 1
+        
+        day_dates.append(day_ordinal)
+        day_hashes.append(file_hash)
+        fragments.append(fragment)
+    
+    # Без фрагментів (лише _stats.csv) - порожні колонки з власними типами, щоб маски лишались bool
+    arrays = {name: np.concatenate([fragment[name] for fragment in fragments]) if fragments
+              else np.array([], dtype=str if name == 'row_status' else attendance_store.ARRAY_DTYPES[name])
+              for name in ROW_COLUMNS}
+    
+    # Коди статусів - індекси у відсортованому списку назв (не залежить від порядку збирання)
+    status_names, status_codes = np.unique(arrays['row_status'].astype(str), return_inverse=True)
+    arrays['row_status'] = status_codes
+    arrays['day_date'] = np.asarray(day_dates)
+    
+    # Точки відвідуваності: дата прийому за mapping з _stats.csv
+    sheet_visit_dates = {datetime.datetime.strptime(name, "%d.%m.%Y").date().toordinal(): visit_date.toordinal()
+                         for name, visit_date in sheet_to_date.items()}
+    visit_dates = np.array([sheet_visit_dates.get(d, -1) for d in arrays['row_sheet_date'].tolist()], dtype=np.int64)
+    point_mask = arrays['row_in_data'] & arrays['row_attended'] & (visit_dates >= 0)
+    arrays['point_date'] = visit_dates[point_mask]
+    arrays['point_id_main'] = arrays['row_id_main'][point_mask]
+    arrays['point_id_sub'] = arrays['row_id_sub'][point_mask]
+    arrays['point_is_live'] = arrays['row_is_live'][point_mask]
+    
+    store = attendance_store.AttendanceStore(
+        source_digest=attendance_store.source_digest(manifest_hashes),
+        status_names=tuple(str(name) for name in status_names),
+        day_hashes=tuple(day_hashes),
+        arrays={name: np.asarray(arrays[name], dtype=dtype)
+                for name, dtype in attendance_store.ARRAY_DTYPES.items()}
+    )
+    changed = attendance_store.save_attendance_store(store_file, store)
+    logger.info(f"{attendance_store.STORE_FILENAME}: {len(arrays['point_date'])} точок, "
+                f"{len(status_codes)} рядків, розібрано {reparsed}/{len(fragments)} днів"
+                f"{'' if changed else ' (без змін)'}")
+    return changed
+
 def generate_attendance_json(output_file='attendance_data.json'):
     """
     Генерує attendance_data.json з усіма історичними точками відвідуваності.
-    Використовує дані зі щоденних аркушів та mapping з Stats.
+    
+    Якщо _attendance_store.npz актуальне, точки збираються з його
+    поденних фрагментів (розбираються лише змінені дні - див. build_attendance_store).
+    Інакше використовує дані зі щоденних аркушів та mapping з Stats.
     
     Returns:
         bool: True якщо успішно, False якщо помилка
     """
-    import json
-    import datetime
-    
     ensure_cache_dir()
     
-    # Читаємо Stats для отримання mapping: назва аркуша -> дата прийому
-    stats_file = os.path.join(DAILY_SHEETS_CACHE_DIR, "_stats.csv")
-    if not os.path.exists(stats_file):
-        logger.error("Файл _stats.csv не знайдено. Запустіть синхронізацію спочатку")
+    store = attendance_store.load_current_store(DAILY_SHEETS_CACHE_DIR)
+    if store is not None:
+        attendance_points = [
+            {
+                'date': datetime.date.fromordinal(day).strftime('%Y-%m-%d'),
+                'id': attendance_store.format_id(main, sub),
+                'is_live': is_live
+            }
+            for day, main, sub, is_live in zip(store['point_date'].tolist(), store['point_id_main'].tolist(),
+                                               store['point_id_sub'].tolist(), store['point_is_live'].tolist())
+        ]
+        return _write_attendance_json(output_file, attendance_points)
+    
+    sheet_to_date = _load_sheet_to_date()
+    if sheet_to_date is None:
         return False
     
-    stats_df = pd.read_csv(stats_file)
-    
-    # Створюємо mapping: назва аркуша -> дата прийому
-    sheet_to_date = {}
-    for _, row in stats_df.iterrows():
-        sheet_name = str(row['Аркуш']).strip()
-        date_str = str(row['Дата прийому']).strip()
-        
-        if sheet_name and sheet_name != 'nan' and date_str and date_str != 'nan':
-            try:
-                visit_date = datetime.datetime.strptime(date_str, "%d.%m.%Y").date()
-                sheet_to_date[sheet_name] = visit_date
-            except ValueError:
-                continue
-    
     files = sorted([f for f in os.listdir(DAILY_SHEETS_CACHE_DIR) 
                     if f.endswith('.csv') and f != '_stats.csv'])
     
@@ -554,13 +887,149 @@ def generate_attendance_json(output_file='attendance_data.json'):
                     'is_live': person_data['is_live']
                 })
     
-    # Зберігаємо в JSON
+    return _write_attendance_json(output_file, attendance_points)
+
+ATTENDANCE_COMPACT_FILENAME = 'attendance_compact.json'
+
+def _write_if_changed(path, data):
+    """Записує bytes у файл лише якщо вміст відрізняється. Повертає True якщо файл змінено."""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+def build_compact_attendance_payload(attendance_points):
+    """
+    Колонковий payload для index.html: дедупліковані дати з готовими
+    порядковими номерами робочих днів, ID як паралельні масиви (основний/суфікс),
+    is_live - індекси точок живої черги.
+    """
+    dates = sorted({point['date'] for point in attendance_points})
+    date_index = {date_str: i for i, date_str in enumerate(dates)}
+    
+    payload = {
+        'v': 1,
+        'total_points': 0,
+        'dates': dates,
+        'ordinals': [get_ordinal_date(datetime.date.fromisoformat(d)) for d in dates],
+        'd': [],
+        'id_main': [],
+        'id_sub': [],
+        'live': []
+    }
+    for point in attendance_points:
+        parsed_id = attendance_store.parse_id(str(point['id']).strip())
+        if parsed_id is None:
+            logger.warning(f"Неканонічний ID '{point['id']}' пропущено у {ATTENDANCE_COMPACT_FILENAME}")
+            continue
+        if point.get('is_live'):
+            payload['live'].append(len(payload['d']))
+        payload['d'].append(date_index[point['date']])
+        payload['id_main'].append(parsed_id[0])
+        payload['id_sub'].append(parsed_id[1])
+    payload['total_points'] = len(payload['d'])
+    return payload
+
+def _write_compact_attendance(compact_file, attendance_points):
+    """
+    Зберігає компактний payload та попередньо стиснуті .gz/.br варіанти
+    (детерміновано: gzip без часу, тож без змін даних файли не змінюються).
+    """
+    data = json.dumps(build_compact_attendance_payload(attendance_points),
+                      ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    
+    changed = _write_if_changed(compact_file, data)
+    changed |= _write_if_changed(compact_file + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        logger.warning(f"brotli не встановлено, {compact_file}.br не оновлено")
+    else:
+        changed |= _write_if_changed(compact_file + '.br', brotli.compress(data, quality=11))
+    if changed:
+        logger.info(f"Оновлено {compact_file}: {len(data)} байт")
+
+CHART_TILES_DIR = 'chart_tiles'
+CHART_OVERVIEW_BUCKETS = 300  # Часових інтервалів в огляді (точок - до 4 на інтервал)
+
+def build_chart_overview(attendance_points, max_buckets=CHART_OVERVIEW_BUCKETS):
+    """
+    Зменшена вибірка точок для графіка в масштабі всієї історії (min/max по інтервалах):
+    дні групуються в не більше ніж max_buckets інтервалів, і в кожному для звичайної
+    та живої черги лишаються точки з мінімальним та максимальним ID.
+    Розмір не залежить від довжини історії.
+    """
+    dates = sorted({point['date'] for point in attendance_points})
+    days_per_bucket = max(1, math.ceil(len(dates) / max_buckets))
+    bucket_of_date = {date_str: i // days_per_bucket for i, date_str in enumerate(dates)}
+    
+    extremes = {}
+    for i, point in enumerate(attendance_points):
+        parsed_id = attendance_store.parse_id(str(point['id']).strip())
+        if parsed_id is None:
+            continue
+        key = (bucket_of_date[point['date']], bool(point.get('is_live')))
+        current = extremes.get(key)
+        if current is None:
+            extremes[key] = [(parsed_id, i), (parsed_id, i)]
+        else:
+            current[0] = min(current[0], (parsed_id, i))
+            current[1] = max(current[1], (parsed_id, i))
+    
+    selected = sorted({i for pair in extremes.values() for _, i in pair})
+    return build_compact_attendance_payload([attendance_points[i] for i in selected])
+
+def _write_chart_tiles(tiles_dir, attendance_points):
+    """
+    Зберігає огляд (overview.json) та повні точки по місяцях (YYYY-MM.json)
+    у компактному форматі; index.html підвантажує місяці лише при наближенні.
+    """
+    months = {}
+    for point in attendance_points:
+        months.setdefault(point['date'][:7], []).append(point)
+    
+    os.makedirs(tiles_dir, exist_ok=True)
+    overview = build_chart_overview(attendance_points)
+    overview['tiles'] = sorted(months)
+    
+    changed = _write_if_changed(os.path.join(tiles_dir, 'overview.json'),
+                                json.dumps(overview, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    for month, month_points in months.items():
+        data = json.dumps(build_compact_attendance_payload(month_points),
+                          ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        changed |= _write_if_changed(os.path.join(tiles_dir, f"{month}.json"), data)
+    
+    keep = {f"{month}.json" for month in months} | {'overview.json'}
+    for filename in os.listdir(tiles_dir):
+        if filename.endswith('.json') and filename not in keep:
+            os.remove(os.path.join(tiles_dir, filename))
+            changed = True
+    if changed:
+        logger.info(f"Оновлено {tiles_dir}/: огляд {overview['total_points']} точок, {len(months)} місяців")
+
+def _write_attendance_json(output_file, attendance_points):
+    """Зберігає точки в JSON, компактний payload та тайли графіка (лише якщо вміст змінився)."""
     try:
+        output_dir = os.path.dirname(output_file)
+        _write_compact_attendance(os.path.join(output_dir, ATTENDANCE_COMPACT_FILENAME), attendance_points)
+        _write_chart_tiles(os.path.join(output_dir, CHART_TILES_DIR), attendance_points)
+        
+        content = json.dumps({
+            'attendance_points': attendance_points,
+            'total_points': len(attendance_points)
+        }, ensure_ascii=False, indent=2)
+        
+        if os.path.exists(output_file):
+            with open(output_file, 'r', encoding='utf-8') as f:
+                if f.read() == content:
+                    logger.info(f"{output_file} без змін ({len(attendance_points)} точок)")
+                    return True
+        
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                'attendance_points': attendance_points,
-                'total_points': len(attendance_points)
-            }, f, ensure_ascii=False, indent=2)
+            f.write(content)
         
         logger.info(f"Згенеровано {len(attendance_points)} точок у файл {output_file}")
         return True
@@ -568,6 +1037,128 @@ def generate_attendance_json(output_file='attendance_data.json'):
         logger.error(f"Помилка збереження {output_file}: {e}")
         return False
 
+PREBOOKED_SNAPSHOT_FILE = 'prebooked.json'
+PREBOOKED_ID_PATTERN = re.compile(r'\d{4}(/\d)?')
+
+def _sheet_title_by_gid(sheets_service, spreadsheet_id, sheet_gid):
+    """Назва аркуша за його sheetId (gid з URL)."""
+    response = sheets_service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id, fields='sheets.properties(sheetId,title)'
+    ).execute()
+    for sheet in response.get('sheets', []):
+        properties = sheet.get('properties', {})
+        if properties.get('sheetId') == sheet_gid:
+            return properties.get('title')
+    return None
+
+def parse_prebooked_rows(values):
+    """
+    Записи з аркуша попередніх записів: [{'id': '4981', 'date': 'YYYY-MM-DD'}, ...].
+    Рядок заголовків - перший, що містить колонки 'ID' та 'Дата';
+    ID та дати відфільтровуються так само, як у index.html.
+    
+    Returns:
+        (записи, найраніша дата серед усіх рядків з датою - як у fetchPreBookedLive, включно
+         з рядками без коректного ID; None якщо дат немає)
+    """
+    header_index = None
+    for i, row in enumerate(values):
+        cells = [str(cell).strip() for cell in row]
+        if 'ID' in cells and 'Дата' in cells:
+            header_index = i
+            break
+    if header_index is None:
+        return [], None
+    
+    header = [str(cell).strip() for cell in values[header_index]]
+    id_col = header.index('ID')
+    date_col = header.index('Дата')
+    
+    records = []
+    earliest_date = None
+    for row in values[header_index + 1:]:
+        id_str = str(row[id_col]).strip() if len(row) > id_col else ''
+        date_str = str(row[date_col]).strip() if len(row) > date_col else ''
+        match = DATE_PATTERN.search(date_str)
+        if not match:
+            continue
+        try:
+            date_obj = datetime.datetime.strptime(match.group(0), '%d.%m.%Y').date()
+        except ValueError:
+            continue
+        if earliest_date is None or date_obj < earliest_date:
+            earliest_date = date_obj
+        if not id_str or not PREBOOKED_ID_PATTERN.match(id_str):
+            continue
+        records.append({'id': id_str, 'date': date_obj.isoformat()})
+    return records, earliest_date
+
+def _latest_attendance_date():
+    """Остання дата відвідуваності (сховище або attendance_data.json)."""
+    store = attendance_store.load_current_store(DAILY_SHEETS_CACHE_DIR)
+    if store is not None and len(store['point_date']):
+        return datetime.date.fromordinal(int(store['point_date'].max()))
+    data = load_attendance_from_json()
+    dates = [point['date'] for point in data.get('attendance_points', [])] if data else []
+    return datetime.date.fromisoformat(max(dates)) if dates else None
+
+def get_migrated_ids(earliest_date):
+    """
+    ID з поточного прийому щоденного аркуша на найранішу дату аркуша попередніх записів
+    (або на останню дату відвідуваності, якщо дат немає).
+    
+    Returns:
+        (дата аркуша 'YYYY-MM-DD' або None, список ID)
+    """
+    sheet_date = earliest_date if earliest_date is not None else _latest_attendance_date()
+    if sheet_date is None:
+        return None, []
+    
+    csv_file = os.path.join(DAILY_SHEETS_CACHE_DIR, f"{sheet_date.isoformat()}.csv")
+    if not os.path.exists(csv_file):
+        logger.warning(f"Немає {csv_file} для перенесених записів")
+        return sheet_date.isoformat(), []
+    
+    sheet = load_daily_sheet(csv_file)
+    # Дані починаються з 4-го рядка (після заголовків)
+    migrated_ids = [row.queue_id for row in sheet.current_rows
+                    if row.row_index >= 3 and PREBOOKED_ID_PATTERN.match(row.queue_id)]
+    return sheet_date.isoformat(), migrated_ids
+
+def download_prebooked_snapshot(sheets_service, spreadsheet_id, sheet_gid, output_file=PREBOOKED_SNAPSHOT_FILE):
+    """
+    Знімок аркуша попередніх записів та перенесених ID для index.html
+    (замість завантаження CSV з Google при кожному відкритті сторінки).
+    Файл перезаписується лише якщо вміст змінився.
+    
+    Returns:
+        bool: True якщо знімок актуальний (записаний або без змін)
+    """
+    try:
+        title = _sheet_title_by_gid(sheets_service, spreadsheet_id, sheet_gid)
+        if title is None:
+            logger.error(f"Аркуш з gid {sheet_gid} не знайдено")
+            return False
+        
+        result = sheets_service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range=f"'{title}'!A:Z"
+        ).execute()
+        records, earliest_date = parse_prebooked_rows(result.get('values', []))
+        migrated_date, migrated_ids = get_migrated_ids(earliest_date)
+        
+        content = json.dumps({
+            'v': 1,
+            'records': records,
+            'migrated': {'date': migrated_date, 'ids': migrated_ids}
+        }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if _write_if_changed(output_file, content):
+            logger.info(f"Оновлено {output_file}: {len(records)} записів, {len(migrated_ids)} перенесених")
+        return True
+    except Exception as e:
+        logger.error(f"Помилка знімку попередніх записів: {e}")
+        return False
+
 def load_attendance_from_json(json_file='attendance_data.json'):
     """
     Завантажує дані відвідуваності з JSON файлу.
@@ -590,67 +1181,108 @@ def load_attendance_from_json(json_file='attendance_data.json'):
         logger.error(f"Помилка завантаження {json_file}: {e}")
         return None
 
-def calculate_prediction_from_attendance_json(user_id, attendance_data):
+# Експоненційні ваги (index.html отримує їх разом з моделлю з model.json)
+WEIGHT_EXP_MIN = -3
+WEIGHT_EXP_MAX = 1
+LIVE_QUEUE_WEIGHT = 0  # Виключаємо живу чергу з розрахунків
+
+def get_ordinal_date(date_obj):
+    """Порядковий номер робочого дня (якір - понеділок 05.01.1970)."""
+    anchor = datetime.date(1970, 1, 5)
+    diff = (date_obj - anchor).days
+    weeks = diff // 7
+    days = diff % 7
+    return weeks * 5 + min(days, 5)
+
+def get_date_from_ordinal(ordinal):
+    """Зворотне перетворення до get_ordinal_date."""
+    anchor = datetime.date(1970, 1, 5)
+    weeks = int(ordinal) // 5
+    days = int(ordinal) % 5
+    total_days = weeks * 7 + days
+    return anchor + datetime.timedelta(days=total_days)
+
+@dataclass
+class RegressionModel:
     """
-    Розраховує прогноз на основі даних з attendance_data.json.
+    Зважена лінійна регресія "ID -> порядковий робочий день".
+    Будується один раз на версію даних, прогноз для окремого ID - кілька операцій.
+    """
+    slope: float
+    intercept: float
+    weighted_mean_x: float
+    weighted_var_x: float
+    mse: float
+    dof: float
+    sum_w: float
+    t_score_90: float
+    t_score_50: float
+    max_hist_ord: int
+    max_id: float
+    data_points: int
+
+    def predict(self, user_id):
+        """Повертає прогноз для user_id у форматі calculate_prediction_with_daily_data."""
+        pred_ord = self.slope * user_id + self.intercept
+        
+        term3 = (user_id - self.weighted_mean_x)**2 / self.weighted_var_x
+        se_pred = math.sqrt(self.mse * (1 + 1/self.sum_w + term3))
+        
+        margin90 = self.t_score_90 * se_pred
+        margin50 = self.t_score_50 * se_pred
+        
+        l90_ord = pred_ord - margin90
+        h90_ord = pred_ord + margin90
+        l50_ord = pred_ord - margin50
+        h50_ord = pred_ord + margin50
+        
+        # Обмеження майбутнім
+        if user_id > self.max_id:
+            min_feasible = self.max_hist_ord + 1
+            l90_ord = max(l90_ord, min_feasible)
+            l50_ord = max(l50_ord, min_feasible)
+        
+        return {
+            'l90': get_date_from_ordinal(l90_ord),
+            'l50': get_date_from_ordinal(l50_ord),
+            'mean': get_date_from_ordinal(pred_ord),
+            'h50': get_date_from_ordinal(h50_ord),
+            'h90': get_date_from_ordinal(h90_ord),
+            'dist': {
+                'loc': pred_ord,
+                'scale': se_pred,
+                'df': self.dof
+            },
+            'data_points': self.data_points
+        }
+
+    def predict_dist_many(self, user_ids):
+        """Векторний варіант predict: повертає масиви (loc, scale) для масиву ID."""
+        user_ids = np.asarray(user_ids, dtype=float)
+        loc = self.slope * user_ids + self.intercept
+        term3 = (user_ids - self.weighted_mean_x)**2 / self.weighted_var_x
+        scale = np.sqrt(self.mse * (1 + 1/self.sum_w + term3))
+        return loc, scale
+
+def fit_regression_model(points):
+    """
+    Будує RegressionModel з точок відвідуваності.
     
     Args:
-        user_id: ID користувача
-        attendance_data: дані з attendance_data.json
+        points: список словників {'id': float, 'ordinal': int, 'is_live': bool}
+                або словник масивів з тими ж ключами
     
     Returns:
-        dict з прогнозом або None
+        RegressionModel або None якщо даних недостатньо
     """
-    import numpy as np
-    import datetime
     from scipy import stats as scipy_stats
     
-    points = attendance_data.get('attendance_points', [])
-    if len(points) < 5:
-        return None
-    
-    # Функції для конвертації дати
-    def get_ordinal_date(date_obj):
-        anchor = datetime.date(1970, 1, 5)
-        diff = (date_obj - anchor).days
-        weeks = diff // 7
-        days = diff % 7
-        return weeks * 5 + min(days, 5)
-    
-    def get_date_from_ordinal(ordinal):
-        anchor = datetime.date(1970, 1, 5)
-        weeks = int(ordinal) // 5
-        days = int(ordinal) % 5
-        total_days = weeks * 7 + days
-        return anchor + datetime.timedelta(days=total_days)
-    
-    # Створюємо список точок з ординалами
-    processed_points = []
-    for point in points:
-        try:
-            date_obj = datetime.datetime.strptime(point['date'], '%Y-%m-%d').date()
-            ordinal = get_ordinal_date(date_obj)
-            
-            # Convert ID to numeric for regression
-            numeric_id = id_to_numeric(point['id'])
-            if numeric_id is None:
-                continue
-                
-            processed_points.append({
-                'id': numeric_id, # Use numeric ID for regression
-                'ordinal': ordinal,
-                'is_live': point.get('is_live', False)
-            })
-        except:
-            continue
-    
-    if len(processed_points) < 5:
+    points_df = pd.DataFrame(points)
+    if len(points_df) < 5:
         return None
     
-    # Створюємо DataFrame
-    points_df = pd.DataFrame(processed_points)
-    
-    # Групуємо за ID і беремо середню дату
+    # Групуємо за ID і беремо середню дату (якщо ID зайшов кілька разів)
+    # Також маркуємо ID як is_live якщо хоча б одне відвідування було за живою чергою
     id_groups = points_df.groupby('id').agg({
         'ordinal': 'mean',
         'is_live': 'max'
@@ -665,13 +1297,9 @@ def calculate_prediction_from_attendance_json(user_id, attendance_data):
     if n < 5:
         return None
     
-    # Експоненційні ваги (синхронізовано з index.html)
-    weightExpMin = -3
-    weightExpMax = 1
-    liveQueueWeight = 0
-    
-    weights = np.exp(weightExpMin + (np.arange(n) / (n - 1)) * (weightExpMax - weightExpMin))
-    weights = np.where(is_live_mask, weights * liveQueueWeight, weights)
+    # Новіші дані важливіші + зменшена вага для живої черги
+    weights = np.exp(WEIGHT_EXP_MIN + (np.arange(n) / (n - 1)) * (WEIGHT_EXP_MAX - WEIGHT_EXP_MIN))
+    weights = np.where(is_live_mask, weights * LIVE_QUEUE_WEIGHT, weights)
     
     sumW = np.sum(weights)
     sumWX = np.sum(weights * X)
@@ -697,47 +1325,433 @@ def calculate_prediction_from_attendance_json(user_id, attendance_data):
     if dof <= 0:
         return None
     
-    mseWeighted = weightedSumResSq / dof
+    return RegressionModel(
+        slope=float(slope),
+        intercept=float(intercept),
+        weighted_mean_x=float(weightedMeanX),
+        weighted_var_x=float(weightedVarX),
+        mse=float(weightedSumResSq / dof),
+        dof=float(dof),
+        sum_w=float(sumW),
+        t_score_90=float(scipy_stats.t.ppf(0.95, dof)),
+        t_score_50=float(scipy_stats.t.ppf(0.75, dof)),
+        max_hist_ord=int(points_df['ordinal'].max()),
+        max_id=float(daily_stats['id'].max()),
+        data_points=len(points_df)
+    )
+
+def _points_from_attendance_json(attendance_data):
+    """Перетворює attendance_points з JSON у точки для регресії."""
+    points = []
+    for point in attendance_data.get('attendance_points', []):
+        try:
+            date_obj = datetime.datetime.strptime(point['date'], '%Y-%m-%d').date()
+            numeric_id = id_to_numeric(point['id'])
+            if numeric_id is None:
+                continue
+            points.append({
+                'id': numeric_id,
+                'ordinal': get_ordinal_date(date_obj),
+                'is_live': point.get('is_live', False)
+            })
+        except:
+            continue
+    return points
+
+def _points_from_store(store):
+    """Точки для регресії з колонкового сховища (без розбору тексту)."""
+    return {
+        'id': store.numeric_ids('point'),
+        'ordinal': attendance_store.business_ordinals(store['point_date']),
+        'is_live': store['point_is_live']
+    }
+
+# Кеш моделі: джерело -> {'signature': ..., 'digest': sha1, 'model': RegressionModel}
+_model_cache = {}
+
+def get_attendance_model(json_file=None):
+    """
+    Повертає модель прогнозу.
     
-    # T-показники
-    tScore90 = scipy_stats.t.ppf(0.95, dof)
-    tScore50 = scipy_stats.t.ppf(0.75, dof)
+    Без json_file модель будується з актуального _attendance_store.npz,
+    а якщо його немає - з attendance_data.json.
     
-    predOrd = slope * user_id + intercept
+    Модель перебудовується тільки коли змінились дані: для сховища - за
+    source_digest, для JSON - спочатку за (mtime, розмір), а при розбіжності
+    за хешем вмісту (os.utime після синхронізації змінює mtime без зміни даних).
     
-    term3 = (user_id - weightedMeanX)**2 / weightedVarX
-    sePred = np.sqrt(mseWeighted * (1 + 1/sumW + term3))
+    Returns:
+        RegressionModel або None
+    """
+    if json_file is None:
+        store = attendance_store.load_current_store(DAILY_SHEETS_CACHE_DIR)
+        if store is not None:
+            cache_key = os.path.join(DAILY_SHEETS_CACHE_DIR, attendance_store.STORE_FILENAME)
+            cached = _model_cache.get(cache_key)
+            if cached and cached['digest'] == store.source_digest:
+                return cached['model']
+            model = fit_regression_model(_points_from_store(store))
+            _model_cache[cache_key] = {'signature': None, 'digest': store.source_digest, 'model': model}
+            logger.info(f"Модель прогнозу перебудовано з {len(store['point_date'])} точок ({cache_key})")
+            return model
+        json_file = 'attendance_data.json'
     
-    margin90 = tScore90 * sePred
-    margin50 = tScore50 * sePred
+    try:
+        st = os.stat(json_file)
+    except OSError:
+        logger.warning(f"Файл {json_file} не знайдено")
+        return None
     
-    l90_ord = predOrd - margin90
-    h90_ord = predOrd + margin90
-    l50_ord = predOrd - margin50
-    h50_ord = predOrd + margin50
+    signature = (st.st_mtime_ns, st.st_size)
+    cached = _model_cache.get(json_file)
+    if cached and cached['signature'] == signature:
+        return cached['model']
+    
+    try:
+        with open(json_file, 'rb') as f:
+            raw = f.read()
+    except Exception as e:
+        logger.error(f"Помилка завантаження {json_file}: {e}")
+        return None
     
-    # Обмеження майбутнім
-    max_hist_ord = points_df['ordinal'].max()
-    min_feasible = max_hist_ord + 1
+    digest = hashlib.sha1(raw).hexdigest()
+    if cached and cached['digest'] == digest:
+        cached['signature'] = signature
+        return cached['model']
     
-    if user_id > daily_stats['id'].max():
-        l90_ord = max(l90_ord, min_feasible)
-        l50_ord = max(l50_ord, min_feasible)
+    try:
+        attendance_data = json.loads(raw.decode('utf-8'))
+    except Exception as e:
+        logger.error(f"Помилка завантаження {json_file}: {e}")
+        return None
     
+    model = fit_regression_model(_points_from_attendance_json(attendance_data))
+    _model_cache[json_file] = {'signature': signature, 'digest': digest, 'model': model}
+    logger.info(f"Модель прогнозу перебудовано з {attendance_data.get('total_points', 0)} точок ({json_file})")
+    return model
+
+MODEL_ARTIFACT_FILE = 'model.json'
+MODEL_ARTIFACT_VERSION = 1
+
+def _model_constants():
+    """Константи, з якими будується модель (перевіряються при завантаженні артефакту)."""
     return {
-        'l90': get_date_from_ordinal(l90_ord),
-        'l50': get_date_from_ordinal(l50_ord),
-        'mean': get_date_from_ordinal(predOrd),
-        'h50': get_date_from_ordinal(h50_ord),
-        'h90': get_date_from_ordinal(h90_ord),
-        'dist': {
-            'loc': predOrd,
-            'scale': sePred,
-            'df': dof
-        },
-        'data_points': len(processed_points),
-        'data_source': 'attendance_json'
+        'weight_exp_min': WEIGHT_EXP_MIN,
+        'weight_exp_max': WEIGHT_EXP_MAX,
+        'live_queue_weight': LIVE_QUEUE_WEIGHT,
+        'ordinal_anchor': '1970-01-05'
+    }
+
+def write_model_artifact(model, output_file=MODEL_ARTIFACT_FILE):
+    """
+    Зберігає підібрану модель у model.json для бота та index.html.
+    Файл перезаписується лише якщо вміст змінився.
+    
+    Returns:
+        bool: True якщо файл змінено
+    """
+    if model is None:
+        return False
+    
+    content = json.dumps({
+        'version': MODEL_ARTIFACT_VERSION,
+        'constants': _model_constants(),
+        **asdict(model)
+    }, ensure_ascii=False, indent=2, sort_keys=True) + '\n'
+    changed = _write_if_changed(output_file, content.encode('utf-8'))
+    if changed:
+        logger.info(f"Оновлено {output_file} ({model.data_points} точок)")
+    return changed
+
+# Кеш артефакту: path -> ((mtime_ns, size), RegressionModel)
+_artifact_cache = {}
+
+def load_model_artifact(path=MODEL_ARTIFACT_FILE):
+    """
+    Завантажує модель з model.json без повторного підбору регресії.
+    
+    Returns:
+        RegressionModel або None (файлу немає, інша версія або інші константи)
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _artifact_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            artifact = json.load(f)
+        if artifact.get('version') != MODEL_ARTIFACT_VERSION or artifact.get('constants') != _model_constants():
+            logger.warning(f"{path} побудовано з іншими константами, ігноруємо")
+            model = None
+        else:
+            model = RegressionModel(**{field.name: artifact[field.name] for field in fields(RegressionModel)})
+    except Exception as e:
+        logger.error(f"Помилка завантаження {path}: {e}")
+        return None
+    
+    _artifact_cache[path] = (key, model)
+    return model
+
+def load_prediction_model():
+    """Модель прогнозу: готовий артефакт model.json, інакше підбір з даних відвідуваності."""
+    return load_model_artifact() or get_attendance_model()
+
+PREDICTION_LOOKUP_DIR = 'forecast'
+PREDICTION_LOOKUP_VERSION = 1
+PREDICTION_LOOKUP_SHARD_SIZE = 100
+PREDICTION_LOOKUP_ID_MARGIN = 500   # ID нижче max_id, які ще можуть чекати (перенесені записи)
+PREDICTION_LOOKUP_HORIZON = 2000    # ID вище max_id, для яких рахуємо прогноз
+PREDICTION_LOOKUP_DAYS = 20         # Робочих днів з ймовірностями після останнього дня відвідуваності
+
+# Кеш хешу для екземпляра моделі: id(model) -> (model, digest)
+_model_digest_cache = {}
+
+def _model_digest(model):
+    """Хеш параметрів моделі - таблиця прогнозів дійсна лише для тієї ж моделі."""
+    cached = _model_digest_cache.get(id(model))
+    if cached is not None and cached[0] is model:
+        return cached[1]
+    payload = json.dumps(asdict(model), sort_keys=True).encode('utf-8')
+    digest = hashlib.sha1(payload).hexdigest()
+    if len(_model_digest_cache) > 16:
+        _model_digest_cache.clear()
+    _model_digest_cache[id(model)] = (model, digest)
+    return digest
+
+def _lookup_start_date(model):
+    """Перший робочий день після останнього дня відвідуваності моделі - вікно ймовірностей залежить лише від моделі."""
+    return get_date_from_ordinal(model.max_hist_ord + 1)
+
+def _next_working_days(start_date, count):
+    """count робочих днів (Пн-Пт), починаючи з start_date включно."""
+    days = []
+    current = start_date
+    while len(days) < count:
+        if current.weekday() < 5:
+            days.append(current)
+        current += datetime.timedelta(days=1)
+    return days
+
+def _lookup_shard_file(lookup_dir, shard_start):
+    return os.path.join(lookup_dir, f"{shard_start}.json")
+
+def build_prediction_lookup(model, shard_size=PREDICTION_LOOKUP_SHARD_SIZE,
+                            id_margin=PREDICTION_LOOKUP_ID_MARGIN, horizon=PREDICTION_LOOKUP_HORIZON,
+                            days_count=PREDICTION_LOOKUP_DAYS):
+    """
+    Таблиця прогнозів для кожного цілого ID від max_id - id_margin до max_id + horizon.
+
+    Returns:
+        dict: початковий ID шарду -> payload шарду. Кожен шард містить дати l90/l50/mean/h50/h90,
+        параметри розподілу (loc/scale, df спільний) та кумулятивні ймовірності (%)
+        для days_count робочих днів після max_hist_ord моделі (тож шарди змінюються лише
+        разом з model.json; читачі відкидають дні до сьогодні).
+    """
+    days = _next_working_days(_lookup_start_date(model), days_count)
+    day_strs = [d.isoformat() for d in days]
+
+    first_id = max(1, int(model.max_id) - id_margin)
+    last_id = int(model.max_id) + horizon
+    ids = list(range(first_id, last_id + 1))
+    probabilities = np.round(predict_many(ids, days, model=model), 1)
+
+    header = {
+        'v': PREDICTION_LOOKUP_VERSION,
+        'model': _model_digest(model),
+        'shard_size': shard_size,
+        'df': model.dof,
+        'data_points': model.data_points,
+        'days': day_strs
     }
+    shards = {}
+    for i, user_id in enumerate(ids):
+        shard_start = user_id // shard_size * shard_size
+        shard = shards.get(shard_start)
+        if shard is None:
+            shard = shards[shard_start] = {**header, 'start_id': shard_start, 'ids': {}}
+
+        prediction = model.predict(user_id)
+        entry = {key: prediction[key].isoformat() for key in ('l90', 'l50', 'mean', 'h50', 'h90')}
+        entry['loc'] = round(prediction['dist']['loc'], 6)
+        entry['scale'] = round(prediction['dist']['scale'], 6)
+        entry['p'] = probabilities[i].tolist()
+        shard['ids'][str(user_id)] = entry
+    return shards
+
+def _prediction_lookup_is_current(model, lookup_dir):
+    """True, якщо lookup_dir/index.json побудовано з цієї моделі і всі його шарди на місці."""
+    try:
+        with open(os.path.join(lookup_dir, 'index.json'), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if index.get('v') != PREDICTION_LOOKUP_VERSION or index.get('model') != _model_digest(model):
+        return False
+    return all(os.path.exists(_lookup_shard_file(lookup_dir, shard_start)) for shard_start in index.get('shards', []))
+
+def write_prediction_lookup(model, lookup_dir=PREDICTION_LOOKUP_DIR):
+    """
+    Зберігає таблицю прогнозів у lookup_dir/<початковий ID>.json (по шарду на діапазон ID)
+    та lookup_dir/index.json. Якщо index.json вже має хеш цієї моделі, таблиця не будується;
+    інакше файли перезаписуються лише якщо вміст змінився, шарди поза новим діапазоном видаляються.
+
+    Returns:
+        bool: True якщо хоча б один файл змінено
+    """
+    if model is None or _prediction_lookup_is_current(model, lookup_dir):
+        return False
+
+    try:
+        shards = build_prediction_lookup(model)
+        os.makedirs(lookup_dir, exist_ok=True)
+
+        changed = False
+        for shard_start, shard in shards.items():
+            data = json.dumps(shard, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            changed |= _write_if_changed(_lookup_shard_file(lookup_dir, shard_start), data)
+
+        any_shard = next(iter(shards.values()))
+        index = {key: any_shard[key] for key in ('v', 'model', 'shard_size', 'days')}
+        index['shards'] = sorted(shards)
+        changed |= _write_if_changed(os.path.join(lookup_dir, 'index.json'),
+                                     json.dumps(index, separators=(',', ':')).encode('utf-8'))
+
+        keep = {f"{shard_start}.json" for shard_start in shards} | {'index.json'}
+        for filename in os.listdir(lookup_dir):
+            if filename.endswith('.json') and filename not in keep:
+                os.remove(os.path.join(lookup_dir, filename))
+                changed = True
+
+        if changed:
+            logger.info(f"Оновлено таблицю прогнозів {lookup_dir}/: {len(shards)} шардів")
+        return changed
+    except Exception as e:
+        logger.error(f"Помилка збереження таблиці прогнозів: {e}")
+        return False
+
+# Кеш шардів: path -> ((mtime_ns, size), payload)
+_lookup_cache = {}
+
+def _load_lookup_shard(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _lookup_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            shard = json.load(f)
+    except Exception as e:
+        logger.error(f"Помилка завантаження {path}: {e}")
+        return None
+
+    _lookup_cache[path] = (key, shard)
+    return shard
+
+def lookup_prediction(user_id, model=None, lookup_dir=PREDICTION_LOOKUP_DIR):
+    """
+    Готовий прогноз для user_id з таблиці прогнозів (один шард, без обчислень).
+
+    Args:
+        user_id: цілий ID
+        model: RegressionModel - якщо задано, таблиця має бути побудована саме з неї
+
+    Returns:
+        dict у форматі RegressionModel.predict, dist додатково містить
+        'probabilities' {datetime.date: %}; None якщо ID немає в таблиці
+        або таблиця застаріла.
+    """
+    try:
+        if user_id is None or float(user_id) != int(user_id):
+            return None
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    shard_start = user_id // PREDICTION_LOOKUP_SHARD_SIZE * PREDICTION_LOOKUP_SHARD_SIZE
+    shard = _load_lookup_shard(_lookup_shard_file(lookup_dir, shard_start))
+    if shard is None or shard.get('v') != PREDICTION_LOOKUP_VERSION:
+        return None
+
+    try:
+        if model is not None and shard.get('model') != _model_digest(model):
+            return None
+
+        entry = shard['ids'].get(str(user_id))
+        if entry is None:
+            return None
+
+        prediction = {key: datetime.date.fromisoformat(entry[key]) for key in ('l90', 'l50', 'mean', 'h50', 'h90')}
+        prediction['dist'] = {
+            'loc': entry['loc'],
+            'scale': entry['scale'],
+            'df': shard['df'],
+            'probabilities': {datetime.date.fromisoformat(day): p for day, p in zip(shard['days'], entry['p'])}
+        }
+        prediction['data_points'] = shard['data_points']
+        return prediction
+    except Exception as e:
+        logger.error(f"Помилка читання таблиці прогнозів для ID {user_id}: {e}")
+        return None
+
+def predict_many(ids, target_dates, model=None):
+    """
+    Обчислює ймовірності для багатьох ID та дат за один векторний прохід.
+    
+    Args:
+        ids: список ID (числа; None для нерозпізнаних ID)
+        target_dates: список datetime.date
+        model: RegressionModel (за замовчуванням - load_prediction_model())
+    
+    Returns:
+        np.ndarray розміру len(ids) x len(target_dates) з кумулятивною ймовірністю
+        (у відсотках) того, що черга настане до кінця дати; NaN для ID без прогнозу.
+        None якщо модель недоступна.
+    """
+    from scipy import stats as scipy_stats
+    
+    if model is None:
+        model = load_prediction_model()
+        if model is None:
+            return None
+    
+    user_ids = np.array([np.nan if uid is None else float(uid) for uid in ids], dtype=float)
+    ordinals = np.array([get_ordinal_date(d) for d in target_dates], dtype=float)
+    
+    loc, scale = model.predict_dist_many(user_ids)
+    # ordinal + 1: ймовірність того, що черга настане ДО кінця дня
+    return scipy_stats.t.cdf(ordinals[np.newaxis, :] + 1, model.dof,
+                             loc=loc[:, np.newaxis], scale=scale[:, np.newaxis]) * 100
+
+def calculate_prediction_from_attendance_json(user_id, attendance_data):
+    """
+    Розраховує прогноз на основі даних з attendance_data.json.
+    
+    Args:
+        user_id: ID користувача
+        attendance_data: дані з attendance_data.json
+    
+    Returns:
+        dict з прогнозом або None
+    """
+    model = fit_regression_model(_points_from_attendance_json(attendance_data))
+    if model is None:
+        return None
+    
+    prediction = model.predict(user_id)
+    prediction['data_source'] = 'attendance_json'
+    return prediction
 
 def calculate_prediction_with_daily_data(user_id, use_daily_sheets=True, use_json_cache=True):
     """
@@ -746,9 +1760,11 @@ def calculate_prediction_with_daily_data(user_id, use_daily_sheets=True, use_jso
     Замість припущення що зайшли всі ID від min до max,
     використовує реальні ID людей які зайшли.
     
-    ВАЖЛИВО: Константи ваг синхронізовані з index.html:
-    - weightExpMin, weightExpMax, liveQueueWeight
-    Після зміни цих значень в index.html, оновіть їх тут також!
+    При use_json_cache модель береться з load_prediction_model(),
+    тож регресія не перераховується на кожен виклик.
+    
+    Модель з model.json (write_model_artifact) використовують і бот, і index.html,
+    тож константи WEIGHT_EXP_MIN, WEIGHT_EXP_MAX, LIVE_QUEUE_WEIGHT задаються лише тут.
     
     Args:
         user_id: ID користувача
@@ -763,11 +1779,13 @@ def calculate_prediction_with_daily_data(user_id, use_daily_sheets=True, use_jso
     if not use_daily_sheets:
         return None
     
-    # Спочатку пробуємо завантажити з JSON кешу
+    # Спочатку пробуємо готовий артефакт model.json, потім модель з JSON кешу
     if use_json_cache:
-        attendance_data = load_attendance_from_json()
-        if attendance_data:
-            return calculate_prediction_from_attendance_json(user_id, attendance_data)
+        model = load_prediction_model()
+        if model is not None:
+            prediction = model.predict(user_id)
+            prediction['data_source'] = 'attendance_json'
+            return prediction
     
     # Fallback: завантажуємо з CSV файлів
     hist_df = get_historical_attendance_data()
@@ -775,30 +1793,9 @@ def calculate_prediction_with_daily_data(user_id, use_daily_sheets=True, use_jso
     if hist_df is None or len(hist_df) < 5:
         return None
     
-    import numpy as np
-    import datetime
-    from scipy import stats as scipy_stats
-    
-    # Для кожного дня створюємо окрему точку для кожного ID що зайшов
-    points = []
-    
-    # Функція для конвертації дати в ordinal (як в оригінальному calculate_prediction)
-    def get_ordinal_date(date_obj):
-        anchor = datetime.date(1970, 1, 5)
-        diff = (date_obj - anchor).days
-        weeks = diff // 7
-        days = diff % 7
-        return weeks * 5 + min(days, 5)
-    
-    def get_date_from_ordinal(ordinal):
-        anchor = datetime.date(1970, 1, 5)
-        weeks = int(ordinal) // 5
-        days = int(ordinal) % 5
-        total_days = weeks * 7 + days
-        return anchor + datetime.timedelta(days=total_days)
-    
     # Створюємо окрему точку для кожного ID що зайшов
     # Це дає регресії повну інформацію про розкид і викиди
+    points = []
     for _, row in hist_df.iterrows():
         date_ordinal = get_ordinal_date(row['date'])
         for attended_item in row['attended_data']:
@@ -812,102 +1809,11 @@ def calculate_prediction_with_daily_data(user_id, use_daily_sheets=True, use_jso
                 'is_live': attended_item['is_live']
             })
     
-    if len(points) < 5:
-        return None
-    
-    # Створюємо DataFrame з усіх точок
-    points_df = pd.DataFrame(points)
-    
-    # Групуємо за ID і беремо середню дату (якщо ID зайшов кілька разів)
-    # Також маркуємо ID як is_live якщо хоча б одне відвідування було за живою чергою
-    id_groups = points_df.groupby('id').agg({
-        'ordinal': 'mean',
-        'is_live': 'max'  # True якщо хоча б одне відвідування було is_live
-    }).reset_index()
-    daily_stats = id_groups.sort_values('ordinal')
-    
-    X = daily_stats['id'].values
-    Y = daily_stats['ordinal'].values
-    is_live_mask = daily_stats['is_live'].values
-    n = len(X)
-    
-    if n < 5:
-        return None
-    
-    # Експоненційні ваги (новіші дані важливіші) + зменшена вага для живої черги
-    # Синхронізовано з index.html (константи WEIGHT_EXP_MIN, WEIGHT_EXP_MAX, LIVE_QUEUE_WEIGHT)
-    weightExpMin = -3
-    weightExpMax = 1
-    liveQueueWeight = 0  # Виключаємо живу чергу з розрахунків
-    
-    weights = np.exp(weightExpMin + (np.arange(n) / (n - 1)) * (weightExpMax - weightExpMin))
-    
-    # Зменшуємо вагу для точок живої черги
-    weights = np.where(is_live_mask, weights * liveQueueWeight, weights)
-    
-    sumW = np.sum(weights)
-    sumWX = np.sum(weights * X)
-    sumWY = np.sum(weights * Y)
-    sumWXX = np.sum(weights * X**2)
-    sumWXY = np.sum(weights * X * Y)
-    
-    denom = sumW * sumWXX - sumWX**2
-    if denom == 0:
+    model = fit_regression_model(points)
+    if model is None:
         return None
     
-    slope = (sumW * sumWXY - sumWX * sumWY) / denom
-    intercept = (sumWY - slope * sumWX) / sumW
-    
-    weightedMeanX = sumWX / sumW
-    weightedVarX = np.sum(weights * (X - weightedMeanX)**2)
-    
-    yPred = slope * X + intercept
-    residuals = Y - yPred
-    weightedSumResSq = np.sum(weights * residuals**2)
-    
-    dof = sumW - 2
-    if dof <= 0:
-        return None
-    
-    mseWeighted = weightedSumResSq / dof
-    
-    # T-показники
-    tScore90 = scipy_stats.t.ppf(0.95, dof)
-    tScore50 = scipy_stats.t.ppf(0.75, dof)
-    
-    predOrd = slope * user_id + intercept
-    
-    term3 = (user_id - weightedMeanX)**2 / weightedVarX
-    sePred = np.sqrt(mseWeighted * (1 + 1/sumW + term3))
-    
-    margin90 = tScore90 * sePred
-    margin50 = tScore50 * sePred
-    
-    l90_ord = predOrd - margin90
-    h90_ord = predOrd + margin90
-    l50_ord = predOrd - margin50
-    h50_ord = predOrd + margin50
-    
-    # Обмеження майбутнім
-    max_hist_ord = points_df['ordinal'].max()
-    min_feasible = max_hist_ord + 1
-    
-    if user_id > daily_stats['id'].max():
-        l90_ord = max(l90_ord, min_feasible)
-        l50_ord = max(l50_ord, min_feasible)
-    
-    return {
-        'l90': get_date_from_ordinal(l90_ord),
-        'l50': get_date_from_ordinal(l50_ord),
-        'mean': get_date_from_ordinal(predOrd),
-        'h50': get_date_from_ordinal(h50_ord),
-        'h90': get_date_from_ordinal(h90_ord),
-        'dist': {
-            'loc': predOrd,
-            'scale': sePred,
-            'df': dof
-        },
-        'data_points': len(points),
-        'data_source': 'daily_sheets',
-        'using_daily_sheets': True
-    }
+    prediction = model.predict(user_id)
+    prediction['data_source'] = 'daily_sheets'
+    prediction['using_daily_sheets'] = True
+    return prediction
@@ -0,0 +1,506 @@
+// Спільна логіка прогнозу черги для index.html та chart_worker.js
+// (ES module: імпортується сторінкою і Web Worker'ом)
+
+// --- Константи налаштування прогнозної моделі (лише для fallback без model.json) ---
+export const WEIGHT_EXP_MIN = -3;  // Мінімальна експонента ваги (для найстаріших точок)
+export const WEIGHT_EXP_MAX = 1;   // Максимальна експонента ваги (для найновіших точок)
+export const LIVE_QUEUE_WEIGHT = 0; // Вага для живої черги (0 = виключити з розрахунків)
+
+// --- Helper Functions ---
+
+export function idToNumeric(idVal) {
+    // Converts ID string to numeric value for regression
+    // "1234" -> 1234.0
+    // "1234/1" -> 1234.01
+    // "1234/2" -> 1234.02
+    const s = String(idVal).trim();
+    if (!s) return null;
+    
+    if (s.includes('/')) {
+        const parts = s.split('/');
+        const main = parseInt(parts[0], 10);
+        if (isNaN(main)) return null;
+        
+        let sub = 0;
+        if (parts.length > 1) {
+            const subNum = parseInt(parts[1], 10);
+            if (!isNaN(subNum)) {
+                sub = subNum;
+            }
+        }
+        return main + (sub / 100.0);
+    }
+    
+    // Try parsing as plain number
+    const num = parseFloat(s);
+    if (!isNaN(num)) return num;
+    
+    // Fallback: extract first sequence of digits
+    const match = s.match(/^(\d+)/);
+    if (match) {
+        return parseFloat(match[1]);
+    }
+    
+    return null;
+}
+
+export function numericToId(numericVal) {
+    // Converts numeric value back to ID string (INVERSE of idToNumeric)
+    // 1234.0 -> "1234"
+    // 1234.01 -> "1234/1"
+    // 1234.04 -> "1234/4"
+    const main = Math.floor(numericVal);
+    const fractional = numericVal - main;
+    
+    // Use tighter tolerance for detecting "whole" numbers
+    if (Math.abs(fractional) < 0.001) {
+        return String(main);
+    }
+    
+    const sub = Math.round(fractional * 100);
+    
+    // Debug logging for problematic IDs
+    if (main === 4794 && sub > 0) {
+        console.log('numericToId DEBUG:', { numericVal, main, fractional, sub, result: `${main}/${sub}` });
+    }
+    
+    if (sub > 0) {
+        return `${main}/${sub}`;
+    }
+    
+    return String(main);
+}
+
+// Anchor date: Monday, Jan 5, 1970
+const ANCHOR_DATE = new Date(1970, 0, 5, 12, 0, 0); 
+const MS_PER_DAY = 24 * 60 * 60 * 1000;
+
+export function toOrdinal(date) {
+    // Calculate business days since anchor
+    const diffTime = date.getTime() - ANCHOR_DATE.getTime();
+    // Use round() instead of floor() to handle DST shifts (23h/25h days) safely
+    const totalDays = Math.round(diffTime / MS_PER_DAY);
+    
+    const weeks = Math.floor(totalDays / 7);
+    const days = totalDays % 7; // 0=Mon, ..., 4=Fri, 5=Sat, 6=Sun
+    
+    // Clamp Sat/Sun to 5 (start of next week / end of current week overlap)
+    // But simpler: just count 5 days per week.
+    // Mon(0)->0, Fri(4)->4, Sat(5)->5, Sun(6)->5, Mon(7)->5 (Wait, next Mon is 5)
+    
+    // Let's handle the case where totalDays might be negative (before 1970) just in case, 
+    // though unlikely for this dataset. Assuming post-1970.
+    
+    return weeks * 5 + Math.min(days, 5);
+}
+
+export function fromOrdinal(ordinal) {
+    // Convert business days back to calendar date
+    const weeks = Math.floor(ordinal / 5);
+    const days = ordinal % 5; // 0..4.999
+    
+    // 5 business days -> 7 calendar days
+    const totalDays = weeks * 7 + days;
+    
+    return new Date(ANCHOR_DATE.getTime() + totalDays * MS_PER_DAY);
+}
+
+// --- Regression Logic ---
+
+function weightedLinearRegression(x, y, weights) {
+    const n = x.length;
+    let sumW = 0;
+    let sumWX = 0;
+    let sumWY = 0;
+    let sumWXX = 0;
+    let sumWXY = 0;
+
+    for (let i = 0; i < n; i++) {
+        const w = weights[i];
+        sumW += w;
+        sumWX += w * x[i];
+        sumWY += w * y[i];
+        sumWXX += w * x[i] * x[i];
+        sumWXY += w * x[i] * y[i];
+    }
+
+    const denom = sumW * sumWXX - sumWX * sumWX;
+    if (denom === 0) return { slope: 0, intercept: 0 };
+
+    const slope = (sumW * sumWXY - sumWX * sumWY) / denom;
+    const intercept = (sumWY - slope * sumWX) / sumW;
+
+    return { slope, intercept };
+}
+
+export function fitRegression(points, studentTInv) {
+    // Fallback, якщо model.json недоступний
+    // studentTInv(p, dof) - квантиль t-розподілу (jStat.studentt.inv)
+    // Групуємо точки відвідуваності за ID для регресії
+    // Якщо ID відвідав кілька разів, беремо середню дату
+    const idGroups = new Map();
+    points.forEach(point => {
+        if (!idGroups.has(point.id)) {
+            idGroups.set(point.id, { ordinals: [], isLive: false, idNumeric: point.idNumeric });
+        }
+        idGroups.get(point.id).ordinals.push(point.ordinal);
+        // Якщо хоча б одне відвідування було за живою чергою, маркуємо ID
+        if (point.isLive) {
+            idGroups.get(point.id).isLive = true;
+        }
+    });
+
+    const regressionData = Array.from(idGroups.entries()).map(([id, data]) => {
+        const avgOrdinal = data.ordinals.reduce((a, b) => a + b, 0) / data.ordinals.length;
+        return { id, idNumeric: data.idNumeric, ordinal: avgOrdinal, isLive: data.isLive };
+    });
+
+    regressionData.sort((a, b) => a.idNumeric - b.idNumeric);
+
+    console.log('Regression data:', regressionData.length, 'groups');
+    const X = regressionData.map(d => d.idNumeric); // Предиктор: ID черги
+    const Y = regressionData.map(d => d.ordinal); // Цільова змінна: Дата
+    const n = regressionData.length;
+
+    // Ваги: експоненційне затухання + зменшена вага для живої черги
+    const weights = [];
+    for (let i = 0; i < n; i++) {
+        const val = WEIGHT_EXP_MIN + (i / (n - 1)) * (WEIGHT_EXP_MAX - WEIGHT_EXP_MIN);
+        let weight = Math.exp(val);
+    
+        // Зменшуємо вагу для точок живої черги
+        if (regressionData[i].isLive) {
+            weight *= LIVE_QUEUE_WEIGHT;
+        }
+    
+        weights.push(weight);
+    }
+
+    // 3. Train Model
+    const model = weightedLinearRegression(X, Y, weights);
+
+    // 4. Calculate Statistics for Intervals
+    let sumW = 0;
+    let weightedMeanX = 0;
+    for(let i=0; i<n; i++) {
+        sumW += weights[i];
+        weightedMeanX += weights[i] * X[i];
+    }
+    weightedMeanX /= sumW;
+
+    let weightedVarX = 0;
+    let weightedSumResSq = 0;
+    for(let i=0; i<n; i++) {
+        weightedVarX += weights[i] * Math.pow(X[i] - weightedMeanX, 2);
+        const yPred = model.slope * X[i] + model.intercept;
+        const res = Y[i] - yPred;
+        weightedSumResSq += weights[i] * res * res;
+    }
+
+    const degreesOfFreedom = sumW - 2;
+    const mseWeighted = weightedSumResSq / degreesOfFreedom;
+
+    // T-scores
+    // For "5% Chance" and "95% Chance" labels, we need the 5th and 95th percentiles.
+    // This corresponds to a 90% Confidence Interval (alpha=0.10, two-tailed -> 0.05 in each tail).
+    // inv(0.95) gives the 95th percentile.
+    const tScore90 = studentTInv(0.95, degreesOfFreedom);
+    // 50% confidence -> alpha=0.50, two-tailed -> 0.75 (75th percentile)
+    const tScore50 = studentTInv(0.75, degreesOfFreedom);
+
+    return { model, tScore90, tScore50, weightedMeanX, weightedVarX, mseWeighted, sumW };
+}
+
+export function modelFromArtifact(artifact) {
+    // model.json генерується синхронізацією (daily_sheets_sync.write_model_artifact)
+    return {
+        model: { slope: artifact.slope, intercept: artifact.intercept },
+        tScore90: artifact.t_score_90,
+        tScore50: artifact.t_score_50,
+        weightedMeanX: artifact.weighted_mean_x,
+        weightedVarX: artifact.weighted_var_x,
+        mseWeighted: artifact.mse,
+        sumW: artifact.sum_w
+    };
+}
+
+// --- Attendance Data ---
+
+export function decodeCompactAttendance(compact) {
+    // Дати дедупліковані, порядкові номери робочих днів пораховані заздалегідь,
+    // тож idToNumeric/toOrdinal для кожної точки не потрібні
+    const dateObjs = compact.dates.map(d => new Date(d + 'T12:00:00'));
+    const live = new Set(compact.live);
+    const points = new Array(compact.d.length);
+    
+    for (let i = 0; i < compact.d.length; i++) {
+        const di = compact.d[i];
+        const main = compact.id_main[i];
+        const sub = compact.id_sub[i];
+        points[i] = {
+            date: compact.dates[di],
+            id: sub ? `${main}/${sub}` : String(main),
+            is_live: live.has(i),
+            idNumeric: main + (sub / 100.0),
+            dateObj: dateObjs[di],
+            ordinal: compact.ordinals[di]
+        };
+    }
+    
+    return { attendance_points: points, total_points: compact.total_points };
+}
+
+export function latestAttendanceDate(attendancePayload) {
+    // Остання дата відвідуваності ('YYYY-MM-DD') без повного розбору payload
+    if (attendancePayload.attendance_points) {
+        const dates = attendancePayload.attendance_points.map(p => p.date);
+        dates.sort();
+        return dates.length > 0 ? dates[dates.length - 1] : null;
+    }
+    const dates = attendancePayload.dates || [];
+    return dates.length > 0 ? dates[dates.length - 1] : null;
+}
+
+export function predictInterval(fit, qId) {
+    // Прогноз з інтервалами для одного ID (ті ж формули, що RegressionModel.predict)
+    const { model, tScore90, tScore50, weightedMeanX, weightedVarX, mseWeighted, sumW } = fit;
+    const predOrd = model.slope * qId + model.intercept;
+
+    const term3 = Math.pow(qId - weightedMeanX, 2) / weightedVarX;
+    const sePred = Math.sqrt(mseWeighted * (1 + 1/sumW + term3));
+
+    const margin90 = tScore90 * sePred;
+    const margin50 = tScore50 * sePred;
+
+    let l90 = predOrd - margin90;
+    let h90 = predOrd + margin90;
+    let l50 = predOrd - margin50;
+    let h50 = predOrd + margin50;
+
+    if (l90 > predOrd) l90 = predOrd;
+    if (h90 < predOrd) h90 = predOrd;
+    if (l50 > predOrd) l50 = predOrd;
+    if (h50 < predOrd) h50 = predOrd;
+
+    return {
+        id: qId,
+        mean: fromOrdinal(predOrd),
+        l90: fromOrdinal(l90),
+        h90: fromOrdinal(h90),
+        l50: fromOrdinal(l50),
+        h50: fromOrdinal(h50)
+    };
+}
+
+// --- Chart Data Preparation ---
+
+export function toChartPoints(attendanceData) {
+    // Точки для scatter-датасетів: { regularPoints, liveQueuePoints }
+    const regularPoints = [];
+    const liveQueuePoints = [];
+    attendanceData.attendance_points.forEach(point => {
+        const id = String(point.id);
+        const idNumeric = point.idNumeric ?? idToNumeric(id);
+        if (idNumeric === null || isNaN(idNumeric)) return;
+        const chartPoint = { x: point.dateObj ?? new Date(point.date + 'T12:00:00'), y: idNumeric, id };
+        (point.is_live ? liveQueuePoints : regularPoints).push(chartPoint);
+    });
+    return { regularPoints, liveQueuePoints };
+}
+
+export function prepareChartData(attendancePayload, modelArtifact, studentTInv, overviewPayload = null) {
+    // Групування точок, регресія та інтервали - усе, що потрібно графіку.
+    // Виконується у chart_worker.js; результат передається через structured clone (Date, Map).
+    // overviewPayload (chart_tiles/overview.json) - зменшена вибірка для scatter-датасетів;
+    // без неї графік малює всі точки.
+    const attendanceData = attendancePayload.attendance_points
+        ? attendancePayload
+        : decodeCompactAttendance(attendancePayload);
+    console.log(`Завантажено ${attendanceData.total_points} точок відвідуваності`);
+
+    // Обробка даних фактичної відвідуваності з щоденних аркушів
+    const allAttendancePoints = [];
+    const liveQueuePoints = [];
+    const regularPoints = [];
+    // Дата візиту за string ID (для freezeAtId; звичайна черга має пріоритет)
+    const historicalDates = new Map();
+    let maxId = 0;
+    let maxDateOrdinal = 0;
+    let minDateOrdinal = Infinity;
+
+    // Групуємо дані за датами для візуалізації діапазонів
+    const dailyRanges = new Map();
+
+    // Створюємо mapping: numeric ID -> original string ID
+    const numericToOriginalId = new Map();
+
+    attendanceData.attendance_points.forEach(point => {
+        // String ID - first-class citizen
+        const id = String(point.id);
+        const idNumeric = point.idNumeric ?? idToNumeric(id);
+        if (idNumeric === null || isNaN(idNumeric)) {
+            console.warn('Пропущено невалідний ID:', point.id);
+            return;
+        }
+
+        // Зберігаємо mapping для конвертації назад
+        numericToOriginalId.set(idNumeric, id);
+
+        const date = point.dateObj ?? new Date(point.date + 'T12:00:00');
+        const ordinal = point.ordinal ?? toOrdinal(date);
+        const isLive = point.is_live || false;
+
+        const pointData = { id, idNumeric, date, ordinal, isLive };
+        allAttendancePoints.push(pointData);
+
+        // Для chart plotting використовуємо numeric, але зберігаємо string
+        if (isLive) {
+            liveQueuePoints.push({ x: date, y: idNumeric, id });
+        } else {
+            regularPoints.push({ x: date, y: idNumeric, id });
+        }
+
+        if (idNumeric > maxId) maxId = idNumeric;
+        if (ordinal > maxDateOrdinal) maxDateOrdinal = ordinal;
+        if (ordinal < minDateOrdinal) minDateOrdinal = ordinal;
+
+        // Додаємо до групи для обчислення діапазону
+        if (!dailyRanges.has(point.date)) {
+            dailyRanges.set(point.date, { ids: [], date: date });
+        }
+        dailyRanges.get(point.date).ids.push(idNumeric);
+    });
+
+    // Створюємо діапазони для візуалізації
+    const histRanges = [];
+    dailyRanges.forEach((data, dateStr) => {
+        const ids = data.ids;
+        if (ids.length > 0) {
+            histRanges.push({
+                x: data.date,
+                y: [Math.min(...ids), Math.max(...ids)],
+                thickness: ids.length
+            });
+        }
+    });
+
+    regularPoints.forEach(p => { if (!historicalDates.has(p.id)) historicalDates.set(p.id, p.x); });
+    liveQueuePoints.forEach(p => { if (!historicalDates.has(p.id)) historicalDates.set(p.id, p.x); });
+
+    const targetEndId = maxId + 100;
+
+    if (allAttendancePoints.length === 0) {
+        console.error('No attendance points found!');
+        throw new Error("Дійсних даних не знайдено.");
+    }
+
+    console.log('Attendance points loaded:', allAttendancePoints.length);
+
+    // Calculate average daily count (last 10 working days)
+    const dateCountMap = new Map();
+    dailyRanges.forEach((data) => {
+        const iso = data.date.toISOString().split('T')[0];
+        dateCountMap.set(iso, data.ids.length);
+    });
+
+    const lastWorkingDate = fromOrdinal(maxDateOrdinal);
+    const lastWorkingDays = [];
+    let currentDate = new Date(lastWorkingDate);
+
+    while (lastWorkingDays.length < 10) {
+        const dayOfWeek = currentDate.getDay(); // 0=Sun, 6=Sat
+        if (dayOfWeek !== 0 && dayOfWeek !== 6) {
+            const iso = currentDate.toISOString().split('T')[0];
+            const count = dateCountMap.get(iso) || 0;
+            lastWorkingDays.push({ date: new Date(currentDate), count });
+        }
+        currentDate.setDate(currentDate.getDate() - 1);
+    }
+
+    const total = lastWorkingDays.reduce((sum, item) => sum + item.count, 0.0);
+    const avgDailyCount = (total / lastWorkingDays.length).toFixed(1);
+
+    // Параметри моделі: готовий model.json (той самий, що використовує бот),
+    // інакше - підбір регресії
+    const fit = modelArtifact ? modelFromArtifact(modelArtifact) : fitRegression(allAttendancePoints, studentTInv);
+    const historicalIds = Array.from(new Set(allAttendancePoints.map(p => p.idNumeric)));
+
+    // DRY функція для генерації прогнозів
+    const generatePredictions = (startId, endId, includeSlashedIds = true) => {
+        const allNumericIds = new Set();
+
+        if (includeSlashedIds) {
+            // Додаємо всі унікальні історичні ID (включно зі слешованими)
+            historicalIds.forEach(id => allNumericIds.add(id));
+        }
+
+        // Додаємо цілі числа для гладких ліній
+        const minIdInt = Math.floor(startId);
+        const maxIdInt = Math.ceil(endId);
+        for (let i = minIdInt; i <= maxIdInt; i++) {
+            allNumericIds.add(i);
+        }
+
+        const sortedIds = Array.from(allNumericIds).sort((a, b) => a - b);
+        return sortedIds.map(qId => predictInterval(fit, qId));
+    };
+
+    // 5. Generate Prediction Data Points
+    const minHistoricalId = Math.min(...historicalIds);
+    const predPoints = generatePredictions(minHistoricalId, targetEndId, true);
+
+    // 6. Chart.js Data Structure
+
+    // Визначаємо останню історичну дату
+    const lastHistoricalDate = fromOrdinal(maxDateOrdinal);
+
+    // Знаходимо наступний робочий день після останньої історичної дати
+    let nextWorkingDate = new Date(lastHistoricalDate);
+    nextWorkingDate.setDate(nextWorkingDate.getDate() + 1);
+
+    // Пропускаємо вихідні (5 = субота, 6 = неділя)
+    while (nextWorkingDate.getDay() === 0 || nextWorkingDate.getDay() === 6) {
+        nextWorkingDate.setDate(nextWorkingDate.getDate() + 1);
+    }
+
+    const nextWorkingTime = nextWorkingDate.getTime();
+
+    // Визначаємо найранішу історичну дату
+    const earliestHistoricalDate = fromOrdinal(minDateOrdinal);
+    const earliestHistoricalTime = earliestHistoricalDate.getTime();
+
+    // Створюємо повні дані для freezeAtId
+    // ВАЖЛИВО: зберігаємо і string ID і numeric (для plotting)
+    const allMeanData = predPoints.map(p => ({
+        x: p.mean,
+        y: p.id,  // numeric для chart plotting
+        id: numericToId(p.id)  // STRING для display
+    }));
+    const allL90Data = predPoints.map(p => ({ x: p.l90, y: p.id }));
+    const allH90Data = predPoints.map(p => ({ x: p.h90, y: p.id }));
+    const allL50Data = predPoints.map(p => ({ x: p.l50, y: p.id }));
+    const allH50Data = predPoints.map(p => ({ x: p.h50, y: p.id }));
+
+    console.log('Generated allMeanData points:', allMeanData.length);
+
+    const filterFutureOnly = (arr) => arr.filter(p => p.x.getTime() >= nextWorkingTime);
+    const filterFromEarliest = (arr) => arr.filter(p => p.x.getTime() >= earliestHistoricalTime);
+
+    const plotted = overviewPayload
+        ? toChartPoints(decodeCompactAttendance(overviewPayload))
+        : { regularPoints, liveQueuePoints };
+
+    return {
+        regularPoints: plotted.regularPoints,
+        liveQueuePoints: plotted.liveQueuePoints,
+        tiles: overviewPayload ? overviewPayload.tiles : null,
+        historicalDates, histRanges, numericToOriginalId,
+        maxDateOrdinal, avgDailyCount, fit,
+        meanData: filterFromEarliest(allMeanData),
+        l90Data: filterFutureOnly(allL90Data),
+        h90Data: filterFutureOnly(allH90Data),
+        l50Data: filterFutureOnly(allL50Data),
+        h50Data: filterFutureOnly(allH50Data),
+        allMeanData, allL90Data, allH90Data, allL50Data, allH50Data
+    };
+}
@@ -4,19 +4,22 @@
 Використання:
     python sync_for_github_actions.py              # Стандартний режим
     python sync_for_github_actions.py --force-all  # Перезавантажити всі аркуші
+    python sync_for_github_actions.py --batch-size 50  # Аркушів в одному batchGet запиті
+    python sync_for_github_actions.py --concurrency 8  # Паралельних запитів до Sheets API
 """
 
 import logging
 import argparse
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from daily_sheets_sync import sync_daily_sheets
+from daily_sheets_sync import sync_daily_sheets, download_prebooked_snapshot, SHEETS_BATCH_SIZE, SHEETS_FETCH_CONCURRENCY, SHEETS_REQUESTS_PER_MINUTE
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 STATS_SHEET_ID = '1d9OG-0b7wxxqrOujC9v6ikhjMKL2ei3wfrfaG61zSjA'
 STATS_WORKSHEET_NAME = 'Stats'
+PRE_BOOKED_SHEET_GID = 84071606  # Аркуш попередніх записів (gid з URL), знімок -> prebooked.json
 SERVICE_ACCOUNT_KEY_PATH = 'service_account_key.json'
 SERVICE_ACCOUNT_SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
 
@@ -27,6 +30,24 @@ def main():
         action='store_true',
         help='Перезавантажити всі аркуші (ігнорувати кеш)'
     )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=SHEETS_BATCH_SIZE,
+        help=f'Кількість аркушів в одному batchGet запиті (за замовчуванням {SHEETS_BATCH_SIZE})'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=SHEETS_FETCH_CONCURRENCY,
+        help=f'Кількість паралельних запитів (за замовчуванням {SHEETS_FETCH_CONCURRENCY})'
+    )
+    parser.add_argument(
+        '--requests-per-minute',
+        type=int,
+        default=SHEETS_REQUESTS_PER_MINUTE,
+        help=f'Ліміт запитів до Sheets API на хвилину (за замовчуванням {SHEETS_REQUESTS_PER_MINUTE})'
+    )
     args = parser.parse_args()
     
     if args.force_all:
@@ -43,9 +64,16 @@ def main():
         STATS_SHEET_ID, 
         STATS_WORKSHEET_NAME, 
         force_refresh_stats=True,
-        force_refresh_all_sheets=args.force_all
+        force_refresh_all_sheets=args.force_all,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        requests_per_minute=args.requests_per_minute
     )
     
+    # Знімок TODO необов'язковий: сторінка читає живий CSV, якщо prebooked.json немає
+    if success and not download_prebooked_snapshot(sheets_service, STATS_SHEET_ID, PRE_BOOKED_SHEET_GID):
+        logger.warning('Не вдалося оновити знімок попередніх записів, дані відвідуваності зберігаються без нього')
+    
     if success:
         logger.info('Синхронізація успішна')
         return 0
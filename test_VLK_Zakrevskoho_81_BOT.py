@@ -1,15 +1,25 @@
 import pytest
+import asyncio
 import pandas as pd
 import datetime
 import numpy as np
 import re
+import os
+import json
+import httpx
 from unittest.mock import MagicMock, patch, AsyncMock
+import telegram
 from telegram import Update, User, Message, Chat
 from telegram.ext import ContextTypes
 
 # Імпорт модуля, що тестується
 # Припускаємо, що модуль знаходиться в тій же директорії або в PYTHONPATH
 import VLK_Zakrevskoho_81_BOT as bot
+import daily_sheets_sync
+import daily_sheet_parser
+import admission_probability
+import attendance_store
+import broadcast
 
 # Ініціалізація глобальних змінних для тестування (хоча ми переважно використовуємо моки)
 bot.ADMIN_IDS = [12345]
@@ -131,6 +141,23 @@ def test_date_keyboard_format():
     # Перевіряємо, що це 2 цифри року
     assert re.search(r'\d{2}\.\d{2}\.\d{2}', first_button_text)
 
+def test_date_keyboards_reused_until_model_refresh():
+    bot.clear_keyboard_cache()
+    today = datetime.date(2025, 12, 1)
+    dist = {'loc': 20440.0, 'scale': 5.0, 'df': 12}
+    
+    with patch.object(bot, 'generate_date_options', wraps=bot.generate_date_options) as generate:
+        reply = bot.date_keyboard(today, 1, 15, prediction_dist=dist)
+        assert bot.date_keyboard(today, 1, 15, prediction_dist=dict(dist, loc=20440.0001)) is reply
+        inline = bot.date_inline_keyboard('111', today, 1, 15, prediction_dist=dist)
+        assert bot.date_inline_keyboard('111', today, 1, 15, prediction_dist=dist) is inline
+        assert bot.date_inline_keyboard('222', today, 1, 15, prediction_dist=dist) is not inline
+        assert generate.call_count == 3
+        
+        bot.clear_keyboard_cache()
+        assert bot.date_keyboard(today, 1, 15, prediction_dist=dist) is not reply
+        assert generate.call_count == 4
+
 # --- Тести логіки прогнозування ---
 
 def test_calculate_prediction_insufficient_data():
@@ -173,6 +200,381 @@ def test_calculate_prediction_valid():
     assert isinstance(res['l90'], datetime.date)
     assert isinstance(res['h90'], datetime.date)
 
+def _write_attendance_json(path, n=12, id_jitter=0):
+    points = []
+    day = datetime.date(2025, 1, 6)
+    for i in range(n):
+        # id_jitter > 0 дає ненульовий розкид (scale) регресії
+        points.append({'date': day.isoformat(), 'id': str(1000 + i * 10 + (i % 3) * id_jitter), 'is_live': False})
+        day += datetime.timedelta(days=1 if day.weekday() < 4 else 3)
+    path.write_text(json.dumps({'attendance_points': points, 'total_points': n}), encoding='utf-8')
+    return points
+
+def test_attendance_model_cached_until_content_changes(tmp_path):
+    json_file = tmp_path / "attendance_data.json"
+    points = _write_attendance_json(json_file)
+    
+    model = daily_sheets_sync.get_attendance_model(str(json_file))
+    assert model is not None
+    assert daily_sheets_sync.get_attendance_model(str(json_file)) is model
+    
+    # Зміна лише mtime (os.utime після синхронізації) не перебудовує модель
+    os.utime(json_file, None)
+    assert daily_sheets_sync.get_attendance_model(str(json_file)) is model
+    
+    # Прогноз з кешованої моделі збігається з повним розрахунком
+    expected = daily_sheets_sync.calculate_prediction_from_attendance_json(1125, {'attendance_points': points})
+    predicted = model.predict(1125)
+    assert predicted['mean'] == expected['mean']
+    assert predicted['dist']['loc'] == pytest.approx(expected['dist']['loc'])
+    
+    _write_attendance_json(json_file, n=15)
+    assert daily_sheets_sync.get_attendance_model(str(json_file)) is not model
+
+def test_model_artifact_roundtrip(tmp_path):
+    json_file = tmp_path / "attendance_data.json"
+    _write_attendance_json(json_file)
+    model = daily_sheets_sync.get_attendance_model(str(json_file))
+    artifact = str(tmp_path / "model.json")
+    
+    assert daily_sheets_sync.write_model_artifact(model, artifact)
+    assert not daily_sheets_sync.write_model_artifact(model, artifact)
+    assert daily_sheets_sync.load_model_artifact(artifact) == model
+    
+    # Артефакт з іншими вагами не використовується
+    with patch('daily_sheets_sync.WEIGHT_EXP_MIN', -4):
+        daily_sheets_sync._artifact_cache.clear()
+        assert daily_sheets_sync.load_model_artifact(artifact) is None
+
+def test_prediction_lookup_matches_model(tmp_path):
+    json_file = tmp_path / "attendance_data.json"
+    _write_attendance_json(json_file, id_jitter=4)
+    model = daily_sheets_sync.get_attendance_model(str(json_file))
+    assert model.predict(1100)['dist']['scale'] > 0
+    lookup_dir = str(tmp_path / "forecast")
+
+    assert daily_sheets_sync.write_prediction_lookup(model, lookup_dir)
+    # Та сама модель - таблиця не перебудовується
+    with patch('daily_sheets_sync.build_prediction_lookup', side_effect=AssertionError):
+        assert not daily_sheets_sync.write_prediction_lookup(model, lookup_dir)
+
+    user_id = int(model.max_id) + 50
+    prediction = daily_sheets_sync.lookup_prediction(user_id, model, lookup_dir)
+    expected = model.predict(user_id)
+    for key in ('l90', 'l50', 'mean', 'h50', 'h90'):
+        assert prediction[key] == expected[key]
+    days = sorted(prediction['dist']['probabilities'])
+    # Вікно прив'язане до моделі (наступний робочий день після останньої точки), а не до сьогодні
+    assert days[0] == datetime.date(2025, 1, 22)
+    probabilities = [bot.calculate_date_probability(day, prediction['dist']) for day in days]
+    assert probabilities == sorted(probabilities) and any(1 < p < 99 for p in probabilities)
+    for day, p in zip(days, probabilities):
+        assert p == pytest.approx(bot.calculate_date_probability(day, expected['dist']), abs=0.05)
+
+    # Таблиця іншої моделі не використовується
+    other = daily_sheets_sync.RegressionModel(**{**daily_sheets_sync.asdict(model), 'slope': model.slope * 2})
+    assert daily_sheets_sync.lookup_prediction(user_id, other, lookup_dir) is None
+
+def test_predict_many_matches_single_predictions(tmp_path):
+    json_file = tmp_path / "attendance_data.json"
+    _write_attendance_json(json_file)
+    model = daily_sheets_sync.get_attendance_model(str(json_file))
+    
+    ids = [1050, 1130, None]
+    dates = [datetime.date(2025, 1, 20), datetime.date(2025, 1, 27)]
+    matrix = daily_sheets_sync.predict_many(ids, dates, model=model)
+    
+    assert matrix.shape == (3, 2)
+    for row, uid in enumerate(ids[:2]):
+        dist = model.predict(uid)['dist']
+        for col, date_obj in enumerate(dates):
+            assert matrix[row, col] == pytest.approx(bot.calculate_date_probability(date_obj, dist))
+    assert np.isnan(matrix[2]).all()
+
+def test_date_probabilities_share_one_table():
+    bot._probability_table.cache_clear()
+    dist = {'loc': 20200.0, 'scale': 6.0, 'df': 12}
+    today = datetime.date(2025, 6, 2)
+    options = bot.generate_date_options(today=today, days_ahead=20, prediction_dist=dist)
+    bot.format_prediction_range_text({'dist': dist, 'mean': today, 'l90': today, 'h90': today}, today)
+    
+    # Одна таблиця t.cdf на прогноз, решта викликів - з кешу
+    assert bot._probability_table.cache_info().misses == 1
+    dates = [o['date'] for o in options] + [datetime.date(2027, 1, 4)]
+    expected = [bot.stats.t.cdf(bot.get_ordinal_date(d) + 1, 12, loc=20200.0, scale=6.0) * 100 for d in dates]
+    assert bot.calculate_date_probabilities(dates, dist, today) == pytest.approx(expected)
+
+def test_download_daily_sheets_batch_groups_ranges(tmp_path, monkeypatch):
+    monkeypatch.setattr(daily_sheets_sync, 'DAILY_SHEETS_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr('time.sleep', lambda s: None)
+    service = MagicMock()
+    batch_get = service.spreadsheets.return_value.values.return_value.batchGet
+    batch_get.return_value.execute.side_effect = [
+        {'valueRanges': [{'values': [['№', 'ID']]}, {'values': []}]},
+        {'valueRanges': [{'values': [['№', 'ID'], ['1', '1001']]}]},
+    ]
+    
+    names = ['06.01.2025', '07.01.2025', '08.01.2025']
+    downloaded = daily_sheets_sync.download_daily_sheets_batch(service, 'sheet', names, batch_size=2, concurrency=1)
+    
+    assert downloaded == ['06.01.2025', '08.01.2025']
+    assert batch_get.call_count == 2
+    assert batch_get.call_args_list[0].kwargs['ranges'] == ['06.01.2025!A:Z', '07.01.2025!A:Z']
+    assert (tmp_path / '2025-01-08.csv').read_text(encoding='utf-8').splitlines() == ['№,ID', '1,1001']
+    assert not (tmp_path / '2025-01-07.csv').exists()
+
+def test_daily_sheet_parsed_once_for_all_consumers(tmp_path):
+    csv_file = tmp_path / '2025-10-01.csv'
+    csv_file.write_text(
+        'Заголовок\n'
+        'Попередній прийом:,,30.09.2025 (10:00 - 14:00),,,Поточний прийом:,,01.10.2025 (15:00 - 17:30)\n'
+        '№,ID,Статус,Примітки,,№,Примітки,ID,Статус\n'
+        '1,2983,Зайшов,,,1,,3001,Обіцяв бути\n'
+        "2,2988,Не з'явився,,,2,,3002,\n"
+        '31,3100/1,Зайшов (за живою чергою),,,,,,\n',
+        encoding='utf-8'
+    )
+    path = str(csv_file)
+    
+    with patch('daily_sheet_parser.parse_daily_sheet', wraps=daily_sheet_parser.parse_daily_sheet) as mock_parse:
+        sheet = daily_sheet_parser.load_daily_sheet(path)
+        attended = daily_sheets_sync.extract_attended_ids_from_sheet(path)
+        left = admission_probability.parse_left_section(path)
+        right = admission_probability.parse_right_section(path)
+    
+    assert mock_parse.call_count == 1
+    assert (sheet.previous_date, sheet.current_date) == (datetime.date(2025, 9, 30), datetime.date(2025, 10, 1))
+    assert attended == [{'id': '2983', 'is_live': False}, {'id': '3100/1', 'is_live': True}]
+    assert [e.queue_id for e in left] == ['2983', '2988', '3100/1']
+    assert [(e.queue_id, e.status) for e in right] == [('3001', 'Обіцяв бути'), ('3002', '')]
+    assert daily_sheets_sync.parse_daily_sheet_attendance(path)['no_show'] == 1
+
+def test_attendance_store_built_from_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(daily_sheets_sync, 'DAILY_SHEETS_CACHE_DIR', str(tmp_path))
+    (tmp_path / '_stats.csv').write_text('Аркуш,Дата прийому,Зайшов\n01.10.2025,01.10.2025,2\n', encoding='utf-8')
+    (tmp_path / '2025-10-01.csv').write_text(
+        'Заголовок\n,\n№,ID,Статус,Примітки\n'
+        '1,2983,Зайшов,\n2,2988/1,Не зайшов,\n31,3100,Зайшов (за живою чергою),\n',
+        encoding='utf-8'
+    )
+    manifest_hashes = {'2025-10-01.csv': 'a', '_stats.csv': 'b'}
+    
+    assert daily_sheets_sync.build_attendance_store(manifest_hashes)
+    assert not daily_sheets_sync.build_attendance_store(manifest_hashes)
+    # Без відповідного маніфесту сховище вважається застарілим
+    assert attendance_store.load_current_store(str(tmp_path)) is None
+    
+    (tmp_path / '_manifest.json').write_text(json.dumps(manifest_hashes), encoding='utf-8')
+    store = attendance_store.load_current_store(str(tmp_path))
+    assert store['point_id_main'].tolist() == [2983, 3100]
+    assert store['point_is_live'].tolist() == [False, True]
+    assert store.numeric_ids('row').tolist() == [2983.0, 2988.01, 3100.0]
+    assert [store.status_names[c] for c in store['row_status']] == ['Зайшов', 'Не зайшов', 'Зайшов (за живою чергою)']
+    assert attendance_store.business_ordinals(store['point_date']).tolist() == [daily_sheets_sync.get_ordinal_date(datetime.date(2025, 10, 1))] * 2
+
+@pytest.mark.asyncio
+async def test_stats_frame_parsed_once_until_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'DAILY_SHEETS_CACHE_DIR', str(tmp_path))
+    stats_file = tmp_path / '_stats.csv'
+    stats_file.write_text('Аркуш,Дата прийому,Останній номер що зайшов\n01.10.2025,01.10.2025,2983\n', encoding='utf-8')
+    
+    with patch('daily_sheets_sync.pd.read_csv', wraps=pd.read_csv) as read_csv:
+        stats_df = await bot.get_stats_data()
+        assert await bot.get_stats_data() is stats_df
+        assert daily_sheets_sync.load_stats_frame(str(stats_file)) is stats_df
+        assert read_csv.call_count == 1
+        assert stats_df['Дата прийому'].iloc[0] == pd.Timestamp(2025, 10, 1)
+        assert stats_df['Останній номер що зайшов'].iloc[0] == 2983
+        
+        stats_file.write_text('Аркуш,Дата прийому,Останній номер що зайшов\n01.10.2025,01.10.2025,3050\n', encoding='utf-8')
+        os.utime(stats_file, ns=(stats_file.stat().st_atime_ns, stats_file.stat().st_mtime_ns + 1))
+        assert (await bot.get_stats_data())['Останній номер що зайшов'].iloc[0] == 3050
+        assert read_csv.call_count == 2
+
+def test_attendance_store_built_without_day_fragments(tmp_path, monkeypatch):
+    monkeypatch.setattr(daily_sheets_sync, 'DAILY_SHEETS_CACHE_DIR', str(tmp_path))
+    (tmp_path / '_stats.csv').write_text('Аркуш,Дата прийому\n', encoding='utf-8')
+    manifest_hashes = {'_stats.csv': 'a'}
+    
+    assert daily_sheets_sync.build_attendance_store(manifest_hashes)
+    (tmp_path / '_manifest.json').write_text(json.dumps(manifest_hashes), encoding='utf-8')
+    store = attendance_store.load_current_store(str(tmp_path))
+    assert len(store['point_date']) == 0 and len(store['row_status']) == 0
+    assert store['row_in_data'].dtype == np.bool_
+
+def test_attendance_store_reparses_only_changed_days(tmp_path, monkeypatch):
+    monkeypatch.setattr(daily_sheets_sync, 'DAILY_SHEETS_CACHE_DIR', str(tmp_path))
+    (tmp_path / '_stats.csv').write_text(
+        'Аркуш,Дата прийому\n01.10.2025,01.10.2025\n02.10.2025,02.10.2025\n', encoding='utf-8'
+    )
+    for day, status in (('01', 'Зайшов'), ('02', 'Зайшов')):
+        (tmp_path / f'2025-10-{day}.csv').write_text(
+            f'Заголовок\n,\n№,ID,Статус\n1,30{day},{status}\n', encoding='utf-8'
+        )
+    daily_sheets_sync.build_attendance_store({'2025-10-01.csv': 'a', '2025-10-02.csv': 'b'})
+    
+    (tmp_path / '2025-10-02.csv').write_text('Заголовок\n,\n№,ID,Статус\n1,3002,Не зайшов\n', encoding='utf-8')
+    with patch('daily_sheets_sync._day_rows', wraps=daily_sheets_sync._day_rows) as mock_rows:
+        daily_sheets_sync.build_attendance_store({'2025-10-01.csv': 'a', '2025-10-02.csv': 'c'})
+    
+    assert [c.args[0] for c in mock_rows.call_args_list] == [str(tmp_path / '2025-10-02.csv')]
+    (tmp_path / '_manifest.json').write_text(json.dumps({'2025-10-01.csv': 'a', '2025-10-02.csv': 'c'}), encoding='utf-8')
+    output = tmp_path / 'attendance_data.json'
+    assert daily_sheets_sync.generate_attendance_json(str(output))
+    assert json.loads(output.read_text(encoding='utf-8'))['attendance_points'] == [
+        {'date': '2025-10-01', 'id': '3001', 'is_live': False}
+    ]
+
+def test_compact_attendance_payload_written_with_compressed_variants(tmp_path):
+    points = [
+        {'date': '2025-10-01', 'id': '2983', 'is_live': False},
+        {'date': '2025-10-01', 'id': '3100/1', 'is_live': True},
+        {'date': '2025-10-02', 'id': '2990', 'is_live': False},
+    ]
+    compact_file = str(tmp_path / 'attendance_compact.json')
+    daily_sheets_sync._write_compact_attendance(compact_file, points)
+    
+    payload = json.loads((tmp_path / 'attendance_compact.json').read_text(encoding='utf-8'))
+    assert payload['dates'] == ['2025-10-01', '2025-10-02']
+    assert payload['ordinals'] == [daily_sheets_sync.get_ordinal_date(datetime.date(2025, 10, d)) for d in (1, 2)]
+    assert (payload['d'], payload['id_main'], payload['id_sub'], payload['live']) == ([0, 0, 1], [2983, 3100, 2990], [0, 1, 0], [1])
+    
+    import gzip
+    assert gzip.decompress((tmp_path / 'attendance_compact.json.gz').read_bytes()) == (tmp_path / 'attendance_compact.json').read_bytes()
+    # Повторний запис без змін не чіпає файли
+    mtime = os.stat(compact_file + '.gz').st_mtime_ns
+    daily_sheets_sync._write_compact_attendance(compact_file, points)
+    assert os.stat(compact_file + '.gz').st_mtime_ns == mtime
+
+def test_chart_overview_keeps_bucket_extremes_and_tiles_by_month(tmp_path):
+    points = [
+        {'date': '2025-10-01', 'id': '2983', 'is_live': False},
+        {'date': '2025-10-01', 'id': '2990', 'is_live': False},
+        {'date': '2025-10-01', 'id': '3000/1', 'is_live': False},
+        {'date': '2025-10-02', 'id': '3005', 'is_live': True},
+        {'date': '2025-11-03', 'id': '3100', 'is_live': False},
+    ]
+    overview = daily_sheets_sync.build_chart_overview(points, max_buckets=2)
+    # Інтервал 1: 01.10-02.10, інтервал 2: 03.11; середня точка 2990 відкидається
+    assert (overview['id_main'], overview['id_sub'], overview['live']) == ([2983, 3000, 3005, 3100], [0, 1, 0, 0], [2])
+
+    daily_sheets_sync._write_chart_tiles(str(tmp_path), points)
+    assert sorted(os.listdir(tmp_path)) == ['2025-10.json', '2025-11.json', 'overview.json']
+    october = json.loads((tmp_path / '2025-10.json').read_text(encoding='utf-8'))
+    assert october['total_points'] == 4
+    assert json.loads((tmp_path / 'overview.json').read_text(encoding='utf-8'))['tiles'] == ['2025-10', '2025-11']
+
+def test_prebooked_snapshot_written_from_sheet(tmp_path, monkeypatch):
+    monkeypatch.setattr(daily_sheets_sync, 'DAILY_SHEETS_CACHE_DIR', str(tmp_path))
+    (tmp_path / '2025-10-02.csv').write_text(
+        'Заголовок\n'
+        'Попередній прийом:,01.10.2025,,,,,Поточний прийом:,02.10.2025\n'
+        '№,ID,Статус,Примітки,,№,Примітки,ID,Статус\n'
+        '1,2983,Зайшов,,,1,,3001,\n'
+        '2,2984,Зайшов,,,2,,Жива черга,\n', encoding='utf-8')
+    service = MagicMock()
+    service.spreadsheets.return_value.get.return_value.execute.return_value = {
+        'sheets': [{'properties': {'sheetId': 1, 'title': 'Stats'}}, {'properties': {'sheetId': 42, 'title': 'TODO'}}]
+    }
+    service.spreadsheets.return_value.values.return_value.get.return_value.execute.return_value = {'values': [
+        ['Попередні записи'],
+        [],
+        ['ID', 'Дата', 'Примітки'],
+        ['3010', '03.10.2025'],
+        ['3005/1', '03.10.2025', 'перенесено'],
+        # Найраніша дата береться з усіх рядків з датою, як у fetchPreBookedLive
+        ['', '02.10.2025'],
+        ['3020', ''],
+    ]}
+    output_file = str(tmp_path / 'prebooked.json')
+
+    assert daily_sheets_sync.download_prebooked_snapshot(service, 'sheet', 42, output_file)
+
+    snapshot = json.loads(open(output_file, encoding='utf-8').read())
+    assert snapshot['records'] == [{'id': '3010', 'date': '2025-10-03'}, {'id': '3005/1', 'date': '2025-10-03'}]
+    assert snapshot['migrated'] == {'date': '2025-10-02', 'ids': ['3001']}
+    assert service.spreadsheets.return_value.values.return_value.get.call_args.kwargs['range'] == "'TODO'!A:Z"
+
+def test_manifest_skips_unchanged_csv_writes(tmp_path):
+    manifest = daily_sheets_sync.SheetManifest(str(tmp_path / '_manifest.json'))
+    csv_file = str(tmp_path / '2025-01-08.csv')
+    values = [['№', 'ID'], ['1', '1001']]
+    
+    assert daily_sheets_sync._write_sheet_csv(csv_file, values, manifest)
+    mtime = os.stat(csv_file).st_mtime_ns
+    manifest.save()
+    
+    reloaded = daily_sheets_sync.SheetManifest(str(tmp_path / '_manifest.json'))
+    assert not daily_sheets_sync._write_sheet_csv(csv_file, values, reloaded)
+    assert os.stat(csv_file).st_mtime_ns == mtime
+    assert not reloaded.changed
+    
+    assert daily_sheets_sync._write_sheet_csv(csv_file, values + [['2', '1002']], reloaded)
+    assert reloaded.changed == {'2025-01-08.csv'}
+
+def test_sheets_request_backs_off_on_rate_limit(monkeypatch):
+    clock = [0.0]
+    sleeps = []
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+    monkeypatch.setattr('time.monotonic', lambda: clock[0])
+    monkeypatch.setattr('time.sleep', fake_sleep)
+    resp = MagicMock(status=429)
+    resp.get.return_value = '7'
+    request = MagicMock()
+    request.execute.side_effect = [daily_sheets_sync.HttpError(resp, b''), {'values': [['1']]}]
+    bucket = daily_sheets_sync.TokenBucket(requests_per_minute=60)
+    
+    result = daily_sheets_sync._execute_sheets_request(lambda: request, bucket, 'test')
+    
+    assert result == {'values': [['1']]}
+    assert bucket.rate < bucket.max_rate
+    # Retry-After враховується: наступний acquire чекав ~7 секунд
+    assert sleeps and sleeps[0] == pytest.approx(7, abs=0.1)
+
+@pytest.mark.asyncio
+async def test_prediction_reads_snapshot_refreshed_in_background():
+    model = MagicMock()
+    model.predict.return_value = {'mean': datetime.date(2026, 1, 5), 'dist': {}, 'data_points': 10}
+    with patch('VLK_Zakrevskoho_81_BOT.daily_sheets_sync.sync_daily_sheets') as mock_sync, \
+         patch('VLK_Zakrevskoho_81_BOT.daily_sheets_sync.load_prediction_model', return_value=model), \
+         patch('VLK_Zakrevskoho_81_BOT.PREDICTION_MODEL', None):
+        await bot.refresh_prediction_data(None)
+        assert mock_sync.call_count == 1
+        assert bot.PREDICTION_MODEL is model
+        
+        # Обробники читають лише знімок - без синхронізації
+        prediction = bot.calculate_prediction(1234)
+        assert prediction['mean'] == datetime.date(2026, 1, 5)
+        model.predict.assert_called_once_with(1234)
+        assert mock_sync.call_count == 1
+
+@pytest.mark.asyncio
+async def test_run_sheets_call_returns_default_on_timeout():
+    import time
+    assert await bot.run_sheets_call(lambda: 42) == 42
+    assert await bot.run_sheets_call(time.sleep, 0.5, default=[], timeout=0.05) == []
+
+def test_queue_repository_indexes_and_incremental_refresh(sample_queue_df):
+    repo = bot.QueueRepository(bot.REQUIRED_COLUMNS)
+    repo.load(sample_queue_df)
+    assert repo.latest('100')['Статус'] == 'Ухвалено'
+    assert [r['ID'] for r in repo.records_for_tg_id(222)] == ['101']
+    
+    # Адміністратор змінив статус і додано новий запис для того ж ID
+    updated = sample_queue_df.copy()
+    updated.loc[1, 'Статус'] = 'Ухвалено'
+    updated.loc[2] = ['100', '05.01.2025', '', 'На розгляді', '02.01.2025 09:00:00', '01.01.2025', 111, 'user1', 'User One']
+    assert repo.apply_frame(updated) == 2
+    
+    assert repo.latest('101')['Статус'] == 'Ухвалено'
+    assert repo.latest('100')['Дата'] == '05.01.2025'
+    assert repo.latest('100', status='Ухвалено')['Дата'] == '01.01.2025'
+    assert len(repo.records_for_id('100')) == 2
+    assert sorted(r['ID'] for r in repo.latest_records()) == ['100', '101']
+    assert len(repo.frame) == 3
+
 # --- Тести обробників команд (асинхронні) ---
 
 @pytest.mark.asyncio
@@ -226,6 +628,120 @@ async def test_join_get_id_valid_no_stats(mock_update, mock_context):
             # Має показати клавіатуру з датами
             assert "Виберіть бажану дату запису" in mock_update.message.reply_text.call_args[0][0]
 
+@pytest.mark.asyncio
+async def test_check_id_for_queue_uses_pass_history_without_mutating_stats():
+    stats_df = pd.DataFrame({
+        'Дата прийому': pd.to_datetime(['01.12.2025', '02.12.2025', '03.12.2025', '04.12.2025', '05.12.2025'], dayfirst=True),
+        'Останній номер що зайшов': [1400.0, 1150.0, np.nan, 1300.0, 1250.0],
+    })
+    bot._pass_history_cache = None
+    
+    with patch('VLK_Zakrevskoho_81_BOT.get_stats_data', new_callable=AsyncMock, return_value=stats_df):
+        history = await bot.get_pass_history()
+        # Як і колишній зворотний cummax по аркушу
+        cum_max = stats_df['Останній номер що зайшов'][::-1].cummax()[::-1]
+        for user_id in (1100, 1249, 1250, 1350, 1400):
+            assert history.missed_days(user_id) == (cum_max > user_id).sum()
+        
+        assert await bot.check_id_for_queue(1400, '', '') == (True, "")
+        can_register, message = await bot.check_id_for_queue(1350, '', '')
+        assert can_register and "п.8" in message
+        can_register, message = await bot.check_id_for_queue(1100, '', '')
+        assert not can_register and "`4`" in message
+    
+    assert list(stats_df.columns) == ['Дата прийому', 'Останній номер що зайшов']
+
+@pytest.mark.asyncio
+async def test_broadcast_resumes_from_journal(tmp_path):
+    journal_file = str(tmp_path / 'broadcast_journal.json')
+    attempts = {}
+    
+    async def send_message(chat_id, **kwargs):
+        attempts[chat_id] = attempts.get(chat_id, 0) + 1
+        if chat_id == 'flood':
+            # Повтори RetryAfter вже вичерпав OutboundRateLimiter
+            raise telegram.error.RetryAfter(0)
+        if chat_id == 'blocked':
+            raise telegram.error.Forbidden("bot was blocked by the user")
+        if chat_id == 'slow':
+            # Таймаут відповіді: могло дійти - без повтору і без запису в журнал
+            raise telegram.error.TimedOut() from httpx.ReadTimeout("read")
+        if chat_id == 'connect' and attempts[chat_id] == 1:
+            # Запит не покидав процес - повторюється
+            raise telegram.error.TimedOut() from httpx.ConnectTimeout("connect")
+    
+    tg_bot = MagicMock()
+    tg_bot.send_message = AsyncMock(side_effect=send_message)
+    messages = [broadcast.OutboundMessage(key=chat, chat_id=chat, text='poll')
+                for chat in ('ok', 'flood', 'blocked', 'slow', 'connect')]
+    
+    with patch('broadcast.BROADCAST_BACKOFF_SECONDS', 0):
+        journal = broadcast.BroadcastJournal(journal_file)
+        result = await broadcast.broadcast(tg_bot, 'poll_01.12.2025', messages, journal)
+        assert (result.sent, result.skipped, result.failed, result.uncertain) == (2, 0, 2, 1)
+        assert attempts == {'ok': 1, 'flood': 1, 'blocked': 1, 'slow': 1, 'connect': 2}
+        
+        # Повторний запуск (наприклад після збою) не надсилає вже доставлені повідомлення
+        result = await broadcast.broadcast(tg_bot, 'poll_01.12.2025', messages, broadcast.BroadcastJournal(journal_file))
+        assert (result.sent, result.skipped, result.failed, result.uncertain) == (0, 2, 2, 1)
+        assert attempts == {'ok': 1, 'flood': 2, 'blocked': 2, 'slow': 2, 'connect': 2}
+
+@pytest.mark.asyncio
+async def test_concurrent_broadcasts_keep_each_others_progress(tmp_path):
+    journal_file = str(tmp_path / 'broadcast_journal.json')
+    
+    async def send_message(chat_id, **kwargs):
+        await asyncio.sleep(0)
+    
+    tg_bot = MagicMock()
+    tg_bot.send_message = AsyncMock(side_effect=send_message)
+    polls = [broadcast.OutboundMessage(key=f"p{i}", chat_id=f"p{i}", text='poll') for i in range(20)]
+    statuses = [broadcast.OutboundMessage(key=f"s{i}", chat_id=f"s{i}", text='status') for i in range(10)]
+    
+    # Як notify_status під час розсилки опитувань: обидві використовують спільний журнал процесу
+    with patch('broadcast.BROADCAST_JOURNAL_FILE', journal_file), patch.dict(broadcast._journals, clear=True):
+        await asyncio.gather(broadcast.broadcast(tg_bot, 'poll_01.12.2025', polls),
+                             broadcast.broadcast(tg_bot, 'status', statuses))
+        await broadcast.get_journal().discard('status')
+    
+    # Після перезапуску в журналі всі надіслані опитування
+    reloaded = broadcast.BroadcastJournal(journal_file)
+    assert reloaded.sent_keys('poll_01.12.2025') == {f"p{i}" for i in range(20)}
+    assert reloaded.sent_keys('status') == set()
+
+@pytest.mark.asyncio
+async def test_rate_limiter_serves_interactive_before_bulk():
+    limiter = broadcast.RateLimiter(messages_per_second=50, capacity=1)
+    order = []
+    
+    async def request(name, priority):
+        await limiter.acquire(name, priority)
+        order.append(name)
+    
+    # Перший токен забирає розсилка, далі в черзі чекають ще кілька масових запитів
+    await request('poll-0', broadcast.PRIORITY_POLL)
+    bulk = [asyncio.create_task(request(f'{kind}-{i}', priority)) for i in range(3)
+            for kind, priority in (('group', broadcast.PRIORITY_GROUP), ('reminder', broadcast.PRIORITY_REMINDER))]
+    await asyncio.sleep(0)
+    await request('reply', broadcast.PRIORITY_INTERACTIVE)
+    await asyncio.gather(*bulk)
+    
+    assert order[:2] == ['poll-0', 'reply']
+    assert order[2:5] == ['reminder-0', 'reminder-1', 'reminder-2']
+
+@pytest.mark.asyncio
+async def test_outbound_rate_limiter_retries_flood_control():
+    limiter = broadcast.OutboundRateLimiter(broadcast.RateLimiter(messages_per_second=1000, per_chat_interval=0), max_retries=2)
+    callback = AsyncMock(side_effect=[telegram.error.RetryAfter(0), telegram.error.RetryAfter(0), {'ok': True}])
+    
+    assert await limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': 1}, None) == {'ok': True}
+    assert callback.call_count == 3
+    
+    callback = AsyncMock(side_effect=telegram.error.RetryAfter(0))
+    with pytest.raises(telegram.error.RetryAfter):
+        await limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': 1}, broadcast.PRIORITY_POLL)
+    assert callback.call_count == 3
+
 @pytest.mark.asyncio
 async def test_join_get_date_invalid(mock_update, mock_context):
     mock_context.user_data = {'temp_id': '999'}
@@ -319,7 +835,7 @@ async def test_perform_queue_cleanup(sample_queue_df):
             df[col] = ''
             
     with patch('VLK_Zakrevskoho_81_BOT.load_queue_data', return_value=df):
-        with patch('VLK_Zakrevskoho_81_BOT.save_queue_data_full', return_value=True):
+        with patch('VLK_Zakrevskoho_81_BOT.delete_queue_rows', return_value=True) as mock_delete:
             # Логіка очищення:
             # Видаляє записи з датою < сьогодні
             # Видаляє відхилені записи, старіші за max_mod_idx для цього ID?
@@ -336,3 +852,58 @@ async def test_perform_queue_cleanup(sample_queue_df):
             assert removed >= 1
             assert len(bot.queue_df) < 3
             assert '2' in bot.queue_df['ID'].values # Майбутнє має бути там
+            # Видаляються лише окремі рядки, а не перезаписується весь аркуш
+            positions, expected_ids = mock_delete.call_args[0]
+            assert expected_ids == [df['ID'].iat[pos] for pos in positions]
+
+def test_delete_queue_rows_batches_descending_ranges():
+    service = MagicMock()
+    service.spreadsheets().values().get().execute.return_value = {
+        'values': [['ID'], ['1'], ['2'], ['3'], ['4'], ['5']]
+    }
+    service.spreadsheets().get().execute.return_value = {
+        'sheets': [{'properties': {'sheetId': 7, 'title': 'TODO'}}]
+    }
+    with patch('VLK_Zakrevskoho_81_BOT.SHEETS_SERVICE', service), \
+         patch('VLK_Zakrevskoho_81_BOT.get_sheets_service', return_value=service), \
+         patch('VLK_Zakrevskoho_81_BOT.SHEET_NAME', 'TODO'), \
+         patch('VLK_Zakrevskoho_81_BOT._queue_sheet_gid', None):
+        assert bot.delete_queue_rows([0, 1, 3], ['1', '2', '4']) is True
+        body = service.spreadsheets().batchUpdate.call_args.kwargs['body']
+        ranges = [(r['deleteDimension']['range']['startIndex'], r['deleteDimension']['range']['endIndex']) for r in body['requests']]
+        assert ranges == [(4, 5), (1, 3)]
+        assert all(r['deleteDimension']['range']['sheetId'] == 7 for r in body['requests'])
+        
+        # Рядки зсунулися - нічого не видаляємо
+        service.spreadsheets().batchUpdate.reset_mock()
+        assert bot.delete_queue_rows([0], ['5']) is False
+        service.spreadsheets().batchUpdate.assert_not_called()
+
+def test_active_status_updates_coalesced_into_one_batch(tmp_path):
+    journal_file = str(tmp_path / 'active_status_journal.json')
+    writer = bot.ActiveStatusWriter(journal_file)
+    with patch('VLK_Zakrevskoho_81_BOT.ACTIVE_STATUS_WRITER', writer):
+        bot.update_active_sheet_status('100', 'Підтвердив візит')
+        bot.update_active_sheet_status('101', 'Скасував')
+        bot.update_active_sheet_status('100', 'Відклав візит')
+        bot.update_active_sheet_status('999', 'Скасував')
+    
+    # Після перезапуску незаписані зміни відновлюються з журналу
+    writer = bot.ActiveStatusWriter(journal_file)
+    assert writer.pending() == {'100': 'Відклав візит', '101': 'Скасував', '999': 'Скасував'}
+    
+    service = MagicMock()
+    service.spreadsheets().values().get().execute.return_value = {'values': [['ID'], ['100'], [], ['101']]}
+    with patch('VLK_Zakrevskoho_81_BOT.SHEETS_SERVICE', service), \
+         patch('VLK_Zakrevskoho_81_BOT.get_sheets_service', return_value=service), \
+         patch('VLK_Zakrevskoho_81_BOT.ACTIVE_WORKSHEET_NAME', 'Active'):
+        assert writer.flush() is True
+    
+    service.spreadsheets().values().batchUpdate.assert_called_once()
+    body = service.spreadsheets().values().batchUpdate.call_args.kwargs['body']
+    assert body['data'] == [
+        {'range': 'Active!C2', 'values': [['Відклав візит']]},
+        {'range': 'Active!C4', 'values': [['Скасував']]},
+    ]
+    assert writer.pending() == {}
+    assert bot.ActiveStatusWriter(journal_file).pending() == {}